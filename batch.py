@@ -0,0 +1,225 @@
+# %%
+# 複数の反例ファイルをプロセスプールで並列に変換する
+import csv
+import glob
+import os
+import time
+from collections import Counter
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+# ワーカープロセス内で共有する引数(初期化時に一度だけ受け取る)
+_shared = {}
+
+
+# %%
+class BatchResult(NamedTuple):
+    """Result of converting one file in batch mode."""
+
+    input_file: str
+    output_file: str
+    ok: bool
+    error: str
+    elapsed: float
+
+
+def expand_inputs(
+    spec: str,
+    output_file: Optional[str] = None,
+    skip_exts: Iterable[str] = (),
+    skip_files: Iterable[str] = (),
+) -> List[str]:
+    """Expand a directory or a glob pattern into input files.
+
+    Outputs are written next to the inputs, so files with the extension of
+    `output_file` (outputs of an earlier run) are left out, as well as the
+    extensions in `skip_exts` and the paths in `skip_files`.
+
+    Args:
+        spec (str): Directory (all files directly under it) or glob pattern
+        output_file (Optional[str]): Output path given on the command line
+        skip_exts (Iterable[str]): Other extensions of generated files, e.g. ".md"
+        skip_files (Iterable[str]): Other files to leave out, e.g. the summary
+
+    Returns:
+        List[str]: Sorted list of input files
+    """
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in os.listdir(spec)]
+    else:
+        paths = glob.glob(spec, recursive=True)
+    exts = {e.lower() for e in skip_exts}
+    if output_file:
+        exts.add(os.path.splitext(output_file)[1].lower())
+    exts.discard("")
+    skipped = {os.path.abspath(p) for p in skip_files}
+    return sorted(
+        p
+        for p in paths
+        if os.path.isfile(p)
+        and os.path.splitext(p)[1].lower() not in exts
+        and os.path.abspath(p) not in skipped
+    )
+
+
+def derive_output(input_file: str, output_file: str) -> str:
+    """Derive the output path of an input file in batch mode.
+
+    The output is placed next to the input with the extension of
+    `output_file`, e.g. `trails/a.txt` and `variable_table.csv` give
+    `trails/a.csv`.
+
+    Args:
+        input_file (str): Path to the input file
+        output_file (str): Output path given on the command line
+
+    Returns:
+        str: Output path
+    """
+    stem, _ = os.path.splitext(input_file)
+    _, ext = os.path.splitext(output_file)
+    return stem + ext
+
+
+def derive_outputs(input_files: List[str], output_file: str) -> List[str]:
+    """Derive the output paths of all input files without collisions.
+
+    Inputs that would share an output (e.g. `b.log` and `b.txt`) keep their
+    own extension in the stem instead (`b.log.csv` and `b.txt.csv`).
+
+    Args:
+        input_files (List[str]): Files to convert
+        output_file (str): Output path given on the command line
+
+    Returns:
+        List[str]: Output paths in the same order as `input_files`
+
+    Raises:
+        ValueError: If an output would overwrite an input
+    """
+    outputs = [derive_output(f, output_file) for f in input_files]
+    counts = Counter(os.path.abspath(o) for o in outputs)
+    _, ext = os.path.splitext(output_file)
+    outputs = [
+        i + ext if counts[os.path.abspath(o)] > 1 else o
+        for i, o in zip(input_files, outputs)
+    ]
+    inputs = {os.path.abspath(f) for f in input_files}
+    for output in outputs:
+        if os.path.abspath(output) in inputs:
+            raise ValueError(f"output {output} would overwrite an input file")
+    return outputs
+
+
+# %%
+def _init_worker(shared: dict):
+    global _shared
+    _shared = shared
+
+
+def _run_task(task: Callable, input_file: str, output_file: str) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        task(input_file, output_file, **_shared)
+    except Exception as e:
+        return BatchResult(
+            input_file,
+            output_file,
+            False,
+            f"{type(e).__name__}: {e}",
+            time.perf_counter() - start,
+        )
+    return BatchResult(input_file, output_file, True, "", time.perf_counter() - start)
+
+
+def run_batch(
+    task: Callable,
+    input_files: List[str],
+    output_file: str,
+    jobs: Optional[int] = None,
+    **shared,
+) -> List[BatchResult]:
+    """Convert files in parallel across processes.
+
+    `task(input_file, output_file, **shared)` is called for each file in a
+    worker process. `shared` is sent to each worker only once, so large values
+    such as initial variables from a .pml file are not pickled per file.
+
+    Args:
+        task (Callable): Module-level conversion function
+        input_files (List[str]): Files to convert
+        output_file (str): Output path given on the command line, used to
+            derive the output extension
+        jobs (Optional[int]): Number of worker processes. Defaults to the
+            number of CPUs
+        **shared: Keyword arguments passed to every call of `task`
+
+    Returns:
+        List[BatchResult]: Results in the same order as `input_files`
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    outputs = derive_outputs(input_files, output_file)
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(shared,)
+    ) as executor:
+        futures = [
+            executor.submit(_run_task, task, i, o)
+            for i, o in zip(input_files, outputs)
+        ]
+        return [f.result() for f in futures]
+
+
+# %%
+def write_summary(results: List[BatchResult], summary_file: str):
+    """Write the per-file results of a batch run as CSV.
+
+    Args:
+        results (List[BatchResult]): Results of `run_batch`
+        summary_file (str): Path to the summary CSV file
+    """
+    with open(summary_file, "w", newline="") as out:
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(BatchResult._fields)
+        for result in results:
+            writer.writerow([*result[:-1], f"{result.elapsed:.3f}"])
+
+
+def print_summary(results: List[BatchResult]):
+    """Print the per-file results and totals of a batch run.
+
+    Args:
+        results (List[BatchResult]): Results of `run_batch`
+    """
+    for result in results:
+        status = "OK" if result.ok else "NG"
+        line = f"[{status}] {result.input_file} -> {result.output_file} ({result.elapsed:.3f}s)"
+        if not result.ok:
+            line += f": {result.error}"
+        print(line)
+    failed = sum(1 for r in results if not r.ok)
+    print(f"{len(results) - failed} succeeded, {failed} failed")
+
+
+def add_batch_arguments(parser):
+    """Add the batch mode options to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument(
+        "--batch",
+        help="Directory or glob pattern of counter example files to convert in parallel. Outputs are written next to the inputs.",
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes in batch mode. Defaults to the number of CPUs.",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--summary",
+        help="Path to save the per-file summary of batch mode.",
+        default="batch_summary.csv",
+    )
@@ -0,0 +1,399 @@
+# %%
+# 合成したSPIN・NuSMVの反例で、変換の各段階の処理時間とメモリ使用量を計測する
+# 乱数のシードを固定して反例を生成するため、同じ引数であれば毎回同じ反例になる
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, NamedTuple, Optional
+
+# %%
+SPIN_FILE = "model.pml"
+NEVER_CLAIM = "\tproc  - (spec1:1) _spin_nvr.tmp:4 (state 4)\t[(1)]"
+MTYPES = ["ready", "stop", "sending", "idle"]
+
+
+def _spin_action(rng: random.Random, globals_: int, channels: int) -> str:
+    # 代入(定数・mtype・他の変数からの計算)、チャネルの送受信、条件式をおおよそ半々で生成する
+    # 偶数番目の変数は整数、奇数番目の変数はmtypeの値をもつ
+    kind = rng.random()
+    ints = range(0, globals_, 2)
+    symbols = range(1, globals_, 2)
+    if ints and kind < 0.2:
+        return f"g{rng.choice(ints)} = {rng.randrange(100)}"
+    if symbols and kind < 0.35:
+        return f"g{rng.choice(symbols)} = {rng.choice(MTYPES)}"
+    if ints and kind < 0.5:
+        return f"g{rng.choice(ints)} = g{rng.choice(ints)} + {rng.randrange(1, 5)}"
+    if channels and kind < 0.75:
+        ch = f"ch{rng.randrange(channels)}"
+        op = "!" if rng.random() < 0.5 else "?"
+        return f"{ch}{op}{rng.choice(MTYPES)}"
+    return f"((g{rng.choice(ints) if ints else 0}>{rng.randrange(10)}))"
+
+
+def generate_spin_trace(
+    processes: int = 3,
+    steps: int = 1000,
+    channels: int = 2,
+    globals_: int = 4,
+    cycle_length: int = 0,
+    seed: int = 0,
+) -> str:
+    """Generate a SPIN `spin -t -p` counter example.
+
+    Args:
+        processes (int): Number of processes started by :init:
+        steps (int): Number of steps
+        channels (int): Number of channels used by send/receive actions
+        globals_ (int): Number of global variables `g0`, `g1`, ... (even
+            ones hold integers, odd ones mtype values)
+        cycle_length (int): Length of the block repeated after
+            `<<<<<START OF CYCLE>>>>>`, or 0 for a trace without a cycle
+        seed (int): Seed of the random generator
+
+    Returns:
+        str: Counter example
+    """
+    rng = random.Random(seed)
+    names = [f"P{pid}" for pid in range(1, processes + 1)]
+
+    def step_line(step: int, pid: int) -> str:
+        line = rng.randrange(10, 200)
+        action = _spin_action(rng, globals_, channels)
+        return (
+            f"{step:>3}:\tproc  {pid} ({names[pid - 1]}:1) {SPIN_FILE}:{line} "
+            f"(state {line - 9})\t[{action}]"
+        )
+
+    out = ["starting claim 2"]
+    step = 1
+    for pid, name in enumerate(names, 1):
+        out.append(f"Starting {name} with pid {pid}")
+        out.append(
+            f"{step:>3}:\tproc  0 (:init::1) {SPIN_FILE}:{90 + pid} (state {pid})\t[(run {name}())]"
+        )
+        step += 1
+
+    cycle_start = steps - 2 * cycle_length if cycle_length else steps
+    body = []
+    while step <= cycle_start:
+        # 2stepごとにnever claimのstepを挟む
+        if step % 2:
+            body.append(f"{step:>3}:{NEVER_CLAIM}")
+        else:
+            body.append(step_line(step, rng.randrange(1, processes + 1)))
+        step += 1
+    out.extend(body)
+
+    if cycle_length:
+        out.append("  <<<<<START OF CYCLE>>>>>")
+        # サイクルの中の同じstepの並びを繰り返す
+        block = [
+            (rng.randrange(1, processes + 1), rng.getstate()) for _ in range(cycle_length)
+        ]
+        while step <= steps:
+            for pid, state in block:
+                if step > steps:
+                    break
+                rng.setstate(state)
+                out.append(step_line(step, pid))
+                step += 1
+
+    out.append("spin: trail ends after {} steps".format(steps))
+    out.append(f"#processes: {processes + 1}")
+    out.append(f"{processes + 1} processes created")
+    return "\n".join(out) + "\n"
+
+
+def generate_smv_trace(
+    variables: int = 10,
+    states: int = 100,
+    specs: int = 1,
+    cycle_length: int = 0,
+    modules: int = 2,
+    seed: int = 0,
+) -> str:
+    """Generate a NuSMV counter example with one trace per specification.
+
+    Args:
+        variables (int): Number of variables, spread over the modules
+        states (int): Number of states of each trace
+        specs (int): Number of false specifications
+        cycle_length (int): Number of states after "-- Loop starts here",
+            or 0 for traces without a loop
+        modules (int): Number of submodules (variables `m0.v1`, ...); the
+            other variables belong to main
+        seed (int): Seed of the random generator
+
+    Returns:
+        str: Counter example
+    """
+    rng = random.Random(seed)
+    names = [
+        f"m{i % (modules + 1) - 1}.v{i}" if i % (modules + 1) else f"v{i}"
+        for i in range(variables)
+    ]
+
+    def value(i: int) -> str:
+        # 変数ごとに真偽値・整数・シンボルのどれかに固定する
+        kind = i % 3
+        if kind == 0:
+            return rng.choice(["TRUE", "FALSE"])
+        if kind == 1:
+            return str(rng.randrange(100))
+        return rng.choice(["Idle", "Busy", "Done"])
+
+    out = ["*** This is NuSMV 2.7.0 (synthetic)", ""]
+    for example in range(1, specs + 1):
+        out.append(f"-- specification AG !(v0 & v{example % max(variables, 1)})  is false")
+        out.append("-- as demonstrated by the following execution sequence")
+        out.append("Trace Description: CTL Counterexample")
+        out.append("Trace Type: Counterexample")
+        for state in range(1, states + 1):
+            if cycle_length and state == states - cycle_length + 1:
+                out.append("  -- Loop starts here")
+            out.append(f"  -> State: {example}.{state} <-")
+            if state == 1:
+                changed = range(variables)
+            else:
+                changed = sorted(rng.sample(range(variables), max(1, variables // 4)))
+            out.extend(f"    {names[i]} = {value(i)}" for i in changed)
+    return "\n".join(out) + "\n"
+
+
+# %%
+class StageResult(NamedTuple):
+    """Time and memory of one stage."""
+
+    trace: str
+    stage: str
+    items: int  # 処理した行・step・変数などの数
+    seconds_min: float
+    seconds_median: float
+    peak_bytes: int
+
+
+def measure(
+    trace: str, stage: str, func: Callable[[], int], repeat: int = 5
+) -> StageResult:
+    """Time a stage `repeat` times, then measure its peak memory once.
+
+    tracemalloc slows down the code it traces, so the memory is measured in a
+    separate run that is not included in the times.
+
+    Args:
+        trace (str): Name of the input, e.g. "spin"
+        stage (str): Name of the stage
+        func (Callable[[], int]): Runs the stage and returns the number of items
+        repeat (int): Number of timed runs
+
+    Returns:
+        StageResult: Result of the stage
+    """
+    times = []
+    items = 0
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        items = func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return StageResult(trace, stage, items, min(times), statistics.median(times), peak)
+
+
+def bench_spin(text: str, globals_: int, repeat: int) -> List[StageResult]:
+    """Measure the stages of converting a SPIN counter example."""
+    from ce2seq import convert_to_plantuml_code
+    from ce2table import apply_action, build_dataframe, smart_exec
+    from plantuml_encoding import encode_plantuml
+    from spin_parser import is_assignment, parse_steps, parse_trace
+
+    lines = text.splitlines()
+    initial = {f"g{i}": 0 if i % 2 == 0 else MTYPES[0] for i in range(globals_)}
+    actions = [s.action for s in parse_steps(lines) if is_assignment(s.action)]
+    df = build_dataframe(lines, dict(initial))
+    code = convert_to_plantuml_code(text, False)
+
+    def run_exec(execute) -> int:
+        env = dict(initial)
+        for action in actions:
+            execute(action, env)
+        return len(actions)
+
+    def run_csv() -> int:
+        df.to_csv(io.StringIO(), index=False)
+        return len(df)
+
+    return [
+        measure("spin", "parse", lambda: sum(1 for _ in parse_trace(lines)), repeat),
+        measure("spin", "apply_action", lambda: run_exec(apply_action), repeat),
+        measure("spin", "smart_exec", lambda: run_exec(smart_exec), repeat),
+        measure(
+            "spin", "dataframe", lambda: len(build_dataframe(lines, dict(initial))), repeat
+        ),
+        measure("spin", "csv", run_csv, repeat),
+        measure(
+            "spin",
+            "plantuml",
+            lambda: len(convert_to_plantuml_code(text, False)),
+            repeat,
+        ),
+        measure("spin", "encode", lambda: len(encode_plantuml(code)), repeat),
+    ]
+
+
+def bench_smv(text: str, repeat: int) -> List[StageResult]:
+    """Measure the stages of converting a NuSMV counter example."""
+    from ce2seq import convert_to_plantuml_code
+    from ce2table_smv import build_dataframe
+    from plantuml_encoding import encode_plantuml
+    from smv_parser import iter_states
+
+    lines = text.splitlines()
+    df = build_dataframe(lines, {})
+    code = convert_to_plantuml_code(text, False)
+
+    def run_csv() -> int:
+        df.to_csv(io.StringIO(), index=False)
+        return len(df)
+
+    return [
+        measure("smv", "parse", lambda: sum(1 for _ in iter_states(lines, {})), repeat),
+        measure("smv", "dataframe", lambda: len(build_dataframe(lines, {})), repeat),
+        measure("smv", "csv", run_csv, repeat),
+        measure(
+            "smv", "plantuml", lambda: len(convert_to_plantuml_code(text, False)), repeat
+        ),
+        measure("smv", "encode", lambda: len(encode_plantuml(code)), repeat),
+    ]
+
+
+def find_regressions(
+    results: List[dict], baseline: dict, max_slowdown: float
+) -> List[str]:
+    """Compare median times with a previous result file.
+
+    Args:
+        results (List[dict]): Stage results of this run
+        baseline (dict): Contents of a previous JSON result
+        max_slowdown (float): Allowed ratio of the median times, e.g. 1.25
+
+    Returns:
+        List[str]: Description of each stage slower than allowed
+    """
+    previous = {(r["trace"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = previous.get((r["trace"], r["stage"]))
+        if not old or not old["seconds_median"]:
+            continue
+        ratio = r["seconds_median"] / old["seconds_median"]
+        if ratio > max_slowdown:
+            regressions.append(
+                f"{r['trace']}/{r['stage']}: {old['seconds_median'] * 1e3:.2f} ms"
+                f" -> {r['seconds_median'] * 1e3:.2f} ms (x{ratio:.2f})"
+            )
+    return regressions
+
+
+# %%
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark each conversion stage on synthetic SPIN and NuSMV counter examples."
+    )
+    parser.add_argument("--processes", type=int, default=3, help="SPIN processes.")
+    parser.add_argument("--steps", type=int, default=20000, help="SPIN steps.")
+    parser.add_argument("--channels", type=int, default=2, help="SPIN channels.")
+    parser.add_argument("--globals", type=int, default=8, help="SPIN global variables.")
+    parser.add_argument(
+        "--cycle-length",
+        type=int,
+        default=10,
+        help="Steps repeated in the SPIN cycle, and states after the NuSMV loop start (0 for none).",
+    )
+    parser.add_argument("--variables", type=int, default=20, help="NuSMV variables.")
+    parser.add_argument("--states", type=int, default=2000, help="NuSMV states per spec.")
+    parser.add_argument("--specs", type=int, default=3, help="NuSMV specifications.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generators.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage.")
+    parser.add_argument(
+        "--only", choices=["spin", "smv"], default=None, help="Run only one kind of trace."
+    )
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        help="Path to save the results as JSON. If not provided, they are printed.",
+        default=None,
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Previous JSON result to compare with. Exits with 1 if a stage got slower.",
+        default=None,
+    )
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=1.25,
+        help="Allowed ratio of the median time to the baseline.",
+    )
+    args = parser.parse_args(argv)
+
+    params = {k: v for k, v in vars(args).items() if k not in ("output_file", "baseline")}
+    results = []
+    if args.only != "smv":
+        text = generate_spin_trace(
+            args.processes,
+            args.steps,
+            args.channels,
+            args.globals,
+            args.cycle_length,
+            args.seed,
+        )
+        results += bench_spin(text, args.globals, args.repeat)
+    if args.only != "spin":
+        text = generate_smv_trace(
+            args.variables, args.states, args.specs, args.cycle_length, seed=args.seed
+        )
+        results += bench_smv(text, args.repeat)
+
+    for r in results:
+        print(
+            f"{r.trace:5s} {r.stage:13s} {r.items:8d} items"
+            f" {r.seconds_median * 1e3:9.2f} ms {r.peak_bytes / 2**20:8.2f} MiB",
+            file=sys.stderr,
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": [r._asdict() for r in results],
+    }
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report["results"], json.load(f), args.max_slowdown)
+        for line in regressions:
+            print(f"slower: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# %%
+# 反例の変換をPythonから呼び出すためのAPIと、各スクリプトをまとめたコマンド
+# pandas・requestsなどは実際に使う関数の中でだけ読み込み、起動を速くする
+import argparse
+import importlib
+import sys
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from trace_reduction import ReductionRules
+
+# サブコマンドと、その処理を実装するスクリプト
+COMMANDS = {
+    "seq": "ce2seq",
+    "table": "ce2table",
+    "smv": "ce2table_smv",
+    "index": "trace_index",
+    "state": "trace_state",
+}
+
+
+# %%
+def to_plantuml(
+    counter_example: str,
+    short_sequence: bool = False,
+    rules: Optional["ReductionRules"] = None,
+) -> str:
+    """Convert a SPIN or NuSMV counter example to PlantUML code.
+
+    Args:
+        counter_example (str): Counter example output from SPIN or NuSMV
+        short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Returns:
+        str: PlantUML code
+    """
+    from ce2seq import convert_to_plantuml_code
+
+    return convert_to_plantuml_code(counter_example, short_sequence, rules)
+
+
+def render(
+    plantuml_code: str,
+    output_file: str,
+    cache_dir: Optional[str] = None,
+    **renderer_options,
+):
+    """Render PlantUML code and save the image.
+
+    Args:
+        plantuml_code (str): PlantUML code, e.g. from `to_plantuml`
+        output_file (str): Path to save the image
+        cache_dir (Optional[str]): Directory of the render cache, or None to disable it
+        **renderer_options: Keyword arguments of `ce2seq.create_renderer`
+            (renderer, plantuml_jar, timeout, retries, server, pool_size)
+
+    Raises:
+        RenderError: If the image could not be rendered
+    """
+    from ce2seq import create_renderer, render_to_file
+    from render_cache import RenderCache
+
+    cache = RenderCache(cache_dir) if cache_dir else None
+    with create_renderer(**renderer_options) as renderer:
+        render_to_file(plantuml_code, output_file, renderer, cache)
+
+
+def spin_table(counter_example: str, pml_file: Optional[str] = None) -> "pd.DataFrame":
+    """Convert a SPIN counter example to a variable table.
+
+    Args:
+        counter_example (str): Counter example output from SPIN
+        pml_file (Optional[str]): Promela file to read the initial values from
+
+    Returns:
+        pd.DataFrame: Variable table
+    """
+    from ce2table import convert_to_dataframe, initialize_globals_from_pml
+
+    variables = initialize_globals_from_pml(pml_file) if pml_file else {}
+    return convert_to_dataframe(counter_example, variables)
+
+
+def smv_table(counter_example: str) -> "pd.DataFrame":
+    """Convert a NuSMV counter example to a variable table.
+
+    Args:
+        counter_example (str): Counter example output from NuSMV
+
+    Returns:
+        pd.DataFrame: Variable table
+    """
+    from ce2table_smv import convert_to_dataframe
+
+    return convert_to_dataframe(counter_example, {})
+
+
+# %%
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Convert SPIN or NuSMV counter examples to sequence diagrams or variable tables.",
+        epilog="Run 'ce2.py COMMAND -h' for the options of each command.",
+    )
+    parser.add_argument(
+        "command",
+        help="seq: sequence diagram (ce2seq.py), table: SPIN variable table (ce2table.py), "
+        "smv: NuSMV variable table (ce2table_smv.py), index: step index (trace_index.py), "
+        "state: variable values at any step (trace_state.py)",
+        choices=COMMANDS,
+    )
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # 選ばれたスクリプトだけを読み込み、残りの引数をそのまま渡す
+    module = importlib.import_module(COMMANDS[args.command])
+    sys.argv[0] = f"{parser.prog} {args.command}"
+    module.main(args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,50 @@
 # %%
 # SPINの反例からシーケンス図を生成する
-import zlib
+import io
+import os
 import re
-import requests
+import sys
+import tempfile
 import argparse
+from contextlib import contextmanager
+from itertools import chain
+from typing import Iterable, Iterator, List, NamedTuple, Optional, TextIO, Union
+
+import batch
+import profiling
+from plantuml_encoding import encode64, encode_plantuml
+from smv_parser import (
+    SPEC_PATTERN,
+    STATE_PATTERN,
+    ExampleStart,
+    StateChange,
+    iter_state_changes,
+)
+from spin_parser import CYCLE_START, STEP_PATTERN, Step, parse_trace, split_channel
+from render_cache import DEFAULT_CACHE_DIR, RenderCache, cache_key
+from renderers import (
+    DEFAULT_SERVER,
+    HttpRenderer,
+    PipeRenderer,
+    Renderer,
+    RenderError,
+    RenderResult,
+)
+from trace_index import add_window_arguments, read_window
+from trace_io import (
+    DEFAULT_FOLLOW_TIMEOUT,
+    add_follow_arguments,
+    follow_input,
+    open_input,
+    stdin_is_piped,
+)
+from trace_reduction import (
+    REPEAT_END,
+    Collapsed,
+    ReductionRules,
+    RepeatStart,
+    add_reduction_arguments,
+)
 
 # %%
 COUNTEREXAMPLE = """
@@ -49,8 +90,25 @@ Exit-Status 0
 
 """
 
-# PlantUMLサーバのURLを設定
-SERVER = "https://www.plantuml.com/plantuml/png/"
+# PlantUMLサーバのURLの既定値(--serverで変更できる)
+SERVER = DEFAULT_SERVER
+
+# --renderer local で同時に描画するplantuml.jarのプロセス数の既定値(必要になるまで起動しない)
+POOL_SIZE = 4
+
+# PlantUMLコードの先頭と末尾
+PLANTUML_HEADER = """
+@startuml
+scale 2.0
+"""
+PLANTUML_FOOTER = "@enduml\n"
+
+CYCLE_BLOCK = "loop CYCLE\n"
+
+# ページ分割の区切り
+PAGE_BREAKS = ("cycle", "process")
+# プロセスの区切りを待つ場合も、1ページはpage_sizeのこの倍数までにする
+PROCESS_BREAK_SLACK = 2
 
 # 式の読み飛ばしルールを定義
 SKIP_RULES = [
@@ -58,24 +116,6 @@ SKIP_RULES = [
     # "(1)",  # 評価結果や「値を更新しない」という情報なので読み飛ばさない
 ]
 
-# %%
-pattern = r"""
-    ^\s*           # 行頭の空白
-    (\d+)          # step番号
-    :\s*proc\s*    # プロセス
-    (\d+)\s*       # プロセス番号
-    \(
-        ([^)]+)    # プロセス名
-    \)\s+
-    ([^\s]+:\d+)   # ファイル名と行番号
-    \s*\(state\s*\d+\)\s*  # SPINの内部状態を読み飛ばす
-    \[
-        (.+?)      # 処理
-    \]
-    \s*$           # 行末の空白
-"""
-
-
 # %%
 def determine_skip(action: str) -> bool:
     """Determine if the action should be skipped based on predefined rules.
@@ -92,49 +132,64 @@ def determine_skip(action: str) -> bool:
     return False
 
 
-## PlantUMLサーバ向けのエンコード関数
-def encode_plantuml(text: str) -> str:
-    """Encode text to PlantUML server format.
+def format_participants(participants) -> str:
+    """Format participants as PlantUML code.
+
+    Args:
+        participants (Iterable[str]): Process names
+
+    Returns:
+        str: PlantUML participants code
+    """
+    # プロセス名をアルファベット順にソート
+    return "".join(f'participant "{p}"\n' for p in sorted(participants))
+
+
+def parse_events(lines: Iterable[str]) -> Iterator[object]:
+    """Parse a SPIN or a NuSMV counter example into diagram events.
+
+    The checker is detected from the first SPIN step line, or NuSMV state
+    or specification line, so the input is still read only once.
 
     Args:
-        text (str): Text to encode
+        lines (Iterable[str]): Lines of the counter example
 
     Returns:
-        str: Encoded text
+        Iterator[object]: Events of `spin_parser.parse_trace` or
+            `smv_parser.iter_state_changes`
     """
-    # UTF-8にエンコードし、zlibでdeflate圧縮
-    data = text.encode("utf-8")
-    compressed = zlib.compress(data)
-    # zlibヘッダー(最初の2バイト)とチェックサム(最後の4バイト)を除去
-    compressed = compressed[2:-4]
-    return encode64(compressed)
+    lines = iter(lines)
+    head = []
+    parse = parse_trace
+    for line in lines:
+        head.append(line)
+        if STEP_PATTERN.match(line):
+            break
+        if STATE_PATTERN.match(line) or SPEC_PATTERN.match(line):
+            parse = iter_state_changes
+            break
+    return parse(chain(head, lines))
 
 
-def encode64(data: bytes) -> str:
-    """Encode bytes to PlantUML server format.
+def collect_participants(
+    lines: Iterable[str], rules: Optional[ReductionRules] = None
+) -> set:
+    """Collect unique process names from the counter example.
 
     Args:
-        data (bytes): Data to encode
+        lines (Iterable[str]): Lines of the counter example
+        rules (Optional[ReductionRules]): Processes dropped by the rules are left out
 
     Returns:
-        str: Encoded text
+        set: Process names
     """
-    # PlantUML用のカスタム64エンコードテーブル
-    char_map = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
-    res = []
-    # 3バイトずつ処理し、24ビット整数にまとめる
-    for i in range(0, len(data), 3):
-        b = data[i : i + 3]
-        # 3バイトに満たない場合は0でパディング
-        if len(b) < 3:
-            b = b + bytes(3 - len(b))
-        n = (b[0] << 16) + (b[1] << 8) + b[2]
-        # 6ビットごとに分割して、char_mapの文字に変換
-        res.append(char_map[(n >> 18) & 0x3F])
-        res.append(char_map[(n >> 12) & 0x3F])
-        res.append(char_map[(n >> 6) & 0x3F])
-        res.append(char_map[n & 0x3F])
-    return "".join(res)
+    participants = set()
+    for event in parse_events(lines):
+        if type(event) is Step or type(event) is StateChange:
+            participants.add(event.process)
+    if rules:
+        participants = {p for p in participants if not rules.drops_process(p)}
+    return participants
 
 
 def get_participants(counter_example: str) -> str:
@@ -146,98 +201,702 @@ def get_participants(counter_example: str) -> str:
     Returns:
         str: PlantUML participants code
     """
-    participants = set()
-    for line in counter_example.splitlines():
-        line = line.strip()
-        m = re.match(pattern, line, re.VERBOSE)
-        if m:
-            _, process_id, process_name, _, _ = m.groups()
-            process_name = process_id + ":" + process_name
-            participants.add(process_name)
-    # プロセス名をアルファベット順にソート
-    participants = sorted(participants)
+    return format_participants(collect_participants(counter_example.splitlines()))
+
+
+def step_to_plantuml(step: Union[Step, StateChange, Collapsed]) -> str:
+    """Convert a single step to a PlantUML message line.
+
+    Args:
+        step (Union[Step, StateChange, Collapsed]): Parsed step, a variable
+            changed in a NuSMV state, or a run of identical self-messages
+            shown as one message with "×N"
+
+    Returns:
+        str: PlantUML code
+    """
+    if type(step) is Collapsed:
+        label = f"s.{step.step_num}-s.{step.last_step_num}"
+        repeat = f" ×{step.count}"
+        step = step.step
+    else:
+        label = f"s.{step.step_num}"
+        repeat = ""
 
-    # PlantUMLのparticipantsとして出力
-    ret = ""
-    for participant in participants:
-        ret += f'participant "{participant}"\n'
+    if type(step) is StateChange:
+        # NuSMVは変化した変数ごとにモジュールの自己メッセージにする(s.反例番号.State番号)
+        return f'"{step.process}" -> "{step.process}" : {label}: {step.action}{repeat}\n'
 
-    return ret
+    # 通常はsource, destinationは自プロセス
+    source = step.process
+    destination = step.process
+    arrow = "->"
+    action = step.action
 
+    # actionがchへの書き込み・読み込み場合はsourceとdestinationを分ける
+    channel_op = split_channel(action)
+    if channel_op:
+        op, channel, action = channel_op
+        if op == "!":
+            # 書き込みの場合
+            destination = channel
+        else:
+            # 読み込みの場合
+            source = channel
+            arrow = "-->"
 
-def convert_to_plantuml_code(counter_example: str, short_sequence: bool) -> str:
-    """Convert a single step to PlantUML code.
+    return f'"{source}" {arrow} "{destination}" : {label}: {step.line_num}: {action}{repeat}\n'
+
+
+def example_divider(example: ExampleStart) -> str:
+    """Get the PlantUML divider put before each NuSMV counter example."""
+    return f"== {example.number}: {example.spec} ==\n"
+
+
+def repeat_block(repeat: RepeatStart) -> str:
+    """Get the PlantUML loop header of a compressed cycle iteration."""
+    return f"loop ×{repeat.count} (s.{repeat.first_step_num}-s.{repeat.last_step_num})\n"
+
+
+def sequence_rules(
+    short_sequence: bool, rules: Optional[ReductionRules] = None
+) -> ReductionRules:
+    """Combine the reduction rules with `SKIP_RULES` for the short sequence.
 
     Args:
-        counter_example (str): Counter example output from SPIN
         short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Reduction rules from the options
 
     Returns:
-        str: PlantUML code
+        ReductionRules: Rules to apply to the trace
     """
-    ret = ""
+    rules = rules or ReductionRules()
+    if short_sequence:
+        rules = rules.extend(re.escape(rule) for rule in SKIP_RULES)
+    return rules
+
 
-    # 反例の出現順に列が並ぶと毎回変わってしまうので、一度読み込んで辞書順に並べる
-    ret += get_participants(counter_example)
+def reduced_events(
+    lines: Iterable[str],
+    short_sequence: bool,
+    participants: Optional[set] = None,
+    rules: Optional[ReductionRules] = None,
+) -> Iterator[object]:
+    """Parse a counter example and apply the reduction rules.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        short_sequence (bool): Flag to skip evaluation logs
+        participants (Optional[set]): If given, process names are added to it
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
 
+    Returns:
+        Iterator[object]: Events to draw
+    """
+    # --profileの指定時は読み込んだ行・解析したイベント・出力するイベントを数える
+    events = parse_events(profiling.counted(lines, "lines_read"))
+    events = sequence_rules(short_sequence, rules).apply(
+        profiling.counted(events, "events_parsed"), participants
+    )
+    return profiling.counted(events, "events_emitted")
+
+
+def iter_sequence(
+    lines: Iterable[str],
+    short_sequence: bool,
+    participants: Optional[set] = None,
+    rules: Optional[ReductionRules] = None,
+) -> Iterator[str]:
+    """Yield PlantUML message lines while scanning the counter example.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        short_sequence (bool): Flag to skip evaluation logs
+        participants (Optional[set]): If given, process names are added to it
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Yields:
+        str: PlantUML code for each message
+    """
     loop = False
-    for line in counter_example.splitlines():
-        line = line.strip()
-        m = re.match(pattern, line, re.VERBOSE)
-        if m:
-            step_num, process_id, process_name, file_line, action = m.groups()
-            process_name = process_id + ":" + process_name
-            if short_sequence and determine_skip(action):
-                # 評価ログをスキップ
-                continue
-        elif "<<<<<START OF CYCLE>>>>>" in line:
+    # 評価ログのスキップなどの間引きは1回の走査でまとめて行う
+    events = reduced_events(lines, short_sequence, participants, rules)
+    for event in events:
+        if event is CYCLE_START:
             # ループの開始を検出
-            ret += "loop CYCLE\n"
+            yield CYCLE_BLOCK
             loop = True
             continue
-        else:
+        if type(event) is ExampleStart:
+            # NuSMVの反例の区切り(前の反例のループはここで閉じる)
+            if loop:
+                yield "end\n"
+                loop = False
+            yield example_divider(event)
+            continue
+        if type(event) is RepeatStart:
+            # 繰り返されるサイクルは1回分だけを回数付きのloopで出力
+            yield repeat_block(event)
             continue
+        if event is REPEAT_END:
+            yield "end\n"
+            continue
+        yield step_to_plantuml(event)
+
+    if loop:
+        yield "end\n"
 
-        # Promelaの行番号を取得
-        line_num = "l." + file_line.split(":")[-1]
 
-        # 通常はsource, destinationは自プロセス
-        source = process_name
-        destination = process_name
-        arrow = "->"
+def iter_plantuml_code(
+    stream: TextIO, short_sequence: bool, rules: Optional[ReductionRules] = None
+) -> Iterator[str]:
+    """Convert a counter example stream to PlantUML code line by line.
 
-        # actionがchへの書き込み・読み込み場合はsourceとdestinationを分ける
-        ch_write_pattern = r"^[^()!]+![^()!]+$"
-        ch_write_match = re.match(ch_write_pattern, action)
-        ch_read_pattern = r"^[A-Za-z0-9_]+\?[A-Za-z0-9_]+$"
-        ch_read_match = re.match(ch_read_pattern, action)
-        if ch_write_match:
-            # 書き込みの場合
-            destination, action = action.split("!")
-        elif ch_read_match:
-            # 読み込みの場合
-            source, action = action.split("?")
-            arrow = "-->"
+    The input is parsed only once: the messages are spooled to a temporary
+    file while the participants are collected, and the participant header is
+    written in front of them afterwards. Memory usage therefore does not
+    depend on the length of the counter example.
+
+    Args:
+        stream (TextIO): Text stream of the counter example
+        short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Yields:
+        str: PlantUML code
+    """
+    # 反例の出現順に列が並ぶと毎回変わってしまうので、参加者を確定させてから辞書順で先頭に置く
+    participants = set()
+    with tempfile.TemporaryFile("w+") as spool:
+        spool.writelines(iter_sequence(stream, short_sequence, participants, rules))
+        spool.seek(0)
+        yield format_participants(participants)
+        yield from spool
 
-        ret += (
-            f'"{source}" {arrow} "{destination}" : s.{step_num}: {line_num}: {action}\n'
+
+def iter_plantuml_follow(
+    lines: Iterable[str],
+    short_sequence: bool,
+    rules: Optional[ReductionRules] = None,
+) -> Iterator[str]:
+    """Convert a counter example to PlantUML code as its lines arrive.
+
+    Unlike `iter_plantuml_code`, the participants cannot be known in advance,
+    so each one is declared just before its first message and they are
+    ordered by first appearance instead of alphabetically.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example, e.g. from
+            `trace_io.follow_input`
+        short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Yields:
+        str: PlantUML code, from the header to the footer
+    """
+    yield PLANTUML_HEADER
+    participants = set()
+    declared = set()
+    for code in iter_sequence(lines, short_sequence, participants, rules):
+        # 新しいプロセスが現れたら、そのメッセージより前で宣言する
+        if len(participants) != len(declared):
+            new = participants - declared
+            yield format_participants(new)
+            declared |= new
+        yield code
+    yield PLANTUML_FOOTER
+
+
+def follow_plantuml(
+    input_file: Optional[str],
+    sink: TextIO,
+    short_sequence: bool,
+    rules: Optional[ReductionRules] = None,
+    idle_timeout: Optional[float] = DEFAULT_FOLLOW_TIMEOUT,
+) -> str:
+    """Write PlantUML code to `sink` while the counter example is being written.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, or None/"-" for stdin
+        sink (TextIO): Destination flushed after each message, e.g. stdout
+        short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+        idle_timeout (Optional[float]): Seconds without new data before stopping
+
+    Returns:
+        str: The whole PlantUML code, to render once the trace is complete
+    """
+    lines = follow_input(input_file, idle_timeout)
+    buffer = io.StringIO()
+    with profiling.stage("emit"):
+        for code in iter_plantuml_follow(lines, short_sequence, rules):
+            buffer.write(code)
+            sink.write(code)
+            sink.flush()
+    return buffer.getvalue()
+
+
+def write_plantuml(
+    sink: TextIO,
+    stream: TextIO,
+    short_sequence: bool,
+    rules: Optional[ReductionRules] = None,
+):
+    """Write a complete PlantUML document to a file-like sink.
+
+    Args:
+        sink (TextIO): Destination such as io.StringIO, an open file or stdout
+        stream (TextIO): Text stream of the counter example
+        short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+    """
+    sink.write(PLANTUML_HEADER)
+    sink.writelines(iter_plantuml_code(stream, short_sequence, rules))
+    sink.write(PLANTUML_FOOTER)
+
+
+def convert_to_plantuml_code(
+    counter_example: str,
+    short_sequence: bool,
+    rules: Optional[ReductionRules] = None,
+) -> str:
+    """Convert a counter example to PlantUML code.
+
+    Args:
+        counter_example (str): Counter example output from SPIN or NuSMV
+        short_sequence (bool): Flag to skip evaluation logs
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Returns:
+        str: PlantUML code
+    """
+    # 反例の出現順に列が並ぶと毎回変わってしまうので、参加者は走査中に集めて最後に辞書順で先頭に置く
+    participants = set()
+    body = list(
+        iter_sequence(
+            counter_example.splitlines(), short_sequence, participants, rules
         )
+    )
+    return format_participants(participants) + "".join(body)
 
-    if loop:
-        ret += "end\n"
 
-    return ret
+# %%
+class Page(NamedTuple):
+    """One page of a paginated sequence diagram."""
+
+    code: str  # PlantUMLのコード(@startuml〜@enduml)
+    first_step: Optional[int]
+    last_step: Optional[int]
+    num_messages: int
+
+    @property
+    def steps(self) -> str:
+        """Step range of the page for the index, e.g. "s.1 - s.20"."""
+        if self.first_step is None:
+            # メッセージが1つもない反例
+            return "-"
+        return f"s.{self.first_step} - s.{self.last_step}"
+
+
+def iter_page_bodies(
+    lines: Iterable[str],
+    short_sequence: bool,
+    page_size: int,
+    page_breaks: Iterable[str] = (),
+    participants: Optional[set] = None,
+    rules: Optional[ReductionRules] = None,
+) -> Iterator[tuple]:
+    """Split the messages of a counter example into pages.
+
+    A page holds at most `page_size` messages. With "cycle" in `page_breaks`,
+    the cycle starts on a new page. With "process", a full page is extended
+    until the active process changes (up to `PROCESS_BREAK_SLACK` times
+    `page_size`), so a run of steps of one process is not cut in two. Pages
+    inside the cycle are wrapped in their own `loop CYCLE` block. Dividers
+    and block ends after the last message do not start a page of their own.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        short_sequence (bool): Flag to skip evaluation logs
+        page_size (int): Number of messages per page
+        page_breaks (Iterable[str]): Boundaries to split at ("cycle", "process")
+        participants (Optional[set]): If given, process names are added to it
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Yields:
+        tuple: PlantUML code of the messages, first step, last step and
+            number of messages of each page
+    """
+    page_breaks = set(page_breaks)
+    page_size = max(page_size, 1)
+    body = []
+    count = 0
+    first_step = last_step = None
+    last_process = None
+    # 開いているloopブロック(ページをまたぐ場合は各ページで閉じて開き直す)
+    blocks = []
+
+    def close():
+        body.extend("end\n" for _ in blocks)
+        return "".join(body), first_step, last_step, count
+
+    events = reduced_events(lines, short_sequence, participants, rules)
+    for event in events:
+        if event is CYCLE_START:
+            # ループの開始を検出
+            if "cycle" in page_breaks and count:
+                yield close()
+                body, count, first_step = list(blocks), 0, None
+            blocks.append(CYCLE_BLOCK)
+            body.append(CYCLE_BLOCK)
+            continue
+        if type(event) is ExampleStart:
+            body.extend("end\n" for _ in blocks)
+            blocks.clear()
+            body.append(example_divider(event))
+            continue
+        if type(event) is RepeatStart:
+            blocks.append(repeat_block(event))
+            body.append(blocks[-1])
+            continue
+        if event is REPEAT_END:
+            blocks.pop()
+            body.append("end\n")
+            continue
+
+        # ページが埋まったら、次のページを始める
+        if count >= page_size:
+            switched = event.process != last_process
+            if (
+                "process" not in page_breaks
+                or switched
+                or count >= page_size * PROCESS_BREAK_SLACK
+            ):
+                yield close()
+                body, count, first_step = list(blocks), 0, None
+
+        body.append(step_to_plantuml(event))
+        count += 1
+        if first_step is None:
+            first_step = event.step_num
+        last_step = (
+            event.last_step_num if type(event) is Collapsed else event.step_num
+        )
+        last_process = event.process
+
+    # 最後のメッセージより後が区切り線やendだけなら、そのページは作らない
+    if count or (body and last_step is None):
+        yield close()
+
+
+def build_pages(
+    input_file: Optional[str],
+    short_sequence: bool,
+    page_size: int,
+    page_breaks: Iterable[str] = (),
+    sample: Optional[str] = None,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+    rules: Optional[ReductionRules] = None,
+) -> List[Page]:
+    """Read a counter example and build a PlantUML document for each page.
+
+    Every page has the same participants header, sorted as in the whole
+    diagram, so the lifelines stay in the same columns across pages.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        short_sequence (bool): Flag to skip evaluation logs
+        page_size (int): Number of messages per page
+        page_breaks (Iterable[str]): Boundaries to split at ("cycle", "process")
+        sample (Optional[str]): Counter example used when there is no input
+        from_step (Optional[str]): First step to convert
+        to_step (Optional[str]): Last step to convert
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Returns:
+        List[Page]: Pages of the sequence diagram
+    """
+    participants = set()
+    with open_counter_example(input_file, sample, from_step, to_step) as f:
+        with profiling.stage("emit"):
+            bodies = list(
+                iter_page_bodies(
+                    f, short_sequence, page_size, page_breaks, participants, rules
+                )
+            )
+    header = PLANTUML_HEADER + format_participants(participants)
+    return [
+        Page(header + body + PLANTUML_FOOTER, first, last, count)
+        for body, first, last, count in bodies
+    ]
+
+
+def page_file(output_file: str, number: int) -> str:
+    """Get the image path of a page, e.g. diagram.png -> diagram_001.png."""
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}_{number:03d}{ext}"
+
+
+def page_index_file(output_file: str) -> str:
+    """Get the index path of a paginated diagram, e.g. diagram.png -> diagram_index.md."""
+    return f"{os.path.splitext(output_file)[0]}_index.md"
+
+
+# %%
+def create_renderer(
+    renderer: str = "http",
+    plantuml_jar: str = os.environ.get("PLANTUML_JAR", "plantuml.jar"),
+    timeout: float = 30.0,
+    retries: int = 3,
+    server: str = SERVER,
+    pool_size: int = POOL_SIZE,
+) -> Renderer:
+    """Create a renderer from the command line options.
+
+    Args:
+        renderer (str): "http" for the PlantUML server, "local" for plantuml.jar
+        plantuml_jar (str): Path to plantuml.jar for the local renderer
+        timeout (float): Timeout in seconds for each request to the server
+        retries (int): Number of retries when the server fails
+        server (str): URL of the PlantUML server for the http renderer
+        pool_size (int): Number of plantuml.jar processes rendering pages
+            concurrently for the local renderer
+
+    Returns:
+        Renderer: Renderer
+    """
+    if renderer == "local":
+        return PipeRenderer(plantuml_jar, pool_size=pool_size)
+    return HttpRenderer(server, timeout=timeout, retries=retries)
+
+
+def build_plantuml(
+    input_file: Optional[str],
+    short_sequence: bool,
+    sample: Optional[str] = None,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+    rules: Optional[ReductionRules] = None,
+) -> str:
+    """Read a counter example and build the whole PlantUML document.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        short_sequence (bool): Flag to skip evaluation logs
+        sample (Optional[str]): Counter example used when there is no input
+        from_step (Optional[str]): First step to convert
+        to_step (Optional[str]): Last step to convert
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Returns:
+        str: PlantUML code
+    """
+    # 1行ずつ読み込みながらバッファに書き出すため、反例全体をメモリに載せない
+    buffer = io.StringIO()
+    with open_counter_example(input_file, sample, from_step, to_step) as f:
+        with profiling.stage("emit"):
+            write_plantuml(buffer, f, short_sequence, rules)
+    return buffer.getvalue()
+
+
+@contextmanager
+def open_counter_example(
+    input_file: Optional[str],
+    sample: Optional[str] = None,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+) -> Iterator[TextIO]:
+    """Open a counter example, or only the steps `from_step` to `to_step`.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        sample (Optional[str]): Counter example used when there is no input
+        from_step (Optional[str]): First step to convert
+        to_step (Optional[str]): Last step to convert
+
+    Yields:
+        TextIO: Text stream of the counter example
+    """
+    if from_step is None and to_step is None:
+        with open_input(input_file, sample=sample) as f:
+            yield f
+        return
+    # 索引を使って指定範囲のstepだけを読み込む
+    if not input_file or input_file == "-":
+        raise ValueError("--from-step/--to-step require an input file")
+    yield read_window(input_file, from_step, to_step)
+
+
+def render_to_file(
+    plantuml_code: str,
+    output_file: str,
+    renderer: Renderer,
+    cache: Optional[RenderCache] = None,
+):
+    """Render PlantUML code and save the image.
+
+    Args:
+        plantuml_code (str): PlantUML code
+        output_file (str): Path to save the image
+        renderer (Renderer): Renderer
+        cache (Optional[RenderCache]): Render cache, or None to disable it
+
+    Raises:
+        RenderError: If the image could not be rendered
+    """
+    # 同じ図を描画済みであればキャッシュを利用して描画を省く
+    key = cache_key(plantuml_code, renderer.output_format, renderer.cache_id)
+    content = cache.get(key) if cache else None
+    if content is None:
+        content = renderer.render(plantuml_code)
+        if cache:
+            cache.put(key, content)
+    with open(output_file, "wb") as out:
+        out.write(content)
+
+
+def render_pages(
+    pages: List[Page],
+    output_file: str,
+    renderer: Renderer,
+    cache: Optional[RenderCache] = None,
+) -> List[RenderResult]:
+    """Render the pages concurrently and save the images and an index file.
+
+    The images are saved as `page_file(output_file, n)`, and the index
+    (`page_index_file(output_file)`) lists them with their step ranges.
+    A failed page does not stop the others.
+
+    Args:
+        pages (List[Page]): Pages of the sequence diagram
+        output_file (str): Base path of the images, e.g. sequence_diagram.png
+        renderer (Renderer): Renderer
+        cache (Optional[RenderCache]): Render cache, or None to disable it
+
+    Returns:
+        List[RenderResult]: Result of each page
+    """
+    results: List[Optional[RenderResult]] = [None] * len(pages)
+    keys = [
+        cache_key(page.code, renderer.output_format, renderer.cache_id)
+        for page in pages
+    ]
+
+    # キャッシュにないページだけをまとめて並行に描画する
+    missing = []
+    for i, key in enumerate(keys):
+        content = cache.get(key) if cache else None
+        if content is None:
+            missing.append(i)
+        else:
+            results[i] = RenderResult(content, None, 0.0)
+    rendered = renderer.render_many([pages[i].code for i in missing])
+    for i, result in zip(missing, rendered):
+        results[i] = result
+        if result.ok and cache:
+            cache.put(keys[i], result.content)
+
+    for number, result in enumerate(results, 1):
+        if result.ok:
+            with open(page_file(output_file, number), "wb") as out:
+                out.write(result.content)
+    write_page_index(pages, results, output_file)
+    return results
+
+
+def write_page_index(
+    pages: List[Page], results: List[RenderResult], output_file: str
+):
+    """Write a Markdown index of the page images.
+
+    Args:
+        pages (List[Page]): Pages of the sequence diagram
+        results (List[RenderResult]): Result of each page
+        output_file (str): Base path of the images
+    """
+    title = os.path.splitext(os.path.basename(output_file))[0]
+    with open(page_index_file(output_file), "w", encoding="utf-8") as f:
+        f.write(f"# {title}\n")
+        for number, (page, result) in enumerate(zip(pages, results), 1):
+            f.write(f"\n## {number}: {page.steps} ({page.num_messages} messages)\n\n")
+            if result.ok:
+                image = os.path.basename(page_file(output_file, number))
+                f.write(f"![{title} {number}]({image})\n")
+            else:
+                f.write(f"画像を生成できませんでした: {result.error}\n")
+
+
+# バッチモードのワーカープロセスごとに使い回すレンダラ
+_worker_renderer = None
+
+
+def convert_file(
+    input_file: str,
+    output_file: str,
+    short_sequence: bool = False,
+    renderer_options: Optional[dict] = None,
+    cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+    page_size: int = 0,
+    page_breaks: Iterable[str] = (),
+    rules: Optional[ReductionRules] = None,
+):
+    """Convert a counter example file to a sequence diagram image (batch task).
+
+    The renderer is created once per process and reused for every file, so
+    HTTP connections and plantuml.jar processes are kept alive.
+
+    Args:
+        input_file (str): Path to the counter example
+        output_file (str): Path to save the image
+        short_sequence (bool): Flag to skip evaluation logs
+        renderer_options (Optional[dict]): Keyword arguments of `create_renderer`
+        cache_dir (Optional[str]): Directory of the render cache, or None to disable it
+        from_step (Optional[str]): First step to convert
+        to_step (Optional[str]): Last step to convert
+        page_size (int): Number of messages per page, or 0 for a single image
+        page_breaks (Iterable[str]): Boundaries to split pages at
+        rules (Optional[ReductionRules]): Rules to drop and collapse steps
+
+    Raises:
+        RenderError: If the image (or any page) could not be rendered
+    """
+    global _worker_renderer
+    if _worker_renderer is None:
+        _worker_renderer = create_renderer(**(renderer_options or {}))
+    cache = RenderCache(cache_dir) if cache_dir else None
+    if page_size:
+        pages = build_pages(
+            input_file,
+            short_sequence,
+            page_size,
+            page_breaks,
+            from_step=from_step,
+            to_step=to_step,
+            rules=rules,
+        )
+        results = render_pages(pages, output_file, _worker_renderer, cache)
+        errors = [r.error for r in results if not r.ok]
+        if errors:
+            raise RenderError(f"{len(errors)}/{len(pages)} pages failed: {errors[0]}")
+        return
+    plantuml_code = build_plantuml(
+        input_file, short_sequence, from_step=from_step, to_step=to_step, rules=rules
+    )
+    render_to_file(plantuml_code, output_file, _worker_renderer, cache)
 
 
 # %%
-def main():
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
-        description="Convert SPIN counter example to PlantUML sequence diagram."
+        description="Convert SPIN or NuSMV counter example to PlantUML sequence diagram."
     )
     parser.add_argument(
         "-i",
         "--input_file",
-        help="Path to the SPIN counter example file. If not provided, a sample will be used.",
+        help="Path to the SPIN or NuSMV counter example file ('-' for stdin). If not provided, stdin or a sample will be used.",
         default=None,
     )
     parser.add_argument(
@@ -252,38 +911,210 @@ def main():
         help="Path to save the output sequence diagram. If not provided, it will output as sequence_diagram.png.",
         default="sequence_diagram.png",
     )
+    parser.add_argument(
+        "--print-only",
+        help="Only print the PlantUML code without rendering an image.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--renderer",
+        help="Render with the PlantUML server (http) or a local plantuml.jar (local).",
+        choices=["http", "local"],
+        default="http",
+    )
+    parser.add_argument(
+        "--plantuml-jar",
+        help="Path to plantuml.jar for the local renderer. Defaults to $PLANTUML_JAR or plantuml.jar.",
+        default=os.environ.get("PLANTUML_JAR", "plantuml.jar"),
+    )
+    parser.add_argument(
+        "--server",
+        help="URL of the PlantUML server for the http renderer.",
+        default=SERVER,
+    )
+    parser.add_argument(
+        "--pool-size",
+        help="Number of plantuml.jar processes rendering pages concurrently for the local renderer.",
+        type=int,
+        default=POOL_SIZE,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Timeout in seconds for each request to the PlantUML server.",
+        type=float,
+        default=30.0,
+    )
+    parser.add_argument(
+        "--retries",
+        help="Number of retries with exponential backoff when the PlantUML server fails.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Always fetch the image from the PlantUML server instead of using the render cache.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory of the render cache.",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--page-size",
+        help="Split the diagram into pages of this many messages, saved as <output>_001.png, ... with an index <output>_index.md.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--page-break",
+        help="Also split pages at the start of the cycle, or wait for the active process to change before starting a new page. Can be repeated.",
+        choices=PAGE_BREAKS,
+        action="append",
+        default=[],
+    )
+    add_reduction_arguments(parser)
+    add_window_arguments(parser)
+    add_follow_arguments(parser)
+    batch.add_batch_arguments(parser)
+    profiling.add_profile_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.profile is not None and args.batch:
+        parser.error("--profile cannot be used with --batch")
+    if args.follow and (args.batch or args.page_size or args.from_step or args.to_step):
+        parser.error(
+            "--follow cannot be used with --batch, --page-size or --from-step/--to-step"
+        )
+    if args.follow and not args.input_file and not stdin_is_piped():
+        parser.error("--follow needs an input file (-i) or a pipe")
+    if args.pool_size < 1:
+        parser.error("--pool-size must be at least 1")
+    rules = ReductionRules.from_args(args)
 
-    plantuml_code = f"""
-@startuml
-scale 2.0
-"""
-    # 入力ファイルの指定がなければサンプルとしてCOUNTEREXAMPLEを使用
-    if not args.input_file:
-        print("Specify the path to the counter example file as an argument.")
-        print("e.g. python ce2seq.py -i counter_example.txt")
-        print("")
-        print("Using sample counter example.")
-        counter_example = COUNTEREXAMPLE
-    else:
-        with open(args.input_file, "r") as f:
-            counter_example = f.read()
-
-    plantuml_code += convert_to_plantuml_code(counter_example, args.short_sequence)
-    plantuml_code += "@enduml\n"
-    print(plantuml_code)
-
-    # PlantUMLサーバ用にエンコード
-    encoded = encode_plantuml(plantuml_code)
-    url = "".join([SERVER, encoded])
-    response = requests.get(url)
-    if response.status_code == 200:
-        pass
-    else:
-        print("サーバから画像を取得できませんでした")
-    with open(args.output_file, "wb") as out:
-        out.write(response.content)
+    renderer_options = {
+        "renderer": args.renderer,
+        "plantuml_jar": args.plantuml_jar,
+        "timeout": args.timeout,
+        "retries": args.retries,
+        "server": args.server,
+        "pool_size": args.pool_size,
+    }
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    # 複数ファイルをまとめて変換する
+    if args.batch:
+        if args.print_only:
+            parser.error("--print-only cannot be used with --batch")
+        # 入力を上書きする出力があれば変換前に止める
+        try:
+            results = batch.run_batch(
+                convert_file,
+                batch.expand_inputs(
+                    args.batch, args.output_file, skip_exts=[".md"], skip_files=[args.summary]
+                ),
+                args.output_file,
+                jobs=args.jobs,
+                short_sequence=args.short_sequence,
+                renderer_options=renderer_options,
+                cache_dir=cache_dir,
+                from_step=args.from_step,
+                to_step=args.to_step,
+                page_size=args.page_size,
+                page_breaks=args.page_break,
+                rules=rules,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        batch.print_summary(results)
+        batch.write_summary(results, args.summary)
+        if not all(r.ok for r in results):
+            sys.exit(1)
+        return
+
+    # 描画に失敗した場合は、集計を出力してから終了コード1で終える
+    failed = False
+    # --profile の指定時だけ各段階の処理時間と件数を集計する
+    with profiling.profile_to(args.profile):
+        # 入力ファイルの指定がなく、標準入力もなければサンプルとしてCOUNTEREXAMPLEを使用
+        if not args.input_file and not stdin_is_piped() and not args.print_only:
+            print("Specify the path to the counter example file as an argument.")
+            print("e.g. python ce2seq.py -i counter_example.txt")
+            print("     spin -t -p model.pml | python ce2seq.py")
+            print("")
+            print("Using sample counter example.")
+
+        # ページに分割して、各ページを並行に描画する
+        if args.page_size:
+            pages = build_pages(
+                args.input_file,
+                args.short_sequence,
+                args.page_size,
+                args.page_break,
+                COUNTEREXAMPLE,
+                args.from_step,
+                args.to_step,
+                rules,
+            )
+            if args.print_only:
+                for page in pages:
+                    print(page.code)
+                return
+            cache = RenderCache(cache_dir) if cache_dir else None
+            with create_renderer(**renderer_options) as renderer:
+                results = render_pages(pages, args.output_file, renderer, cache)
+            for number, (page, result) in enumerate(zip(pages, results), 1):
+                if result.ok:
+                    print(f"{page_file(args.output_file, number)}: {page.steps}")
+                else:
+                    print(f"画像を生成できませんでした ({number}ページ): {result.error}")
+            # 一部のページが欠けた場合は、索引が不完全であることを示して終了コード1で終える
+            errors = sum(1 for r in results if not r.ok)
+            if errors:
+                print(f"{errors}/{len(pages)}ページの画像を生成できませんでした(索引は不完全です)")
+                failed = True
+            print(page_index_file(args.output_file))
+        else:
+            if args.follow:
+                # 書き込み中の反例を追いかけ、メッセージが届くたびにPlantUMLコードを出力する
+                plantuml_code = follow_plantuml(
+                    args.input_file,
+                    sys.stdout,
+                    args.short_sequence,
+                    rules,
+                    args.follow_timeout or None,
+                )
+            elif args.print_only:
+                # 表示だけなら文書全体を文字列にせず、標準出力へ直接書き出す
+                with open_counter_example(
+                    args.input_file, COUNTEREXAMPLE, args.from_step, args.to_step
+                ) as f:
+                    with profiling.stage("emit"):
+                        write_plantuml(sys.stdout, f, args.short_sequence, rules)
+                return
+            else:
+                plantuml_code = build_plantuml(
+                    args.input_file,
+                    args.short_sequence,
+                    COUNTEREXAMPLE,
+                    args.from_step,
+                    args.to_step,
+                    rules,
+                )
+                print(plantuml_code)
+            if args.print_only:
+                return
+
+            # PlantUMLサーバ、またはローカルのplantuml.jarで描画する
+            cache = RenderCache(cache_dir) if cache_dir else None
+            try:
+                with create_renderer(**renderer_options) as renderer:
+                    render_to_file(plantuml_code, args.output_file, renderer, cache)
+            except RenderError as e:
+                print(f"画像を生成できませんでした: {e}")
+                failed = True
+    if failed:
+        sys.exit(1)
 
 
 # %%
@@ -2,8 +2,30 @@
 # SPINの反例から変数の変化をテーブルに変換するスクリプト
 import re
 import sys
-import pandas as pd
 import argparse
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional
+
+import batch
+import profiling
+from promela_eval import PromelaSyntaxError, execute
+from spin_parser import is_assignment, parse_steps
+from table_builder import ChangeTrackingDict, ColumnarTableBuilder
+from delta_log import DEFAULT_SNAPSHOT_INTERVAL, write_delta_log
+from trace_index import add_window_arguments, open_trace
+from trace_reduction import find_repetition
+from trace_io import (
+    DEFAULT_FOLLOW_TIMEOUT,
+    add_follow_arguments,
+    add_table_output_arguments,
+    default_table_file,
+    follow_input,
+    stdin_is_piped,
+    write_rows_csv,
+)
+
+# pandasの読み込みには時間がかかるため、表を作る処理の中でだけ読み込む
+if TYPE_CHECKING:
+    import pandas as pd
 
 # %%
 COUNTEREXAMPLE = """
@@ -49,26 +71,9 @@ Exit-Status 0
 
 """
 
-# %%
-pattern = r"""
-    ^\s*           # 行頭の空白
-    (\d+)          # step番号
-    :\s*proc\s*    # プロセス
-    (\d+)\s*         # プロセス番号
-    \(
-        ([^)]+)    # プロセス名
-    \)\s+
-    ([^\s]+:\d+)   # ファイル名と行番号
-    \s*\(state\s*\d+\)\s*  # SPINの内部状態を読み飛ばす
-    \[
-        (.+?)      # 処理
-    \]
-    \s*$           # 行末の空白
-"""
-
-
 # %%
 import ast, keyword
+from functools import lru_cache
 
 
 class StringifyUnknownNames(ast.NodeTransformer):
@@ -96,10 +101,10 @@ def initialize_globals_from_pml(pml_filepath: str) -> dict:
             m = pattern.match(line)
             if m:
                 var_name, var_value = m.groups()
-                # 抽出した値をsmart_execで評価して辞書に格納
+                # 抽出した値を評価して辞書に格納
                 # これにより 'sw = off' のようなものも正しく処理できる
                 temp_env = {}
-                smart_exec(f"{var_name} = {var_value}", temp_env)
+                apply_action(f"{var_name} = {var_value}", temp_env)
                 variables.update(temp_env)
 
     print(f".pmlファイルから初期値を読み込みました: {variables}")
@@ -161,30 +166,157 @@ def _assert_safe(tree: ast.AST):
             raise ValueError(f"Disallowed syntax: {type(node).__name__}")
 
 
+# コンパイル済みの代入文を保持する件数
+EXEC_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=EXEC_CACHE_SIZE)
+def _parse_action(assign_src: str) -> frozenset:
+    # パースと安全チェックを行い、右辺などで参照している名前を返す
+    tree = ast.parse(assign_src, mode="exec")
+    _assert_safe(tree)
+    return frozenset(
+        node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+    )
+
+
+@lru_cache(maxsize=EXEC_CACHE_SIZE)
+def _compile_action(assign_src: str, known_names: frozenset):
+    # 未知Nameを"文字列"に変換してコンパイルする
+    # 変換結果は参照している名前のうち環境にあるものだけで決まるので、それをキーに含める
+    tree = ast.parse(assign_src, mode="exec")
+    transformer = StringifyUnknownNames(allowed_names=known_names)
+    tree2 = transformer.visit(tree)
+    ast.fix_missing_locations(tree2)
+    return compile(tree2, "<smart_exec>", "exec")
+
+
 def smart_exec(assign_src: str, env: dict):
     """
     代入文を受け取り、環境にない単語を自動で文字列化してから exec する。
     例: smart_exec('sw = off', env) → env['sw'] == 'off'
-    """
-    # パース（代入文を想定）
-    tree = ast.parse(assign_src, mode="exec")
 
-    # 安全チェック
-    _assert_safe(tree)
+    パース・安全チェック・変換・コンパイルの結果はキャッシュするため、
+    同じ代入文の2回目以降は辞書の参照と exec だけで済む。
+    """
+    # パースと安全チェック（代入文を想定）
+    names = _parse_action(assign_src)
 
-    # 未知Nameを"文字列"に変換
-    transformer = StringifyUnknownNames(allowed_names=env.keys())
-    tree2 = transformer.visit(tree)
-    ast.fix_missing_locations(tree2)
+    # 環境にある名前によって変換結果が変わるため、それも含めてキャッシュを引く
+    known_names = frozenset(name for name in names if name in env)
+    code = _compile_action(assign_src, known_names)
 
     # 実行（globalsは空、localsにenv）
-    code = compile(tree2, "<smart_exec>", "exec")
     exec(code, {}, env)
     return env
 
 
+def apply_action(action: str, env: dict) -> dict:
+    """Apply a Promela action to the variables.
+
+    Actions are evaluated by `promela_eval` without exec. Actions outside its
+    Promela subset fall back to `smart_exec`.
+
+    Args:
+        action (str): Action string of a step
+        env (dict): Variables, updated in place
+
+    Returns:
+        dict: The variables
+    """
+    try:
+        return execute(action, env)
+    except PromelaSyntaxError:
+        profiling.count("smart_exec_fallbacks")
+        return smart_exec(action, env)
+
+
 # %%
-def convert_to_dataframe(counter_example: str, variables: dict = {}) -> pd.DataFrame:
+def iter_updates(
+    lines: Iterable[str], variables: dict, first_step: Optional[int] = None
+) -> Iterator[dict]:
+    """Apply each step that updates a variable and yield its step information.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        variables (dict): Initialized variables, updated in place
+        first_step (Optional[int]): Steps before this are applied but not yielded
+
+    Yields:
+        dict: Step information (without the variable values)
+    """
+    # --profileの指定がなければ、行数などを数える処理は挟まない
+    apply = profiling.timed(apply_action, "exec")
+    steps = profiling.counted(
+        parse_steps(profiling.counted(lines, "lines_read")), "steps_matched"
+    )
+    executed = 0
+    for step in steps:
+        # actionが値を更新する場合のみ変数を更新する
+        if not is_assignment(step.action):
+            continue
+
+        # 変数を更新する右辺の式を評価
+        apply(step.action, variables)
+        executed += 1
+        if first_step is not None and step.step_num < first_step:
+            continue
+
+        yield {
+            "step": step.step_num,
+            "loop": step.loop,
+            "process": step.process,
+            "action": step.action,
+            "file_line": step.file_line,
+        }
+    profiling.count("actions_executed", executed)
+
+
+def iter_rows(
+    lines: Iterable[str], variables: dict, first_step: Optional[int] = None
+) -> Iterator[dict]:
+    """Yield a table row for each step that updates a variable.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        variables (dict): Initialized variables, updated in place
+        first_step (Optional[int]): Steps before this are applied but not yielded
+
+    Yields:
+        dict: Row containing the step information and all variable values
+    """
+    for info in iter_updates(lines, variables, first_step):
+        yield {**info, **variables}  # 変数の値を展開
+
+
+def build_dataframe(
+    lines: Iterable[str], variables: dict, first_step: Optional[int] = None
+) -> "pd.DataFrame":
+    """Build the variable table column by column.
+
+    Unlike `pd.DataFrame(list(iter_rows(...)))`, rows are not materialized as
+    dicts; only the variable changes of each step are kept until the end.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        variables (dict): Initialized variables, updated in place
+        first_step (Optional[int]): Steps before this are applied but not output
+
+    Returns:
+        pd.DataFrame: DataFrame containing the parsed data
+    """
+    builder = ColumnarTableBuilder(variables)
+    with profiling.stage("scan"):
+        for info in iter_updates(lines, builder.variables, first_step):
+            builder.append(info)
+    variables.update(builder.variables)
+    with profiling.stage("dataframe"):
+        return builder.to_dataframe()
+
+
+def convert_to_dataframe(counter_example: str, variables: dict = {}) -> "pd.DataFrame":
     """Convert a SPIN counter example output to a DataFrame.
 
     Args:
@@ -194,53 +326,148 @@ def convert_to_dataframe(counter_example: str, variables: dict = {}) -> pd.DataF
     Returns:
         pd.DataFrame: DataFrame containing the parsed data
     """
-    data = []
-    loop = False
-    for line in counter_example.splitlines():
-        line = line.strip()
-
-        # ループの開始を検出
-        if "<<<<<START OF CYCLE>>>>>" in line:
-            loop = True
-
-        m = re.match(pattern, line, re.VERBOSE)
-        if m:
-            step_num, process_id, process_name, file_line, action = m.groups()
-            process_name = process_id + ":" + process_name
-
-            # actionが値を更新する場合、変数名と値を抽出
-            if "=" in action and "==" not in action:
-                pass
-            else:
-                # 変数の更新がない場合はスキップ
-                continue
-
-            # 変数を更新する右辺の式を評価
-            smart_exec(action, variables)
-
-            data.append(
-                {
-                    "step": int(step_num),
-                    "loop": loop,
-                    "process": process_name,
-                    "action": action,
-                    "file_line": file_line,
-                    **variables,  # 変数の値を展開
-                }
-            )
+    return build_dataframe(counter_example.splitlines(), variables)
+
 
-    return pd.DataFrame(data)
+def compress_cycle_rows(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Keep one iteration of the rows repeated at the start of the cycle.
+
+    Rows after the cycle start are compared by everything except the step
+    number (process, file_line, action and all variable values). If they
+    begin, possibly after a few rows that are not repeated (see
+    `find_repetition`), with a block of rows repeated k times, only the
+    first iteration is kept. A `repeat` column holds k for its rows and 1
+    for the others.
+
+    Args:
+        df (pd.DataFrame): Variable table with a `loop` column
+
+    Returns:
+        pd.DataFrame: Variable table with the repetitions removed
+    """
+    import pandas as pd
+
+    repeat = pd.Series(1, index=df.index, name="repeat")
+    cycle = df.index[df["loop"].astype(bool)]
+    found = None
+    if len(cycle):
+        start = df.index.get_loc(cycle[0])
+        # 行の内容をハッシュ値にして周期を探す
+        rows = df.iloc[start:].drop(columns=["step"])
+        keys = pd.util.hash_pandas_object(rows, index=False).tolist()
+        found = find_repetition(keys)
+    if found is None:
+        return df.assign(repeat=repeat)
+
+    offset, period, count = found
+    start += offset
+    repeat.iloc[start : start + period] = count
+    removed = df.index[start + period : start + period * count]
+    return df.assign(repeat=repeat).drop(removed).reset_index(drop=True)
 
 
 # %%
-def main():
+def convert_file(
+    input_file: Optional[str],
+    output_file: str,
+    variables: dict,
+    stream: bool = False,
+    sample: Optional[str] = None,
+    output_format: str = "csv",
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+    compress_cycle: bool = False,
+):
+    """Convert a SPIN counter example file to a variable table.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        output_file (str): Path to save the table
+        variables (dict): Initialized variables from the Promela (.pml) file.
+            The dict is copied, so it can be shared between files
+        stream (bool): Write rows while reading to keep memory usage constant
+        sample (Optional[str]): Counter example used when there is no input
+        output_format (str): "csv", "parquet" or "arrow" for a dense table,
+            "delta" for a change log
+        snapshot_interval (int): Number of rows between snapshots of the change log
+        from_step (Optional[str]): First step to convert (needs an input file)
+        to_step (Optional[str]): Last step to convert (needs an input file)
+        compress_cycle (bool): Keep one iteration of the repeated cycle rows
+            (dense tables only)
+    """
+    variables = dict(variables)
+    # 範囲指定時は索引から読み込む(範囲より前は変数の更新行だけを再生する)
+    with open_trace(input_file, sample, from_step, to_step) as window:
+        f = window.lines
+        first = window.first_key
+        if output_format == "delta":
+            # 変化した変数だけを1行ずつ書き出す
+            env = ChangeTrackingDict(variables)
+            with profiling.stage("write"):
+                write_delta_log(
+                    iter_updates(f, env, first), env, output_file, snapshot_interval
+                )
+            return
+
+        if stream and output_format == "csv":
+            # 1行ずつ読み込み、1行ずつCSVに書き出す
+            with profiling.stage("write"):
+                write_rows_csv(iter_rows(f, variables, first), output_file)
+            return
+
+        df = build_dataframe(f, variables, first)
+
+    # SPINはfloatの型を本来もたないため、intに変換して出力
+    for col in df.select_dtypes(include=["float"]):
+        df[col] = df[col].astype("Int64")
+
+    if compress_cycle:
+        df = compress_cycle_rows(df)
+
+    from table_writers import write_dataframe
+
+    with profiling.stage("write"):
+        write_dataframe(df, output_file, output_format)
+
+
+def follow_file(
+    input_file: Optional[str],
+    output_file: str,
+    variables: dict,
+    idle_timeout: Optional[float] = DEFAULT_FOLLOW_TIMEOUT,
+) -> int:
+    """Convert a SPIN counter example to a CSV table while it is being written.
+
+    Each step is parsed as soon as its line is complete, and its row is
+    flushed to the CSV file, so the table can be watched while SPIN runs.
+    The variables and the cycle flag are kept between the chunks read.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, or None/"-" for stdin
+        output_file (str): Path to save the table
+        variables (dict): Initialized variables from the Promela (.pml) file
+        idle_timeout (Optional[float]): Seconds without new data before stopping
+
+    Returns:
+        int: Number of rows written
+    """
+    lines = follow_input(input_file, idle_timeout)
+    with profiling.stage("write"):
+        return write_rows_csv(
+            iter_rows(lines, dict(variables)), output_file, line_buffered=True
+        )
+
+
+# %%
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description="Convert SPIN counter example to PlantUML sequence diagram."
     )
     parser.add_argument(
         "-i",
         "--input_file",
-        help="Path to the SPIN counter example file. If not provided, a sample will be used.",
+        help="Path to the SPIN counter example file ('-' for stdin). If not provided, stdin or a sample will be used.",
         default=None,
     )
     parser.add_argument(
@@ -250,36 +477,94 @@ def main():
         help="REQUIRED: Path to the Promela file.",
         default=None,
     )
+    add_table_output_arguments(parser)
+    add_window_arguments(parser)
     parser.add_argument(
-        "-o",
-        "--output_file",
-        help="Path to save the output csv file. If not provided, it will output as variable_table.csv.",
-        default="variable_table.csv",
+        "--compress-cycle",
+        help="Keep one iteration of the rows repeated after the start of the cycle, with a repeat column.",
+        action="store_true",
     )
-
-    args = parser.parse_args()
-
-    # 入力ファイルの指定がなければサンプルとしてCOUNTEREXAMPLEを使用
-    if not args.input_file:
-        print("Specify the path to the counter example file as an argument.")
-        print("e.g. python ce2seq.py -i counter_example.txt")
-        print("")
-        print("Using sample counter example.")
-        counter_example = COUNTEREXAMPLE
-    else:
-        with open(args.input_file, "r") as f:
-            counter_example = f.read()
-
-    if args.pml_file:
+    add_follow_arguments(parser)
+    batch.add_batch_arguments(parser)
+    profiling.add_profile_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if args.profile is not None and args.batch:
+        parser.error("--profile cannot be used with --batch")
+    if args.follow and (
+        args.batch or args.format != "csv" or args.from_step or args.to_step or args.compress_cycle
+    ):
+        parser.error(
+            "--follow writes a CSV of the whole trace (not with --batch, --from-step/--to-step or --compress-cycle)"
+        )
+    if args.follow and not args.input_file and not stdin_is_piped():
+        parser.error("--follow needs an input file (-i) or a pipe")
+    if args.stream and args.format != "csv":
+        parser.error("--stream is only available with --format csv")
+    if args.compress_cycle and (args.stream or args.format == "delta"):
+        parser.error("--compress-cycle needs the whole table (not --stream or delta)")
+    if not args.output_file:
+        args.output_file = default_table_file(args.format)
+
+    # 複数ファイルをまとめて変換する(.pmlの初期値は一度だけ読み込んで共有する)
+    if args.batch:
         variables = initialize_globals_from_pml(args.pml_file)
-
-    df = convert_to_dataframe(counter_example, variables)
-
-    # SPINはfloatの型を本来もたないため、intに変換して出力
-    for col in df.select_dtypes(include=["float"]):
-        df[col] = df[col].astype("Int64")
-
-    df.to_csv("variable_table.csv", index=False)
+        # 入力を上書きする出力があれば変換前に止める
+        try:
+            results = batch.run_batch(
+                convert_file,
+                batch.expand_inputs(
+                    args.batch, args.output_file, skip_files=[args.summary]
+                ),
+                args.output_file,
+                jobs=args.jobs,
+                variables=variables,
+                stream=args.stream,
+                output_format=args.format,
+                snapshot_interval=args.snapshot_interval,
+                from_step=args.from_step,
+                to_step=args.to_step,
+                compress_cycle=args.compress_cycle,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        batch.print_summary(results)
+        batch.write_summary(results, args.summary)
+        if not all(r.ok for r in results):
+            sys.exit(1)
+        return
+
+    # --profile の指定時だけ各段階の処理時間と件数を集計する
+    with profiling.profile_to(args.profile):
+        # 入力ファイルの指定がなく、標準入力もなければサンプルとしてCOUNTEREXAMPLEを使用
+        if not args.input_file and not stdin_is_piped():
+            print("Specify the path to the counter example file as an argument.")
+            print("e.g. python ce2table.py -i counter_example.txt -p model.pml")
+            print("")
+            print("Using sample counter example.")
+
+        if args.pml_file:
+            variables = initialize_globals_from_pml(args.pml_file)
+
+        # 書き込み中の反例を追いかけ、変換した行をすぐにCSVへ書き出す
+        if args.follow:
+            follow_file(
+                args.input_file, args.output_file, variables, args.follow_timeout or None
+            )
+            return
+
+        convert_file(
+            args.input_file,
+            args.output_file,
+            variables,
+            args.stream,
+            COUNTEREXAMPLE,
+            args.format,
+            args.snapshot_interval,
+            args.from_step,
+            args.to_step,
+            args.compress_cycle,
+        )
 
 
 # %%
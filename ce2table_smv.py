@@ -1,9 +1,32 @@
 # %%
 # SMVVの反例から変数の変化をテーブルに変換するスクリプト
-import re
 import sys
-import pandas as pd
 import argparse
+import csv
+import os
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+import batch
+import profiling
+from table_builder import ChangeTrackingDict, ColumnarTableBuilder
+from delta_log import DEFAULT_SNAPSHOT_INTERVAL, write_delta_log
+from smv_parser import STATE_PATTERN, SmvTrace, iter_states, iter_traces
+from trace_index import add_window_arguments, open_trace
+from trace_io import (
+    DEFAULT_FOLLOW_TIMEOUT,
+    add_follow_arguments,
+    add_table_output_arguments,
+    default_table_file,
+    follow_input,
+    open_input,
+    stdin_is_piped,
+    write_rows_csv,
+)
+
+# pandasの読み込みには時間がかかるため、表を作る処理の中でだけ読み込む
+if TYPE_CHECKING:
+    import pandas as pd
 
 # %%
 COUNTEREXAMPLE = """
@@ -87,16 +110,11 @@ Trace Type: Counterexample
 """
 
 # %%
-pattern = r"""
-    ^\s*           # 行頭の空白
-    ->             # Stateの開始を示す
-    \s+
-    State:
-    \s+
-    (\d+)\.(\d+)   # ステート番号（例: 1.1, 2.3など）
-    \s+
-    <-             # ステートの終了を示す
-"""
+# Stateの開始行(解析は smv_parser.py で行う)
+pattern = STATE_PATTERN
+
+# 検査式ごとに出力する場合の形式
+SPEC_LAYOUTS = ("files", "dataset")
 
 
 # %%
@@ -117,110 +135,435 @@ class StringifyUnknownNames(ast.NodeTransformer):
 
 
 # %%
-def convert_to_dataframe(counter_example: str, variables: dict = {}) -> pd.DataFrame:
-    """Convert a SPIN counter example output to a DataFrame.
+def iter_rows(
+    lines: Iterable[str], variables: dict, first_key: Optional[int] = None
+) -> Iterator[dict]:
+    """Yield a table row for each state of the NuSMV counter example.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        variables (dict): Variable values, updated in place and cleared when
+            the next counter example starts
+        first_key (Optional[int]): States before this key are applied but not yielded
+
+    Yields:
+        dict: Row containing the state information and all variable values
+    """
+    for info in iter_states(lines, variables, first_key, reset_variables=True):
+        yield {**info, **variables}  # 変数の値を展開
+
+
+def build_dataframe(
+    lines: Iterable[str], variables: dict, first_key: Optional[int] = None
+) -> "pd.DataFrame":
+    """Build the variable table column by column.
+
+    Unlike `pd.DataFrame(list(iter_rows(...)))`, rows are not materialized as
+    dicts; only the variable changes of each state are kept until the end.
 
     Args:
-        counter_example (str): Counter example output from SPIN
-        variables (dict): Initialized variables from the Promela (.pml) file
+        lines (Iterable[str]): Lines of the counter example
+        variables (dict): Variable values, updated in place and cleared when
+            the next counter example starts
+        first_key (Optional[int]): States before this key are applied but not output
 
     Returns:
         pd.DataFrame: DataFrame containing the parsed data
     """
-    data = []
-    loop = False
-    temp_loop = False
-    example_num = 0
-    step_num = 0
-    temp_example_num = 0
-    temp_step_num = 0
-    for line in counter_example.splitlines():
-        line = line.strip()
-
-        # ループの開始を検出
-        # ループは次のStateから開始されるため、テーブル出力にはまだ反映しない
-        if "-- Loop starts here" in line:
-            temp_loop = True
-
-        m = re.match(pattern, line, re.VERBOSE)
-        if m:
-            # State更新前に1つ前のStateを出力
-            if example_num != 0:
-                data.append(
-                    {
-                        "example": example_num,
-                        "step": step_num,
-                        "loop": loop,
-                        **variables,  # 変数の値を展開
-                    }
-                )
+    builder = ColumnarTableBuilder(variables)
+    with profiling.stage("scan"):
+        for info in iter_states(
+            lines, builder.variables, first_key, reset_variables=True
+        ):
+            builder.append(info)
+    variables.update(builder.variables)
+    with profiling.stage("dataframe"):
+        return builder.to_dataframe()
 
-            temp_example_num, temp_step_num = m.groups()
-            # exampleが変わったらリセット
-            if temp_example_num != example_num:
-                loop = False
-                temp_loop = False
-            example_num = temp_example_num
-            step_num = temp_step_num
-            loop = temp_loop
-        elif "--" not in line and "=" in line:
-            # 変数の更新行を検出
-            variable, value = line.split("=")
-            variables[variable.strip()] = value.strip()
-
-    # 最後のState出力
-    data.append(
-        {
-            "example": example_num,
-            "step": step_num,
-            "loop": loop,
-            **variables,  # 変数の値を展開
-        }
-    )
 
-    return pd.DataFrame(data)
+def convert_to_dataframe(counter_example: str, variables: dict = {}) -> "pd.DataFrame":
+    """Convert a NuSMV counter example output to a DataFrame.
+
+    Args:
+        counter_example (str): Counter example output from NuSMV
+        variables (dict): Initial variable values
+
+    Returns:
+        pd.DataFrame: DataFrame containing the parsed data
+    """
+    return build_dataframe(counter_example.splitlines(), variables)
 
 
 # %%
-def main():
+def convert_file(
+    input_file: Optional[str],
+    output_file: str,
+    stream: bool = False,
+    sample: Optional[str] = None,
+    output_format: str = "csv",
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+):
+    """Convert a NuSMV counter example file to a variable table.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        output_file (str): Path to save the table
+        stream (bool): Write rows while reading to keep memory usage constant
+        sample (Optional[str]): Counter example used when there is no input
+        output_format (str): "csv", "parquet" or "arrow" for a dense table,
+            "delta" for a change log
+        snapshot_interval (int): Number of rows between snapshots of the change log
+        from_step (Optional[str]): First state "x.y" to convert (needs an input file)
+        to_step (Optional[str]): Last state "x.y" to convert (needs an input file)
+    """
+    # 範囲指定時は索引から読み込む(同じ反例の最初のStateから変数の値を再生する)
+    with open_trace(input_file, sample, from_step, to_step) as window:
+        write_table(
+            window.lines,
+            output_file,
+            stream,
+            output_format,
+            snapshot_interval,
+            window.first_key,
+        )
+
+
+def write_table(
+    lines: Iterable[str],
+    output_file: str,
+    stream: bool = False,
+    output_format: str = "csv",
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+    first_key: Optional[int] = None,
+):
+    """Convert the lines of a NuSMV counter example and save the table.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        output_file (str): Path to save the table
+        stream (bool): Write rows while reading to keep memory usage constant
+        output_format (str): "csv", "parquet", "arrow" or "delta"
+        snapshot_interval (int): Number of rows between snapshots of the change log
+        first_key (Optional[int]): States before this key are applied but not output
+    """
+    # --profile用の行数はここで数える(smv_parser.iter_statesはce2seqからも使うため)
+    lines = profiling.counted(lines, "lines_read")
+    variables = {}
+    if output_format == "delta":
+        # 変化した変数だけを1行ずつ書き出す
+        env = ChangeTrackingDict(variables)
+        with profiling.stage("write"):
+            write_delta_log(
+                iter_states(lines, env, first_key, reset_variables=True),
+                env,
+                output_file,
+                snapshot_interval,
+            )
+        return
+
+    if stream and output_format == "csv":
+        # 1行ずつ読み込み、1行ずつCSVに書き出す
+        with profiling.stage("write"):
+            write_rows_csv(iter_rows(lines, variables, first_key), output_file)
+        return
+
+    from table_writers import write_dataframe
+
+    df = _to_int(build_dataframe(lines, variables, first_key))
+    with profiling.stage("write"):
+        write_dataframe(df, output_file, output_format)
+
+
+def follow_file(
+    input_file: Optional[str],
+    output_file: str,
+    idle_timeout: Optional[float] = DEFAULT_FOLLOW_TIMEOUT,
+) -> int:
+    """Convert a NuSMV counter example to a CSV table while it is being written.
+
+    A state is written and flushed once the header of the next state (or the
+    end of the input) is read, since NuSMV prints only its updates.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, or None/"-" for stdin
+        output_file (str): Path to save the table
+        idle_timeout (Optional[float]): Seconds without new data before stopping
+
+    Returns:
+        int: Number of rows written
+    """
+    lines = profiling.counted(follow_input(input_file, idle_timeout), "lines_read")
+    with profiling.stage("write"):
+        return write_rows_csv(iter_rows(lines, {}), output_file, line_buffered=True)
+
+
+def _to_int(df: "pd.DataFrame") -> "pd.DataFrame":
+    # NuSMVはfloatの型を本来もたないため、intに変換して出力
+    for col in df.select_dtypes(include=["float"]):
+        df[col] = df[col].astype("Int64")
+    return df
+
+
+# %%
+class SpecResult(NamedTuple):
+    """Result of converting the counter example of one specification."""
+
+    number: int
+    spec: str
+    output_file: str
+    ok: bool
+    error: str
+
+
+def trace_to_dataframe(trace: SmvTrace) -> "pd.DataFrame":
+    """Convert one counter example to a variable table with a `spec` column.
+
+    Each trace starts from empty variables, so no value carries over from
+    the counter example of another specification.
+
+    Args:
+        trace (SmvTrace): Counter example
+
+    Returns:
+        pd.DataFrame: Variable table
+    """
+    df = _to_int(build_dataframe(trace.lines, {}))
+    df.insert(0, "spec", trace.spec)
+    return df
+
+
+def spec_file(output_file: str, number: int) -> str:
+    """Get the output path for a specification, e.g. table.csv -> table_spec001.csv."""
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}_spec{number:03d}{ext}"
+
+
+def _write_trace(
+    trace: SmvTrace, output_file: str, output_format: str, snapshot_interval: int
+) -> SpecResult:
+    try:
+        write_table(trace.lines, output_file, False, output_format, snapshot_interval)
+    except Exception as e:
+        return SpecResult(
+            trace.number, trace.spec, output_file, False, f"{type(e).__name__}: {e}"
+        )
+    return SpecResult(trace.number, trace.spec, output_file, True, "")
+
+
+def _map_bounded(
+    submit: Callable, traces: Iterable[SmvTrace], limit: int
+) -> Iterator[tuple]:
+    # 次の反例は実行中のタスクがlimit個未満になってから読み込む
+    pending = deque()
+    for trace in traces:
+        pending.append((SmvTrace(trace.number, trace.spec, []), submit(trace)))
+        if len(pending) >= limit:
+            head, future = pending.popleft()
+            yield head, future.result()
+    while pending:
+        head, future = pending.popleft()
+        yield head, future.result()
+
+
+def convert_specs(
+    input_file: Optional[str],
+    output_file: str,
+    output_format: str = "csv",
+    layout: str = "files",
+    jobs: Optional[int] = None,
+    sample: Optional[str] = None,
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+) -> List[SpecResult]:
+    """Convert the counter example of each specification in parallel.
+
+    With the "files" layout, each counter example is saved to
+    `spec_file(output_file, n)` and the specifications are listed in
+    `<stem>_specs.csv`. With the "dataset" layout, all tables are saved as
+    one Parquet dataset in the directory `<stem>`, partitioned by `example`
+    and with the specification in a `spec` column.
+
+    Args:
+        input_file (Optional[str]): Path to the NuSMV output, "-" for stdin
+        output_file (str): Output path given on the command line
+        output_format (str): Format of the tables for the "files" layout
+        layout (str): "files" or "dataset"
+        jobs (Optional[int]): Number of worker processes. Defaults to the
+            number of CPUs
+        sample (Optional[str]): Counter example used when there is no input
+        snapshot_interval (int): Number of rows between snapshots of the change log
+
+    Returns:
+        List[SpecResult]: Results in the order of the specifications (empty
+            if the input has no counter example)
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    stem, _ = os.path.splitext(output_file)
+    # 読み込み済みで変換を待つ反例をワーカー数の2倍までに抑える
+    limit = 2 * (jobs or os.cpu_count() or 1)
+    with open_input(input_file, sample=sample) as f, ProcessPoolExecutor(
+        max_workers=jobs
+    ) as executor:
+        traces = iter_traces(f)
+        if layout == "dataset":
+            results = []
+            dfs = []
+            for trace, df in _map_bounded(
+                lambda t: executor.submit(trace_to_dataframe, t), traces, limit
+            ):
+                dfs.append(df)
+                results.append(SpecResult(trace.number, trace.spec, stem, True, ""))
+            if dfs:
+                import pandas as pd
+
+                from table_writers import write_parquet_dataset
+
+                df = pd.concat(dfs, ignore_index=True)
+                write_parquet_dataset(df, stem, ["example"])
+        else:
+            results = [
+                result
+                for _, result in _map_bounded(
+                    lambda t: executor.submit(
+                        _write_trace,
+                        t,
+                        spec_file(output_file, t.number),
+                        output_format,
+                        snapshot_interval,
+                    ),
+                    traces,
+                    limit,
+                )
+            ]
+
+    with open(stem + "_specs.csv", "w", newline="") as out:
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(SpecResult._fields)
+        writer.writerows(results)
+    return results
+
+
+# %%
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description="Convert NuSMV counter example to PlantUML sequence diagram."
     )
     parser.add_argument(
         "-i",
         "--input_file",
-        help="Path to the NuSMV counter example file. If not provided, a sample will be used.",
+        help="Path to the NuSMV counter example file ('-' for stdin). If not provided, stdin or a sample will be used.",
         default=None,
     )
+    add_table_output_arguments(parser)
+    add_window_arguments(parser)
     parser.add_argument(
-        "-o",
-        "--output_file",
-        help="Path to save the output csv file. If not provided, it will output as variable_table.csv.",
-        default="variable_table.csv",
+        "--split-specs",
+        help="Write one table per specification (files, listed in <output>_specs.csv), or one Parquet dataset partitioned by counter example (dataset). Uses -j worker processes.",
+        nargs="?",
+        choices=SPEC_LAYOUTS,
+        const="files",
+        default=None,
     )
+    add_follow_arguments(parser)
+    batch.add_batch_arguments(parser)
+    profiling.add_profile_arguments(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.profile is not None and (args.batch or args.split_specs):
+        # 変換を別プロセスで行うため集計できない
+        parser.error("--profile cannot be used with --batch or --split-specs")
+    if args.stream and args.format != "csv":
+        parser.error("--stream is only available with --format csv")
+    if args.split_specs and (args.batch or args.from_step or args.to_step):
+        parser.error(
+            "--split-specs cannot be used with --batch or --from-step/--to-step"
+        )
+    if args.split_specs == "dataset" and args.format != "parquet":
+        parser.error("--split-specs dataset requires --format parquet")
+    if args.follow and (
+        args.batch or args.split_specs or args.format != "csv" or args.from_step or args.to_step
+    ):
+        parser.error(
+            "--follow writes a CSV of the whole trace (not with --batch, --split-specs or --from-step/--to-step)"
+        )
+    if args.follow and not args.input_file and not stdin_is_piped():
+        parser.error("--follow needs an input file (-i) or a pipe")
+    if not args.output_file:
+        args.output_file = default_table_file(args.format)
 
-    # 入力ファイルの指定がなければサンプルとしてCOUNTEREXAMPLEを使用
-    if not args.input_file:
-        print("Specify the path to the counter example file as an argument.")
-        print("e.g. python ce2seq_smv.py -i counter_example.txt")
-        print("")
-        print("Using sample counter example.")
-        counter_example = COUNTEREXAMPLE
-    else:
-        with open(args.input_file, "r") as f:
-            counter_example = f.read()
+    # 複数ファイルをまとめて変換する
+    if args.batch:
+        # 入力を上書きする出力があれば変換前に止める
+        try:
+            results = batch.run_batch(
+                convert_file,
+                batch.expand_inputs(
+                    args.batch, args.output_file, skip_files=[args.summary]
+                ),
+                args.output_file,
+                jobs=args.jobs,
+                stream=args.stream,
+                output_format=args.format,
+                snapshot_interval=args.snapshot_interval,
+                from_step=args.from_step,
+                to_step=args.to_step,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        batch.print_summary(results)
+        batch.write_summary(results, args.summary)
+        if not all(r.ok for r in results):
+            sys.exit(1)
+        return
 
-    variables = {}
+    # --profile の指定時だけ各段階の処理時間と件数を集計する
+    with profiling.profile_to(args.profile):
+        # 入力ファイルの指定がなく、標準入力もなければサンプルとしてCOUNTEREXAMPLEを使用
+        if not args.input_file and not stdin_is_piped():
+            print("Specify the path to the counter example file as an argument.")
+            print("e.g. python ce2table_smv.py -i counter_example.txt")
+            print("")
+            print("Using sample counter example.")
 
-    df = convert_to_dataframe(counter_example, variables)
+        # 検査式ごとの反例を別々のテーブルとして並列に変換する
+        if args.split_specs:
+            results = convert_specs(
+                args.input_file,
+                args.output_file,
+                args.format,
+                args.split_specs,
+                args.jobs,
+                COUNTEREXAMPLE,
+                args.snapshot_interval,
+            )
+            if not results:
+                print("反例が見つかりませんでした(-> State: x.y <- の行がありません)")
+                sys.exit(1)
+            for result in results:
+                status = "OK" if result.ok else "NG"
+                line = f"[{status}] {result.number}: {result.spec} -> {result.output_file}"
+                print(line if result.ok else f"{line}: {result.error}")
+            if not all(r.ok for r in results):
+                sys.exit(1)
+            return
 
-    # NuSMVはfloatの型を本来もたないため、intに変換して出力
-    for col in df.select_dtypes(include=["float"]):
-        df[col] = df[col].astype("Int64")
+        # 書き込み中の反例を追いかけ、変換した行をすぐにCSVへ書き出す
+        if args.follow:
+            follow_file(args.input_file, args.output_file, args.follow_timeout or None)
+            return
 
-    df.to_csv("variable_table.csv", index=False)
+        convert_file(
+            args.input_file,
+            args.output_file,
+            args.stream,
+            COUNTEREXAMPLE,
+            args.format,
+            args.snapshot_interval,
+            args.from_step,
+            args.to_step,
+        )
 
 
 # %%
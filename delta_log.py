@@ -0,0 +1,277 @@
+# %%
+# 変数テーブルを変化分(delta)だけのログとして保存・復元する
+# 各行は変化した変数の (変数名, 変更前, 変更後) のみを持ち、一定行ごとに全変数のスナップショットを挟む
+import bisect
+import json
+import os
+from typing import Iterable, Iterator, Optional, Tuple
+
+from table_builder import ChangeTrackingDict
+from trace_index import smv_key
+
+DEFAULT_SNAPSHOT_INTERVAL = 1000
+INDEX_SUFFIX = ".idx"
+
+
+# %%
+def step_key(info: dict):
+    """Get the key ordering the rows of a log, like `trace_index` keys.
+
+    NuSMV step numbers restart in each counter example, so NuSMV rows are
+    keyed on `smv_key(example, step)` and SPIN rows on the step number.
+
+    Args:
+        info (dict): Step information of a row
+
+    Returns:
+        Step number, or `smv_key(example, step)` if the row has an "example"
+    """
+    if "example" in info:
+        return smv_key(int(info["example"]), int(info["step"]))
+    return info.get("step")
+
+
+class DeltaLogWriter:
+    """Write a variable table as a JSON Lines change log with periodic snapshots.
+
+    Each row is written as `{"row": r, "info": {...}, "changes": [[name, old, new], ...]}`.
+    After every `snapshot_interval` rows, the full state is written as
+    `{"snapshot": r, "variables": {...}}`, and its byte offset is recorded in a
+    sidecar index file (`<path>.idx`).
+    """
+
+    def __init__(self, path: str, snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = max(snapshot_interval, 1)
+        self.num_rows = 0
+        self._file = open(path, "wb")
+        self._state = {}
+        self._snapshots = []
+        self._kind = None
+
+    def write_row(self, info: dict, env: ChangeTrackingDict):
+        """Write a row with the variables assigned since the previous row.
+
+        Args:
+            info (dict): Step information of the row
+            env (ChangeTrackingDict): Current variables
+        """
+        state = self._state
+        changes = []
+        names = env.changed
+        if len(names) > 1:
+            # 複数の変数が変化した場合は変数の定義順に並べる(clearで消えた変数は最後)
+            names = [name for name in env if name in names] + sorted(
+                name for name in names if name not in env
+            )
+        for name in names:
+            # clearで消えた変数は値なし(None)として記録する
+            new = env.get(name)
+            if new is None and state.get(name) is None:
+                continue
+            old = state.get(name)
+            if name not in state or old != new or type(old) is not type(new):
+                changes.append([name, old, new])
+                state[name] = new
+        env.changed.clear()
+
+        row = self.num_rows
+        if self._kind is None:
+            self._kind = "smv" if "example" in info else "spin"
+        self._write({"row": row, "info": info, "changes": changes})
+        self.num_rows += 1
+        if self.num_rows % self.snapshot_interval == 0:
+            self._snapshots.append([row, step_key(info), self._file.tell()])
+            self._write({"snapshot": row, "variables": state})
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+        self._file.write(b"\n")
+
+    def close(self):
+        """Close the log and write the snapshot index."""
+        if self._file.closed:
+            return
+        self._file.close()
+        with open(self.path + INDEX_SUFFIX, "w") as f:
+            json.dump(
+                {"kind": self._kind, "rows": self.num_rows, "snapshots": self._snapshots},
+                f,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_delta_log(
+    infos: Iterable[dict],
+    env: ChangeTrackingDict,
+    path: str,
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+) -> int:
+    """Write rows produced by a generator as a change log.
+
+    Args:
+        infos (Iterable[dict]): Step information yielded after each update of `env`
+        env (ChangeTrackingDict): Variables updated by the generator
+        path (str): Path to the log file
+        snapshot_interval (int): Number of rows between snapshots
+
+    Returns:
+        int: Number of rows written
+    """
+    with DeltaLogWriter(path, snapshot_interval) as writer:
+        for info in infos:
+            writer.write_row(info, env)
+    return writer.num_rows
+
+
+# %%
+class DeltaLogReader:
+    """Rebuild the state at any row of a change log written by `DeltaLogWriter`.
+
+    The nearest snapshot before the requested row is located with the index,
+    so at most `snapshot_interval` rows are replayed per query.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        index_path = path + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        else:
+            index = _build_index(path)
+        # 種類のない古い索引は作り直す(NuSMVのstepを比較できる形にするため)
+        if "kind" not in index:
+            index = _build_index(path)
+        self.kind = index["kind"]
+        self.num_rows = index["rows"]
+        self._snapshot_rows = [s[0] for s in index["snapshots"]]
+        self._snapshot_steps = [s[1] for s in index["snapshots"]]
+        self._snapshot_offsets = [s[2] for s in index["snapshots"]]
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def parse_key(self, step) -> int:
+        """Convert a step to the key compared by `state_at`.
+
+        Args:
+            step: SPIN step number, or NuSMV state "x.y" (or "y" for the
+                first counter example)
+
+        Returns:
+            int: Key
+        """
+        if self.kind != "smv":
+            return int(step)
+        if "." in str(step):
+            example, state = str(step).split(".", 1)
+            return smv_key(int(example), int(state))
+        first = next(self.iter_changes(), None)
+        example = int(first[0]["example"]) if first else 1
+        return smv_key(example, int(step))
+
+    def _replay(self, index: int) -> Tuple[dict, Iterator[dict]]:
+        # index番目のスナップショットの状態と、それ以降の行を返す(-1はファイル先頭から)
+        if index < 0:
+            return {}, self._records(0)
+        records = self._records(self._snapshot_offsets[index])
+        snapshot = next(records)
+        return dict(snapshot["variables"]), records
+
+    def _records(self, offset: int) -> Iterator[dict]:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                yield json.loads(line)
+
+    def state_at_row(self, row: int) -> dict:
+        """Return all variable values after the given row.
+
+        Args:
+            row (int): Row number (0-based)
+
+        Returns:
+            dict: Variable values
+        """
+        if not 0 <= row < self.num_rows:
+            raise IndexError(f"row {row} out of range")
+        start = bisect.bisect_right(self._snapshot_rows, row) - 1
+        state, records = self._replay(start)
+        for record in records:
+            if "row" not in record:
+                continue
+            if record["row"] > row:
+                break
+            for name, _, new in record["changes"]:
+                state[name] = new
+        return state
+
+    def state_at(self, step, key: str = "step") -> Optional[dict]:
+        """Return all variable values at the last row whose `info[key]` <= step.
+
+        With the default key, SPIN step numbers and NuSMV states ("x.y") are
+        compared as `parse_key` keys. Any other key must never decrease.
+
+        Args:
+            step: Step to look up
+            key (str): Key of the step information to compare
+
+        Returns:
+            Optional[dict]: Variable values, or None if no row is at or before `step`
+        """
+        start = -1
+        if key == "step":
+            step = self.parse_key(step)
+            start = bisect.bisect_right(self._snapshot_steps, step) - 1
+            get_key = step_key
+        else:
+            get_key = lambda info: info.get(key)
+        state, records = self._replay(start)
+        found = start >= 0
+        for record in records:
+            if "row" not in record:
+                continue
+            if get_key(record["info"]) > step:
+                break
+            for name, _, new in record["changes"]:
+                state[name] = new
+            found = True
+        return state if found else None
+
+    def iter_changes(self) -> Iterator[Tuple[dict, list]]:
+        """Iterate over the step information and changes of every row.
+
+        Yields:
+            Tuple[dict, list]: Step information and `[name, old, new]` changes
+        """
+        for record in self._records(0):
+            if "row" in record:
+                yield record["info"], record["changes"]
+
+
+def _build_index(path: str) -> dict:
+    # 索引ファイルがない場合はログを1度走査して作る
+    rows = 0
+    snapshots = []
+    last_step = None
+    kind = None
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            record = json.loads(line)
+            if "row" in record:
+                rows += 1
+                info = record["info"]
+                last_step = step_key(info)
+                if kind is None:
+                    kind = "smv" if "example" in info else "spin"
+            else:
+                snapshots.append([record["snapshot"], last_step, offset])
+            offset += len(line)
+    return {"kind": kind, "rows": rows, "snapshots": snapshots}
@@ -0,0 +1,112 @@
+# %%
+# PlantUMLサーバ向けのエンコード処理
+# PlantUMLの64文字表は標準のBase64と並びが違うだけなので、base64モジュールで変換してから文字を置き換える
+import base64
+import zlib
+
+# PlantUML用のカスタム64エンコードテーブル
+PLANTUML_ALPHABET = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+# 3バイトに満たない末尾は0でパディングして4文字にするため、"=" は0の文字にする
+_ENCODE_TABLE = bytes.maketrans(BASE64_ALPHABET + b"=", PLANTUML_ALPHABET + b"0")
+_DECODE_TABLE = bytes.maketrans(PLANTUML_ALPHABET, BASE64_ALPHABET)
+
+# zlibの圧縮レベル(0〜9、-1はzlibの既定値で6相当)
+DEFAULT_COMPRESSION_LEVEL = zlib.Z_DEFAULT_COMPRESSION
+
+
+# %%
+def encode_plantuml(text: str, level: int = DEFAULT_COMPRESSION_LEVEL) -> str:
+    """Encode text to PlantUML server format.
+
+    Args:
+        text (str): Text to encode
+        level (int): zlib compression level (0-9, or -1 for the default).
+            Higher levels give shorter URLs at some CPU cost
+
+    Returns:
+        str: Encoded text
+    """
+    # UTF-8にエンコードし、zlibヘッダーとチェックサムなしのdeflateで圧縮
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(text.encode("utf-8")) + compressor.flush()
+    return encode64(compressed)
+
+
+def encode64(data: bytes) -> str:
+    """Encode bytes to PlantUML server format.
+
+    Args:
+        data (bytes): Data to encode
+
+    Returns:
+        str: Encoded text
+    """
+    return base64.b64encode(data).translate(_ENCODE_TABLE).decode("ascii")
+
+
+def decode64(text: str) -> bytes:
+    """Decode text encoded by `encode64`.
+
+    The padding of the last 3-byte group cannot be told apart from data, so
+    up to two trailing zero bytes may be added to the original data.
+
+    Args:
+        text (str): Encoded text
+
+    Returns:
+        bytes: Decoded data
+    """
+    return base64.b64decode(text.encode("ascii").translate(_DECODE_TABLE))
+
+
+def decode_plantuml(encoded: str) -> str:
+    """Decode text encoded by `encode_plantuml` (for tests and debugging).
+
+    Args:
+        encoded (str): Encoded text, e.g. the last part of a PlantUML server URL
+
+    Returns:
+        str: Original text
+    """
+    # deflateの終端以降(パディングの0バイト)は読み捨てられる
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    return decompressor.decompress(decode64(encoded)).decode("utf-8")
+
+
+# %%
+if __name__ == "__main__":
+    # 3バイトずつループする以前の実装との比較
+    import timeit
+
+    def encode64_loop(data: bytes) -> str:
+        char_map = PLANTUML_ALPHABET.decode("ascii")
+        res = []
+        for i in range(0, len(data), 3):
+            b = data[i : i + 3]
+            if len(b) < 3:
+                b = b + bytes(3 - len(b))
+            n = (b[0] << 16) + (b[1] << 8) + b[2]
+            res.append(char_map[(n >> 18) & 0x3F])
+            res.append(char_map[(n >> 12) & 0x3F])
+            res.append(char_map[(n >> 6) & 0x3F])
+            res.append(char_map[n & 0x3F])
+        return "".join(res)
+
+    text = "".join(
+        f'"{i % 7}:proc" -> "ch{i % 3}" : s.{i}: l.{i % 90}: x = {i}\n'
+        for i in range(20000)
+    )
+    for level in (1, DEFAULT_COMPRESSION_LEVEL, 9):
+        print(f"level {level:2d}: {len(encode_plantuml(text, level))} chars")
+
+    data = zlib.compress(text.encode("utf-8"))[2:-4]
+    assert encode64(data) == encode64_loop(data)
+    assert decode_plantuml(encode_plantuml(text)) == text
+    n = 20
+    t_loop = timeit.timeit(lambda: encode64_loop(data), number=n) / n
+    t_fast = timeit.timeit(lambda: encode64(data), number=n) / n
+    print(f"{len(data)} bytes")
+    print(f"loop:      {t_loop * 1e3:.2f} ms")
+    print(f"translate: {t_fast * 1e3:.2f} ms")
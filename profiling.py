@@ -0,0 +1,215 @@
+# %%
+# 変換の各段階の処理時間と件数を集計する
+# 計測は有効にしたときだけ行い、無効な間は各関数がすぐに戻るため処理はほとんど増えない
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+# 計測中のProfiler(無効な間はNone)
+_active = None
+
+# 無効な間にstage()が返す何もしないコンテキストマネージャ
+_NULL_STAGE = nullcontext()
+
+# hook(kind, name, value): kindは "stage"(valueは秒数) または "count"(valueは件数)
+Hook = Callable[[str, str, float], None]
+
+
+# %%
+class Profiler:
+    """Stage timers and counters of one conversion.
+
+    Stages may be entered from several threads (e.g. concurrent renders);
+    their times are summed, so a stage can take longer than the wall time.
+
+    Args:
+        hooks (Iterable[Hook]): Callbacks called with `("stage", name, seconds)`
+            when a stage ends and `("count", name, n)` when a counter is added to
+    """
+
+    def __init__(self, hooks: Iterable[Hook] = ()):
+        self.hooks = list(hooks)
+        self.stages: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measure the time spent in a block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1):
+        """Add the time of a stage measured by the caller."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+        for hook in self.hooks:
+            hook("stage", name, seconds)
+
+    def count(self, name: str, n: int = 1):
+        """Add `n` to a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        for hook in self.hooks:
+            hook("count", name, n)
+
+    def report(self) -> dict:
+        """Return the stage times and counters as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.started,
+                "stages": {
+                    name: {"seconds": seconds, "calls": self.calls[name]}
+                    for name, seconds in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def print_summary(self, file=None):
+        """Print the stage times and counters as a table."""
+        file = file or sys.stderr
+        report = self.report()
+        print(f"profile (wall {report['wall_seconds'] * 1e3:.1f} ms)", file=file)
+        for name, stage in report["stages"].items():
+            print(
+                f"  {name:24s} {stage['seconds'] * 1e3:10.2f} ms {stage['calls']:8d} calls",
+                file=file,
+            )
+        for name, value in report["counters"].items():
+            print(f"  {name:24s} {value:10d}", file=file)
+
+
+# %%
+def enable(profiler: Optional[Profiler] = None) -> Profiler:
+    """Start collecting into `profiler` (a new one if not given)."""
+    global _active
+    _active = profiler or Profiler()
+    return _active
+
+
+def disable() -> Optional[Profiler]:
+    """Stop collecting and return the profiler that was active."""
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active() -> Optional[Profiler]:
+    """Return the active profiler, or None if profiling is off."""
+    return _active
+
+
+def stage(name: str):
+    """Measure a block in the active profiler (does nothing when off).
+
+    Example:
+        with profiling.stage("encode"):
+            encoded = encode_plantuml(code)
+    """
+    profiler = _active
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name)
+
+
+def count(name: str, n: int = 1):
+    """Add `n` to a counter of the active profiler (does nothing when off)."""
+    profiler = _active
+    if profiler is not None:
+        profiler.count(name, n)
+
+
+def counted(items: Iterable, name: str) -> Iterable:
+    """Count the items of an iterable as they are consumed.
+
+    When profiling is off, `items` is returned as is, so loops over it run
+    at full speed.
+    """
+    profiler = _active
+    if profiler is None:
+        return items
+    return _count_items(items, name, profiler)
+
+
+def _count_items(items: Iterable, name: str, profiler: Profiler) -> Iterator:
+    n = 0
+    try:
+        for item in items:
+            n += 1
+            yield item
+    finally:
+        profiler.count(name, n)
+
+
+def timed(func: Callable, name: str) -> Callable:
+    """Wrap a function called in a loop so that its calls are timed.
+
+    When profiling is off, `func` is returned as is. Look the function up once
+    before the loop, not inside it.
+    """
+    profiler = _active
+    if profiler is None:
+        return func
+    perf_counter = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.add_time(name, perf_counter() - start)
+
+    return wrapper
+
+
+# %%
+@contextmanager
+def profile_to(path: Optional[str]) -> Iterator[Optional[Profiler]]:
+    """Profile a block and report it, as requested by `--profile`.
+
+    Args:
+        path (Optional[str]): None to leave profiling off, "-" to print a
+            summary to stderr, or a path to save the report as JSON
+
+    Yields:
+        Optional[Profiler]: The profiler, or None if profiling is off
+    """
+    if path is None:
+        yield None
+        return
+    profiler = enable()
+    try:
+        yield profiler
+    finally:
+        disable()
+    if path == "-":
+        profiler.print_summary()
+    else:
+        with open(path, "w") as f:
+            json.dump(profiler.report(), f, indent=2)
+
+
+def add_profile_arguments(parser):
+    """Add --profile to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument(
+        "--profile",
+        help="Print the time of each stage and counters to stderr, or save them as JSON to the given path.",
+        nargs="?",
+        const="-",
+        default=None,
+        metavar="JSON_FILE",
+    )
+
@@ -0,0 +1,339 @@
+# %%
+# 反例のstepに現れるPromelaの代入文を exec を使わずに評価する
+# 対応する文: x = expr, x++, x--, a[i] = expr, 式のみの文
+import re
+from functools import lru_cache
+from typing import Callable, List
+
+# コンパイル済みの文を保持する件数
+EVAL_CACHE_SIZE = 4096
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    \s*(?:
+        (\d+)                         # 数値
+      | ([A-Za-z_][A-Za-z0-9_.]*)     # 名前(構造体のメンバ a.b も1つの名前として扱う)
+      | (\+\+|--|->|&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%()!~<>&|^\[\]=:])  # 演算子
+    )
+""",
+    re.VERBOSE,
+)
+
+# 二項演算子の優先順位(Cと同じ)
+BINARY_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "|": 3,
+    "^": 4,
+    "&": 5,
+    "==": 6,
+    "!=": 6,
+    "<": 7,
+    "<=": 7,
+    ">": 7,
+    ">=": 7,
+    "<<": 8,
+    ">>": 8,
+    "+": 9,
+    "-": 9,
+    "*": 10,
+    "/": 10,
+    "%": 10,
+}
+
+# Promelaの真偽値
+# 変数テーブルの値は従来どおり "true"/"false" の文字列で表し、比較や論理演算の結果も同じ文字列にする
+TRUE = "true"
+FALSE = "false"
+CONSTANTS = {"true": TRUE, "false": FALSE}
+
+# 算術・比較で真偽値を整数として扱うための対応
+BOOL_VALUES = {TRUE: 1, FALSE: 0}
+
+Env = dict
+Expr = Callable[[Env], object]
+
+
+class PromelaSyntaxError(ValueError):
+    """Raised when an action is outside the supported Promela subset."""
+
+
+# %%
+def _div(a, b):
+    # Cと同じく0方向に切り捨てる
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def _mod(a, b):
+    return a - b * _div(a, b)
+
+
+def _truth(value) -> bool:
+    # 定数 false は文字列で保持しているため、条件では偽として扱う
+    return bool(value) and value != FALSE
+
+
+def _bool(value) -> str:
+    return TRUE if value else FALSE
+
+
+def _num(value):
+    # true/false はPromelaと同じく1/0として計算・比較する(mtypeの名前はそのまま)
+    return BOOL_VALUES.get(value, value) if type(value) is str else value
+
+
+def _arith(func):
+    return lambda a, b: func(_num(a), _num(b))
+
+
+def _compare(func):
+    return lambda a, b: _bool(func(_num(a), _num(b)))
+
+
+_BINARY_OPS = {
+    "+": _arith(lambda a, b: a + b),
+    "-": _arith(lambda a, b: a - b),
+    "*": _arith(lambda a, b: a * b),
+    "/": _arith(_div),
+    "%": _arith(_mod),
+    "<<": _arith(lambda a, b: a << b),
+    ">>": _arith(lambda a, b: a >> b),
+    "<": _compare(lambda a, b: a < b),
+    "<=": _compare(lambda a, b: a <= b),
+    ">": _compare(lambda a, b: a > b),
+    ">=": _compare(lambda a, b: a >= b),
+    "==": _compare(lambda a, b: a == b),
+    "!=": _compare(lambda a, b: a != b),
+    "&": _arith(lambda a, b: a & b),
+    "^": _arith(lambda a, b: a ^ b),
+    "|": _arith(lambda a, b: a | b),
+}
+
+
+def tokenize(source: str) -> List[str]:
+    """Split a Promela action into tokens.
+
+    Args:
+        source (str): Action string
+
+    Returns:
+        List[str]: Tokens
+    """
+    tokens = []
+    pos = 0
+    end = len(source.rstrip())
+    while pos < end:
+        m = TOKEN_PATTERN.match(source, pos)
+        if not m:
+            raise PromelaSyntaxError(f"Unexpected character at {pos}: {source!r}")
+        tokens.append(m.group(m.lastindex))
+        pos = m.end()
+    return tokens
+
+
+# %%
+class _Parser:
+    """Recursive descent parser compiling an action into closures."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = tokenize(source)
+        self.pos = 0
+
+    def peek(self, offset: int = 0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected: str = None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise PromelaSyntaxError(
+                f"Expected {expected or 'token'} but got {token!r}: {self.source!r}"
+            )
+        self.pos += 1
+        return token
+
+    def statement(self) -> Callable[[Env], None]:
+        # 左辺になり得る場合は代入・インクリメントとして解釈する
+        if _is_name(self.peek()) and self.peek() not in CONSTANTS:
+            start = self.pos
+            name = self.peek()
+            key = self.lvalue()
+            op = self.peek()
+            if op == "=":
+                self.take()
+                value = self.expression()
+                self.finish()
+                return _make_assign(name, key, value, self.tokens[start + 1] != "[")
+            if op in ("++", "--"):
+                self.take()
+                self.finish()
+                delta = 1 if op == "++" else -1
+
+                def step(env):
+                    k = key(env)
+                    env[k] = _num(env.get(k, 0)) + delta
+
+                return step
+            self.pos = start
+
+        # 式のみの文(評価するだけで変数は更新しない)
+        value = self.expression()
+        self.finish()
+        return lambda env: value(env) and None
+
+    def finish(self):
+        if self.peek() is not None:
+            raise PromelaSyntaxError(f"Unexpected {self.peek()!r}: {self.source!r}")
+
+    def lvalue(self) -> Callable[[Env], str]:
+        name = self.take()
+        if self.peek() != "[":
+            return lambda env: name
+        self.take("[")
+        index = self.expression()
+        self.take("]")
+        return lambda env: f"{name}[{index(env)}]"
+
+    def expression(self) -> Expr:
+        cond = self.binary(1)
+        # 条件式 (c -> a : b)
+        if self.peek() == "->":
+            self.take()
+            then = self.expression()
+            self.take(":")
+            other = self.expression()
+            return lambda env: then(env) if _truth(cond(env)) else other(env)
+        return cond
+
+    def binary(self, min_prec: int) -> Expr:
+        left = self.unary()
+        while True:
+            op = self.peek()
+            prec = BINARY_PRECEDENCE.get(op)
+            if prec is None or prec < min_prec:
+                return left
+            self.take()
+            right = self.binary(prec + 1)
+            left = _make_binary(op, left, right)
+
+    def unary(self) -> Expr:
+        op = self.peek()
+        if op == "!":
+            self.take()
+            operand = self.unary()
+            return lambda env: _bool(not _truth(operand(env)))
+        if op == "-":
+            self.take()
+            operand = self.unary()
+            return lambda env: -_num(operand(env))
+        if op == "~":
+            self.take()
+            operand = self.unary()
+            return lambda env: ~_num(operand(env))
+        return self.primary()
+
+    def primary(self) -> Expr:
+        token = self.take()
+        if token == "(":
+            value = self.expression()
+            self.take(")")
+            return value
+        if token.isdigit():
+            number = int(token)
+            return lambda env: number
+        if not _is_name(token):
+            raise PromelaSyntaxError(f"Unexpected {token!r}: {self.source!r}")
+        if token in CONSTANTS:
+            constant = CONSTANTS[token]
+            return lambda env: constant
+        if self.peek() == "[":
+            self.take()
+            index = self.expression()
+            self.take("]")
+            # 配列の要素は "a[i]" をキーとして保持する(未設定は0)
+            return lambda env: env.get(f"{token}[{index(env)}]", 0)
+        # 環境にない名前はmtypeのシンボルとして名前の文字列を値にする
+        return lambda env: env.get(token, token)
+
+
+def _make_assign(name: str, key, value: Expr, simple: bool) -> Callable[[Env], None]:
+    # 配列でない単純な代入はキーの計算を省く
+    if simple:
+
+        def assign(env):
+            env[name] = value(env)
+
+    else:
+
+        def assign(env):
+            env[key(env)] = value(env)
+
+    return assign
+
+
+def _is_name(token) -> bool:
+    return token is not None and (token[0].isalpha() or token[0] == "_")
+
+
+def _make_binary(op: str, left: Expr, right: Expr) -> Expr:
+    if op == "&&":
+        return lambda env: _bool(_truth(left(env)) and _truth(right(env)))
+    if op == "||":
+        return lambda env: _bool(_truth(left(env)) or _truth(right(env)))
+    func = _BINARY_OPS[op]
+    return lambda env: func(left(env), right(env))
+
+
+# %%
+@lru_cache(maxsize=EVAL_CACHE_SIZE)
+def compile_action(action: str) -> Callable[[Env], None]:
+    """Parse a Promela action once and return a function applying it.
+
+    Args:
+        action (str): Action string such as `x = y + 1` or `a[i]++`
+
+    Returns:
+        Callable[[dict], None]: Function updating a variable store in place
+
+    Raises:
+        PromelaSyntaxError: If the action is outside the supported subset
+    """
+    return _Parser(action).statement()
+
+
+def execute(action: str, env: dict) -> dict:
+    """Apply a Promela action to a variable store.
+
+    Args:
+        action (str): Action string
+        env (dict): Variable store, updated in place
+
+    Returns:
+        dict: The variable store
+    """
+    compile_action(action)(env)
+    return env
+
+
+# %%
+if __name__ == "__main__":
+    # smart_exec との比較
+    import timeit
+
+    import ce2table
+
+    actions = ["DB_state = ready", "count = count + 1", "x = (count > 3 -> 1 : 0)"]
+    python_actions = ["DB_state = ready", "count = count + 1", "x = 1 if count > 3 else 0"]
+    n = 100000
+    env = {"DB_state": "stop", "count": 0}
+    for a in python_actions:
+        ce2table.smart_exec(a, env)
+    t_exec = timeit.timeit(
+        lambda: [ce2table.smart_exec(a, env) for a in python_actions], number=n
+    )
+    env = {"DB_state": "stop", "count": 0}
+    t_eval = timeit.timeit(lambda: [execute(a, env) for a in actions], number=n)
+    print(f"smart_exec: {t_exec / (n * 3) * 1e6:.2f} us/action")
+    print(f"execute:    {t_eval / (n * 3) * 1e6:.2f} us/action")
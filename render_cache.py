@@ -0,0 +1,166 @@
+# %%
+# PlantUMLの描画結果をディスクにキャッシュする
+# キーはPlantUMLコード・出力形式・描画に使うサーバ(またはplantuml.jar)のハッシュ
+import hashlib
+import os
+import tempfile
+import time
+from typing import Optional
+
+import profiling
+
+# キャッシュの既定値
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "ce2seq",
+)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256MB
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60  # 30日
+# 古いエントリを削除する間隔(保存の回数)。ディレクトリ全体を調べるため毎回は行わない
+EVICT_INTERVAL = 64
+
+
+# %%
+def cache_key(plantuml_code: str, output_format: str, renderer_id: str = "") -> str:
+    """Build a cache key from the final PlantUML code and how it is rendered.
+
+    Args:
+        plantuml_code (str): PlantUML code to render
+        output_format (str): Image format such as "png" or "svg"
+        renderer_id (str): Identity of the renderer (`Renderer.cache_id`),
+            since servers and plantuml.jar versions may draw differently
+
+    Returns:
+        str: Hex digest used as the file name
+    """
+    digest = hashlib.sha256()
+    digest.update(output_format.encode("ascii"))
+    digest.update(b"\0")
+    digest.update(renderer_id.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(plantuml_code.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Content-addressed cache of rendered images with size and age limits.
+
+    The limits are enforced by `evict` on the first store and then every
+    `evict_interval` stores, so the cache may exceed `max_bytes` by that many
+    images in between.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+        evict_interval: int = EVICT_INTERVAL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = max(evict_interval, 1)
+        self._stores = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached image, or None if it is missing or expired.
+
+        Args:
+            key (str): Cache key from `cache_key`
+
+        Returns:
+            Optional[bytes]: Cached image data
+        """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                profiling.count("cache_misses")
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            # 最近使ったものを残すため、更新時刻を利用時刻として扱う
+            os.utime(path)
+            profiling.count("cache_hits")
+            return data
+        except OSError:
+            profiling.count("cache_misses")
+            return None
+
+    def put(self, key: str, data: bytes) -> bool:
+        """Store an image, evicting old entries every `evict_interval` stores.
+
+        The cache only saves requests, so a directory that cannot be written
+        (e.g. a read-only home directory) is ignored instead of failing the
+        render.
+
+        Args:
+            key (str): Cache key from `cache_key`
+            data (bytes): Image data
+
+        Returns:
+            bool: True if the image was stored
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # 書き込み途中のファイルを読まないよう、一時ファイルから置き換える
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            _remove_quietly(tmp_path)
+            return False
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        # 1回目の保存でも削除するため、実行のたびに1回は上限を確認する
+        if self._stores % self.evict_interval == 0:
+            self.evict()
+        self._stores += 1
+        return True
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones over the size limit."""
+        now = time.time()
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(".tmp-"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                _remove_quietly(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        # 古いものから削除
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove_quietly(path)
+            total -= size
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,317 @@
+# %%
+# PlantUMLコードを画像に変換するレンダラ
+# PlantUMLサーバ(HTTP)とローカルのplantuml.jar(-pipe)を切り替えて使う
+import os
+import queue
+import subprocess
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+import profiling
+from plantuml_encoding import DEFAULT_COMPRESSION_LEVEL, encode_plantuml
+
+# PlantUMLの公開サーバ
+DEFAULT_SERVER = "https://www.plantuml.com/plantuml/png/"
+
+# -pipeモードで画像の区切りとして出力させる文字列
+PIPE_DELIMITER = "___CE2SEQ_END_OF_IMAGE___"
+
+
+# %%
+class RenderError(Exception):
+    """Raised when a diagram could not be rendered."""
+
+
+class RenderResult(NamedTuple):
+    """Result of rendering one diagram in a batch."""
+
+    content: Optional[bytes]  # 失敗した場合はNone
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.content is not None
+
+
+class Renderer:
+    """Base class of renderers converting PlantUML code to an image."""
+
+    output_format = "png"
+    max_workers = 1
+
+    @property
+    def cache_id(self) -> str:
+        """Identity of the renderer in render cache keys."""
+        return type(self).__name__
+
+    def render(self, plantuml_code: str) -> bytes:
+        """Render PlantUML code to an image.
+
+        Args:
+            plantuml_code (str): PlantUML code including @startuml/@enduml
+
+        Returns:
+            bytes: Image data
+        """
+        raise NotImplementedError
+
+    def render_many(
+        self, plantuml_codes: Iterable[str], max_workers: Optional[int] = None
+    ) -> List[RenderResult]:
+        """Render several diagrams concurrently.
+
+        A failure does not stop the other diagrams; it is reported as a
+        `RenderResult` without content.
+
+        Args:
+            plantuml_codes (Iterable[str]): PlantUML code of each diagram
+            max_workers (Optional[int]): Number of concurrent renders.
+                Defaults to `self.max_workers`
+
+        Returns:
+            List[RenderResult]: Results in the same order as the input
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers or self.max_workers) as executor:
+            return list(executor.map(self._render_result, plantuml_codes))
+
+    def _render_result(self, plantuml_code: str) -> RenderResult:
+        start = time.perf_counter()
+        try:
+            content = self.render(plantuml_code)
+        except RenderError as e:
+            return RenderResult(None, str(e), time.perf_counter() - start)
+        return RenderResult(content, None, time.perf_counter() - start)
+
+    def close(self):
+        """Release resources held by the renderer."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# %%
+class HttpRenderer(Renderer):
+    """Renderer using a PlantUML server.
+
+    Requests share one `requests.Session`, so connections to the server are
+    kept alive and reused across diagrams. Connection errors, timeouts and
+    429/5xx responses are retried with exponential backoff.
+    `compression_level` is the zlib level of the encoded URL; a higher level
+    gives shorter URLs for large diagrams.
+    """
+
+    # 再試行する HTTP ステータス
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        server: str = DEFAULT_SERVER,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_workers: int = 4,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+    ):
+        self.server = server
+        self.output_format = server.rstrip("/").rsplit("/", 1)[-1]
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.compression_level = compression_level
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Shared HTTP session, created on first use."""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                # 同時実行数分の接続をプールしておく
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=max(self.max_workers, 1)
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def cache_id(self) -> str:
+        return self.server
+
+    def render(self, plantuml_code: str) -> bytes:
+        with profiling.stage("encode"):
+            encoded = encode_plantuml(plantuml_code, self.compression_level)
+        return self.fetch(encoded)
+
+    def fetch(self, encoded: str) -> bytes:
+        """Fetch the image of already encoded PlantUML code.
+
+        Args:
+            encoded (str): Output of `encode_plantuml`
+
+        Returns:
+            bytes: Image data
+        """
+        import requests
+
+        url = "".join([self.server, encoded])
+        session = self.session
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            profiling.count("bytes_sent", len(url))
+            try:
+                with profiling.stage("http"):
+                    response = session.get(url, timeout=self.timeout)
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                error = f"Could not connect to PlantUML server: {e}"
+                continue
+            except requests.RequestException as e:
+                # URLの誤り(--server)やリダイレクトの繰り返しなどは再試行しない
+                raise RenderError(f"Request to PlantUML server failed: {e}") from e
+            if response.status_code == 200 and response.content:
+                profiling.count("bytes_received", len(response.content))
+                return response.content
+            error = f"PlantUML server returned {response.status_code}"
+            if response.status_code not in self.RETRY_STATUS:
+                break
+        raise RenderError(error)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+# %%
+class PipeRenderer(Renderer):
+    """Renderer using long-lived `plantuml.jar -pipe` processes.
+
+    The JVM is started once per worker and reused for every diagram, so batch
+    renders pay the startup cost only once. Up to `pool_size` diagrams are
+    rendered concurrently when `render` is called from several threads.
+    """
+
+    def __init__(
+        self,
+        jar: str = os.environ.get("PLANTUML_JAR", "plantuml.jar"),
+        output_format: str = "png",
+        pool_size: int = 1,
+        java: str = "java",
+        command: Optional[List[str]] = None,
+    ):
+        self.output_format = output_format
+        # commandを指定した場合はそれを起動する(テスト用のスタブなど)
+        self.command = command or [
+            java,
+            "-Djava.awt.headless=true",
+            "-jar",
+            jar,
+            "-pipe",
+            f"-t{output_format}",
+            "-charset",
+            "UTF-8",
+            "-pipedelimitor",
+            PIPE_DELIMITER,
+        ]
+        self.max_workers = pool_size
+        self._delimiter = PIPE_DELIMITER.encode("ascii")
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._processes = []
+        self._lock = threading.Lock()
+
+    @property
+    def cache_id(self) -> str:
+        # 起動するjarのパスが変われば別の描画結果として扱う
+        return "pipe:" + " ".join(self.command)
+
+    def _start(self) -> subprocess.Popen:
+        try:
+            process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+        except OSError as e:
+            raise RenderError(f"Could not start PlantUML: {e}") from e
+        with self._lock:
+            self._processes.append(process)
+        return process
+
+    def _acquire(self) -> subprocess.Popen:
+        try:
+            process = self._idle.get_nowait()
+        except queue.Empty:
+            return self._start()
+        if process.poll() is not None:
+            # 終了してしまったプロセスは作り直す
+            return self._start()
+        return process
+
+    def render(self, plantuml_code: str) -> bytes:
+        with self._slots:
+            process = self._acquire()
+            try:
+                if not plantuml_code.endswith("\n"):
+                    plantuml_code += "\n"
+                data = plantuml_code.encode("utf-8")
+                profiling.count("bytes_sent", len(data))
+                with profiling.stage("plantuml_pipe"):
+                    process.stdin.write(data)
+                    process.stdin.flush()
+                    data = self._read_image(process.stdout)
+            except (OSError, RenderError) as e:
+                process.kill()
+                raise RenderError(f"PlantUML process failed: {e}") from e
+            self._idle.put(process)
+            return data
+
+    def _read_image(self, stream) -> bytes:
+        # 区切り文字列とそれに続く改行が現れるまで読み込む
+        buf = bytearray()
+        start = 0
+        while True:
+            index = buf.find(self._delimiter, start)
+            if index >= 0:
+                if buf.find(b"\n", index) >= 0:
+                    return bytes(buf[:index])
+                start = index
+            else:
+                start = max(0, len(buf) - len(self._delimiter) + 1)
+            chunk = stream.read1(65536)
+            if not chunk:
+                raise RenderError("PlantUML process exited")
+            buf += chunk
+
+    def close(self):
+        with self._lock:
+            processes, self._processes = self._processes, []
+        for process in processes:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
@@ -0,0 +1,269 @@
+# %%
+# NuSMVの反例(-> State: x.y <- のブロック)を解析する共通パーサ
+# ce2table_smv.py と ce2seq.py の両方から利用する
+import re
+from collections import deque
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from spin_parser import CYCLE_START
+from trace_index import smv_key
+
+# %%
+STATE_PATTERN = re.compile(
+    r"""
+    ^\s*           # 行頭の空白
+    ->             # Stateの開始を示す
+    \s+
+    State:
+    \s+
+    (\d+)\.(\d+)   # ステート番号（例: 1.1, 2.3など）
+    \s+
+    <-             # ステートの終了を示す
+""",
+    re.VERBOSE,
+)
+
+# 反例の前に出力される検査式の行(例: "-- specification AG p  is false")
+SPEC_PATTERN = re.compile(
+    r"^\s*--\s+(?:specification|invariant)\s+(.*?)\s+is\s+(true|false)\s*$"
+)
+
+
+# %%
+def iter_states(
+    lines: Iterable[str],
+    variables: dict,
+    first_key: Optional[int] = None,
+    reset_variables: bool = False,
+) -> Iterator[dict]:
+    """Apply the updates of each state and yield its state information.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        variables (dict): Variable values, updated in place
+        first_key (Optional[int]): States before `smv_key(x, y)` are applied
+            but not yielded
+        reset_variables (bool): Clear `variables` when a new counter example
+            starts, instead of carrying the values over
+
+    Yields:
+        dict: State information (without the variable values): "example"
+            and "step" as ints, and "loop"
+    """
+    match = STATE_PATTERN.match
+    loop = False
+    temp_loop = False
+    example_num = 0
+    step_num = 0
+    temp_example_num = 0
+    temp_step_num = 0
+    for line in lines:
+        line = line.strip()
+
+        # ループの開始を検出
+        # ループは次のStateから開始されるため、テーブル出力にはまだ反映しない
+        if "-- Loop starts here" in line:
+            temp_loop = True
+
+        m = match(line)
+        if m:
+            # State更新前に1つ前のStateを出力
+            if example_num != 0 and _in_window(example_num, step_num, first_key):
+                yield {
+                    "example": example_num,
+                    "step": step_num,
+                    "loop": loop,
+                }
+
+            temp_example_num, temp_step_num = int(m.group(1)), int(m.group(2))
+            # exampleが変わったらリセット
+            if temp_example_num != example_num:
+                loop = False
+                temp_loop = False
+                # 最初の反例の前に与えられた値はそのまま使う
+                if reset_variables and example_num:
+                    variables.clear()
+            example_num = temp_example_num
+            step_num = temp_step_num
+            loop = temp_loop
+        elif "--" not in line and "=" in line:
+            # 変数の更新行を検出
+            variable, value = line.split("=")
+            variables[variable.strip()] = value.strip()
+
+    # 最後のState出力
+    if _in_window(example_num, step_num, first_key):
+        yield {
+            "example": example_num,
+            "step": step_num,
+            "loop": loop,
+        }
+
+
+def _in_window(example_num, step_num, first_key: Optional[int]) -> bool:
+    return first_key is None or smv_key(int(example_num), int(step_num)) >= first_key
+
+
+# %%
+class SmvTrace(NamedTuple):
+    """Counter example of one specification in a NuSMV output."""
+
+    number: int  # 出力中で何番目の反例か(1始まり)
+    spec: str
+    lines: List[str]
+
+
+def iter_traces(lines: Iterable[str]) -> Iterator[SmvTrace]:
+    """Split a NuSMV output into the counter examples of each specification.
+
+    Only the lines of one counter example are held at a time. Specifications
+    that hold have no counter example and are skipped. An output without
+    specification lines (e.g. of `show_traces`) is one counter example with
+    an empty `spec`.
+
+    Args:
+        lines (Iterable[str]): Lines of the NuSMV output
+
+    Yields:
+        SmvTrace: Counter example with its specification
+    """
+    match = SPEC_PATTERN.match
+    trace = None
+    number = 0
+    # 最初の検査式の行より前の行(バナーなど)
+    preamble = []
+    for line in lines:
+        m = match(line)
+        if m:
+            if trace:
+                yield trace
+            trace = None
+            preamble = None
+            if m.group(2) == "false":
+                number += 1
+                trace = SmvTrace(number, m.group(1), [])
+        elif trace is not None:
+            trace.lines.append(line)
+        elif preamble is not None:
+            preamble.append(line)
+            if STATE_PATTERN.match(line):
+                # 検査式の行がないままStateが始まったら、全体を1つの反例とする
+                number += 1
+                trace = SmvTrace(number, "", preamble)
+                preamble = None
+    if trace:
+        yield trace
+
+
+# %%
+# モジュールを持たない変数のプロセス名
+MAIN_MODULE = "main"
+
+
+class StateChange(NamedTuple):
+    """A variable assigned in a state of a NuSMV counter example."""
+
+    example: int
+    state: int
+    module: str  # 変数名の "." より前(なければ "main")
+    variable: str  # モジュール名を除いた変数名
+    value: str
+    loop: bool  # Loop starts here 以降のStateかどうか
+
+    @property
+    def process(self) -> str:
+        return self.module
+
+    @property
+    def action(self) -> str:
+        return f"{self.variable} = {self.value}"
+
+    # SPINのstepと同じ形で扱えるようにする(NuSMVにはファイル名・行番号がない)
+    file = ""
+    line = 0
+
+    @property
+    def file_line(self) -> str:
+        return ""
+
+    @property
+    def step_num(self) -> str:
+        return f"{self.example}.{self.state}"
+
+
+class ExampleStart(NamedTuple):
+    """Marker emitted before the counter example of each specification."""
+
+    number: int
+    spec: str
+
+
+def split_module(name: str) -> tuple:
+    """Split a variable name into its module prefix and the rest.
+
+    Args:
+        name (str): Variable name such as `heater.on`
+
+    Returns:
+        tuple: Module (`MAIN_MODULE` without a prefix) and variable name
+    """
+    module, dot, variable = name.rpartition(".")
+    return (module, variable) if dot else (MAIN_MODULE, name)
+
+
+def iter_state_changes(lines: Iterable[str]) -> Iterator[object]:
+    """Scan a NuSMV output and yield the variables changed in each state.
+
+    The lines are parsed by `iter_states` as they are read, so no counter
+    example is held in memory. Each counter example starts from empty
+    variables, so its first state lists every variable, and is preceded by
+    `ExampleStart` if a failed specification was printed before it (outputs
+    without the specification lines, e.g. of `show_traces`, have none).
+    `CYCLE_START` is yielded before the first state of the loop. Only values
+    that differ from the previous state are yielded, in the order the
+    variables first appear.
+
+    Args:
+        lines (Iterable[str]): Lines of the NuSMV output
+
+    Yields:
+        object: `ExampleStart`, `CYCLE_START` or `StateChange`
+    """
+    # 読み込んだが、まだ反例が始まっていない検査式
+    specs = deque()
+
+    def scan(lines: Iterable[str]) -> Iterator[str]:
+        match = SPEC_PATTERN.match
+        number = 0
+        for line in lines:
+            m = match(line)
+            if m and m.group(2) == "false":
+                number += 1
+                specs.append(ExampleStart(number, m.group(1)))
+            yield line
+
+    variables = {}
+    previous = {}
+    current = None
+    loop = False
+    for info in iter_states(scan(lines), variables, reset_variables=True):
+        if info["example"] == 0:
+            # Stateが1つもない出力
+            continue
+        example, state = int(info["example"]), int(info["step"])
+        if example != current:
+            # 反例が変わったら、その検査式の区切りを出して差分をやり直す
+            if specs:
+                yield specs.popleft()
+            current = example
+            previous = {}
+            loop = False
+        if info["loop"] and not loop:
+            yield CYCLE_START
+            loop = True
+        for name, value in variables.items():
+            if previous.get(name) == value:
+                continue
+            previous[name] = value
+            module, variable = split_module(name)
+            yield StateChange(example, state, module, variable, value, loop)
@@ -0,0 +1,184 @@
+# %%
+# SPINの反例(spin -t -p の出力)を解析する共通パーサ
+# ce2seq.py と ce2table.py の両方から利用する
+import re
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+# %%
+# 正規表現は import 時に一度だけコンパイルする
+# never claimの行(proc  - (spec1:1) _spin_nvr.tmp:4 ...)はプロセス番号がないため一致せず、常に出力しない
+STEP_PATTERN = re.compile(
+    r"""
+    ^\s*           # 行頭の空白
+    (\d+)          # step番号
+    :\s*proc\s*    # プロセス
+    (              # プロセス番号と名前の部分全体(記号表のキー)
+        (\d+)\s*   # プロセス番号
+        \(
+            ([^)]+)  # プロセス名
+        \)
+    )\s+
+    ([^\s]+)       # ファイル名
+    :(\d+)         # 行番号
+    \s*\(state\s*\d+\)\s*  # SPINの内部状態を読み飛ばす
+    \[
+        (.+?)      # 処理
+    \]
+    \s*$           # 行末の空白
+""",
+    re.VERBOSE,
+)
+
+# chへの書き込み(ch!msg)・読み込み(ch?msg)
+CH_WRITE_PATTERN = re.compile(r"^[^()!]+![^()!]+$")
+CH_READ_PATTERN = re.compile(r"^[A-Za-z0-9_]+\?[A-Za-z0-9_]+$")
+
+CYCLE_MARKER = "<<<<<START OF CYCLE>>>>>"
+
+
+# %%
+class Step:
+    """A single step line of a SPIN counter example.
+
+    Steps are created for every line of traces with millions of steps, so
+    they have no instance dict, share their process, file and action strings
+    through the symbol table of `parse_trace`, and keep numbers as ints.
+    """
+
+    __slots__ = ("step_num", "process", "file", "line", "action", "loop")
+
+    def __init__(
+        self,
+        step_num: int,
+        process: str,
+        file: str,
+        line: int,
+        action: str,
+        loop: bool = False,
+    ):
+        self.step_num = step_num
+        self.process = process  # "プロセス番号:プロセス名"
+        self.file = file
+        self.line = line
+        self.action = action
+        self.loop = loop  # CYCLE開始後のstepかどうか
+
+    @property
+    def file_line(self) -> str:
+        """Source position formatted as `file:line`."""
+        return f"{self.file}:{self.line}"
+
+    @property
+    def line_num(self) -> str:
+        """Promela line number formatted as `l.N`."""
+        return f"l.{self.line}"
+
+    def _fields(self) -> tuple:
+        return self.step_num, self.process, self.file, self.line, self.action, self.loop
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not Step:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{name}={value!r}" for name, value in zip(self.__slots__, self._fields())
+        )
+        return f"Step({fields})"
+
+
+class CycleStart(NamedTuple):
+    """Marker emitted at `<<<<<START OF CYCLE>>>>>`."""
+
+
+CYCLE_START = CycleStart()
+
+TraceEvent = Union[Step, CycleStart]
+
+
+# %%
+def parse_trace(lines: Iterable[str]) -> Iterator[TraceEvent]:
+    """Scan a SPIN counter example once and yield typed events.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+
+    Yields:
+        TraceEvent: `Step` for each step line, `CYCLE_START` at the cycle marker
+    """
+    match = STEP_PATTERN.match
+    loop = False
+    # 同じプロセス・ファイル・処理の文字列は反例の中で1つのオブジェクトを共有する
+    processes = {}
+    symbols = {}
+    intern = symbols.setdefault
+    for line in lines:
+        m = match(line)
+        if m:
+            step_num, process_key, file, line_num, action = m.group(1, 2, 5, 6, 7)
+            process = processes.get(process_key)
+            if process is None:
+                process_id, process_name = m.group(3, 4)
+                process = processes[process_key] = process_id + ":" + process_name
+            yield Step(
+                int(step_num),
+                process,
+                intern(file, file),
+                int(line_num),
+                intern(action, action),
+                loop,
+            )
+        elif CYCLE_MARKER in line:
+            loop = True
+            yield CYCLE_START
+
+
+def parse_steps(lines: Iterable[str]) -> Iterator[Step]:
+    """Same as `parse_trace` but yields only `Step` events.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+
+    Yields:
+        Step: Parsed step
+    """
+    for event in parse_trace(lines):
+        if type(event) is Step:
+            yield event
+
+
+# %%
+def split_channel(action: str) -> Optional[Tuple[str, str, str]]:
+    """Split a channel send/receive action.
+
+    Args:
+        action (str): Action string of a step
+
+    Returns:
+        Optional[Tuple[str, str, str]]: ("!" or "?", channel, message), or None
+            if the action is not a channel operation
+    """
+    if CH_WRITE_PATTERN.match(action):
+        channel, message = action.split("!")
+        return "!", channel, message
+    if CH_READ_PATTERN.match(action):
+        channel, message = action.split("?")
+        return "?", channel, message
+    return None
+
+
+# 左辺への代入(b = (x == 1) のように右辺に == を含むものも)と、x++ / a[i]-- のようなインクリメント・デクリメント
+UPDATE_PATTERN = re.compile(r"^\s*[A-Za-z_][\w.]*(?:\[[^\]]*\])?\s*(?:=(?!=)|\+\+\s*$|--\s*$)")
+
+
+def is_assignment(action: str) -> bool:
+    """Determine if the action updates a variable.
+
+    Args:
+        action (str): Action string of a step
+
+    Returns:
+        bool: True if the action is an assignment, increment or decrement
+    """
+    return ("=" in action and "==" not in action) or bool(UPDATE_PATTERN.match(action))
@@ -0,0 +1,201 @@
+# %%
+# 変数テーブルを列ごとに組み立てる
+# 行ごとに全変数をコピーした辞書を作らず、変数が変化した行と値だけを記録する
+import math
+from typing import Dict, List
+
+
+# %%
+class ChangeTrackingDict(dict):
+    """Dict remembering which keys have been assigned since the last reset.
+
+    Keys removed by `clear` are also remembered as changed; they are no
+    longer in the dict, so readers see them as unset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set(self)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.changed.add(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self.changed.update(self)
+        dict.clear(self)
+
+
+class ColumnarTableBuilder:
+    """Build a variable table column by column from the changes of each row.
+
+    Each row has some step information (e.g. step number, process) and the
+    values of all variables at that point. Only variables assigned since the
+    previous row are recorded, as (row, value) pairs per variable, and they
+    are expanded into full columns once in `to_dataframe`.
+
+    Example:
+        builder = ColumnarTableBuilder(initial_variables)
+        env = builder.variables  # 変数の更新はこの辞書に対して行う
+        for ...:
+            env["x"] = 1
+            builder.append({"step": 1})
+        df = builder.to_dataframe()
+    """
+
+    def __init__(self, variables: dict = None):
+        self.variables = ChangeTrackingDict(variables or {})
+        self.num_rows = 0
+        self._info: Dict[str, list] = {}
+        # 変数名(最初に現れた順。clearで消えた変数も残す)
+        self._names: Dict[str, None] = {}
+        self._rows: Dict[str, List[int]] = {}
+        self._values: Dict[str, list] = {}
+
+    def append(self, info: dict):
+        """Add a row with the current values of the variables.
+
+        Args:
+            info (dict): Step information of the row
+        """
+        row = self.num_rows
+        columns = self._info
+        if not columns:
+            for key in info:
+                columns[key] = []
+        for key, value in info.items():
+            columns[key].append(value)
+
+        env = self.variables
+        names = self._names
+        if not names.keys() >= env.changed:
+            for name in env:
+                names.setdefault(name)
+        for name in env.changed:
+            # clearで消えた変数は、その行から値なし(NaN)
+            value = env.get(name, math.nan)
+            values = self._values.get(name)
+            if values is None:
+                self._rows[name] = [row]
+                self._values[name] = [value]
+            elif values[-1] != value or type(values[-1]) is not type(value):
+                self._rows[name].append(row)
+                values.append(value)
+        env.changed.clear()
+        self.num_rows += 1
+
+    def columns(self) -> dict:
+        """Expand the recorded changes into full columns.
+
+        Each variable column is a numpy array repeated from its (row, value)
+        changes, with the dtype pandas would infer from the same values
+        (int64, float64 with NaN before the first assignment, bool, or
+        object), so no per-cell Python list is built.
+
+        Returns:
+            dict: Column name to values, in the same order as a DataFrame
+                built from `{**info, **variables}` rows
+        """
+        n = self.num_rows
+        result = dict(self._info)
+        for name in self._names:
+            rows = self._rows.get(name)
+            if rows is None:
+                continue
+            result[name] = _repeat_column(rows, self._values[name], n)
+        return result
+
+    def to_dataframe(self):
+        """Build a pandas DataFrame from the columns.
+
+        The arrays of `columns` are used as they are (one block per column)
+        instead of being copied into a consolidated 2D block, so the peak
+        memory is about the size of the table itself.
+
+        Returns:
+            pd.DataFrame: Variable table
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.columns(), copy=False)
+
+
+def _column_dtype(values: list, has_nan: bool) -> str:
+    # pd.DataFrame がPythonのリストから推論する型に合わせる
+    kinds = {type(v) for v in values}
+    if kinds == {int}:
+        return "float64" if has_nan else "int64"
+    if kinds <= {int, float}:
+        return "float64"
+    if kinds == {bool} and not has_nan:
+        return "bool"
+    return "object"
+
+
+def _repeat_column(rows: List[int], values: list, n: int):
+    import numpy as np
+
+    # 最初に代入されるまでは値なし(NaN)
+    has_nan = rows[0] > 0
+    if has_nan:
+        rows = [0] + rows
+        values = [math.nan] + values
+    dtype = _column_dtype(values, has_nan)
+    if dtype == "object":
+        # タプルなどを配列の次元として展開させないよう要素ごとに入れる
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+    else:
+        try:
+            array = np.array(values, dtype=dtype)
+        except OverflowError:
+            # int64に収まらない整数はPythonのintのまま持つ
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+    lengths = np.diff(np.append(np.asarray(rows, dtype=np.int64), n))
+    return np.repeat(array, lengths)
+
+
+# %%
+if __name__ == "__main__":
+    # 行ごとに辞書をコピーする方法とのピークメモリの比較(DataFrameの作成まで)
+    import tracemalloc
+
+    import pandas as pd
+
+    num_vars = 500
+    num_steps = 20000
+
+    def steps():
+        for i in range(num_steps):
+            yield f"v{i % num_vars}", i
+
+    tracemalloc.start()
+    env = {f"v{i}": 0 for i in range(num_vars)}
+    data = []
+    for name, value in steps():
+        env[name] = value
+        data.append({"step": value, **env})
+    df = pd.DataFrame(data)
+    _, dict_peak = tracemalloc.get_traced_memory()
+    del data, df
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    builder = ColumnarTableBuilder({f"v{i}": 0 for i in range(num_vars)})
+    env = builder.variables
+    for name, value in steps():
+        env[name] = value
+        builder.append({"step": value})
+    df = builder.to_dataframe()
+    _, builder_peak = tracemalloc.get_traced_memory()
+    del builder, df
+    tracemalloc.stop()
+
+    print(f"{num_vars} variables x {num_steps} steps (peak including the DataFrame)")
+    print(f"dict rows: {dict_peak / 1e6:.1f} MB")
+    print(f"columnar:  {builder_peak / 1e6:.1f} MB")
@@ -0,0 +1,140 @@
+# %%
+# 変数テーブルをCSV・Parquet・Arrow IPC形式で保存する
+# Parquet/Arrowではmtypeなどのシンボルを辞書エンコード(category)し、整数・真偽値を小さな型に変換する
+import os
+import re
+import shutil
+
+import pandas as pd
+
+# NuSMV(TRUE/FALSE)とSPIN(true/false)の真偽値
+BOOLEANS = {"TRUE": True, "FALSE": False, "true": True, "false": False}
+
+INT_PATTERN = re.compile(r"^-?\d+$")
+
+# 値の種類がこの割合以下の文字列の列をcategoryにする
+CATEGORY_RATIO = 0.5
+
+
+# %%
+def _convert_object_column(column: pd.Series) -> pd.Series:
+    values = column.dropna()
+    if values.empty:
+        return column
+
+    kinds = set(map(type, values))
+    if kinds <= {bool}:
+        return column.astype("boolean")
+    if kinds <= {int, bool}:
+        return pd.to_numeric(column, downcast="integer").astype(
+            _compact_int_dtype(column)
+        )
+    if not kinds <= {str}:
+        # intの変数にmtypeを代入した場合など、型が混在する列はArrowで扱えないため文字列にする
+        column = column.map(str, na_action="ignore")
+        values = column.dropna()
+        kinds = {str}
+    if kinds <= {str}:
+        unique = values.unique()
+        # NuSMVの出力やSPINのtrue/falseは文字列なので、真偽値・整数に見えるものは変換する
+        if all(v in BOOLEANS for v in unique):
+            return column.map(BOOLEANS, na_action="ignore").astype("boolean")
+        if all(INT_PATTERN.match(v) for v in unique):
+            numbers = pd.to_numeric(column)
+            return numbers.astype(_compact_int_dtype(numbers))
+        if len(unique) <= max(1, len(values) * CATEGORY_RATIO):
+            return column.astype("category")
+    return column
+
+
+def _compact_int_dtype(column: pd.Series) -> str:
+    # 値の範囲に収まる最小の整数型(欠損値があればnullableの型)
+    values = pd.to_numeric(column.dropna())
+    low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    nullable = column.isna().any()
+    for bits in (8, 16, 32, 64):
+        if -(2 ** (bits - 1)) <= low and high < 2 ** (bits - 1):
+            return f"Int{bits}" if nullable else f"int{bits}"
+    return "Int64" if nullable else "int64"
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert columns to compact dtypes for binary formats.
+
+    Symbolic columns (mtype values and other repeated strings) become
+    categorical, which Parquet and Arrow store dictionary-encoded. Integer and
+    boolean columns use the smallest dtype that fits their values. Columns
+    mixing types (e.g. ints and mtype names) are stored as strings.
+
+    Args:
+        df (pd.DataFrame): Variable table
+
+    Returns:
+        pd.DataFrame: Variable table with compact dtypes
+    """
+    columns = {}
+    for name, column in df.items():
+        dtype = column.dtype
+        if dtype == object:
+            column = _convert_object_column(column)
+        elif pd.api.types.is_bool_dtype(dtype):
+            pass
+        elif pd.api.types.is_integer_dtype(dtype):
+            column = column.astype(_compact_int_dtype(column))
+        columns[name] = column
+    return pd.DataFrame(columns)
+
+
+# %%
+def _require_pyarrow(output_format: str):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            f"pyarrow is required for the {output_format} format: pip install pyarrow"
+        ) from e
+
+
+def write_dataframe(df: pd.DataFrame, output_file: str, output_format: str = "csv"):
+    """Save a variable table in the given format.
+
+    Args:
+        df (pd.DataFrame): Variable table
+        output_file (str): Path to save the table
+        output_format (str): "csv", "parquet" or "arrow" (Arrow IPC file)
+    """
+    if output_format == "csv":
+        df.to_csv(output_file, index=False)
+        return
+
+    _require_pyarrow(output_format)
+    df = optimize_dtypes(df)
+    if output_format == "parquet":
+        df.to_parquet(output_file, index=False)
+    elif output_format == "arrow":
+        df.to_feather(output_file)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+
+def write_parquet_dataset(df: pd.DataFrame, directory: str, partition_cols: list):
+    """Save a variable table as a Parquet dataset partitioned by columns.
+
+    The partitions of an earlier run (`<column>=<value>` directories) are
+    removed first, since pyarrow adds a new file to each partition instead of
+    replacing it.
+
+    Args:
+        df (pd.DataFrame): Variable table
+        directory (str): Directory of the dataset
+        partition_cols (list): Columns to partition by (e.g. ["example"])
+    """
+    _require_pyarrow("parquet")
+    if os.path.isdir(directory):
+        prefix = f"{partition_cols[0]}="
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(prefix) and os.path.isdir(path):
+                shutil.rmtree(path)
+    df = optimize_dtypes(df.drop(columns=partition_cols)).join(df[partition_cols])
+    df.to_parquet(directory, index=False, partition_cols=partition_cols)
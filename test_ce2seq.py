@@ -0,0 +1,66 @@
+# %%
+# ce2seq.py のテスト
+import io
+
+from ce2seq import (
+    COUNTEREXAMPLE,
+    Page,
+    convert_to_plantuml_code,
+    iter_page_bodies,
+    iter_plantuml_code,
+    page_index_file,
+    write_page_index,
+)
+from renderers import RenderResult
+
+
+class NoRewindStream(io.StringIO):
+    """Seekable stream that fails if it is read a second time."""
+
+    def seek(self, *args):
+        raise AssertionError("the counter example must be read only once")
+
+
+# %%
+def test_seekable_stream_is_parsed_once():
+    code = "".join(iter_plantuml_code(NoRewindStream(COUNTEREXAMPLE), False))
+    assert code == convert_to_plantuml_code(COUNTEREXAMPLE, False)
+
+
+# %%
+def spin_lines(num_steps: int, cycle_after: int) -> list:
+    lines = []
+    for step in range(1, num_steps + 1):
+        lines.append(f"{step:3d}:\tproc  0 (:init::1) m.pml:{step} (state {step})\t[x = {step}]\n")
+        if step == cycle_after:
+            lines.append("  <<<<<START OF CYCLE>>>>>\n")
+    return lines
+
+
+def test_trailing_markers_do_not_make_a_page():
+    # サイクルの開始が最後の行にあり、それ以降のメッセージがない
+    bodies = list(iter_page_bodies(spin_lines(5, 5), False, 2, ["cycle"]))
+    assert [(first, last, count) for _, first, last, count in bodies] == [
+        (1, 2, 2),
+        (3, 4, 2),
+        (5, 5, 1),
+    ]
+
+
+def test_page_index_labels(tmp_path):
+    output = str(tmp_path / "diagram.png")
+    pages = [Page("", 1, 20, 20), Page("", None, None, 0)]
+    results = [RenderResult(b"png"), RenderResult(None, "error")]
+    write_page_index(pages, results, output)
+    with open(page_index_file(output), encoding="utf-8") as f:
+        index = f.read()
+    assert "## 1: s.1 - s.20 (20 messages)" in index
+    assert "## 2: - (0 messages)" in index
+    assert "None" not in index
+
+
+def test_never_claim_steps_are_not_output():
+    # never claimの行(proc  -)はプロセス番号がないため読み込まない
+    code = convert_to_plantuml_code(COUNTEREXAMPLE, False)
+    assert "_spin_nvr" not in code and "spec1" not in code
+    assert "s.2:" in code and "s.1:" not in code
@@ -0,0 +1,34 @@
+# %%
+# ce2table.py(SPINの変数テーブル)のテスト
+import pandas as pd
+
+from ce2table import convert_to_dataframe
+
+TRACE = """\
+  1:	proc  0 (:init::1) m.pml:5 (state 1)	[x = 1]
+  2:	proc  0 (:init::1) m.pml:6 (state 2)	[x++]
+  3:	proc  0 (:init::1) m.pml:7 (state 3)	[(x == 2)]
+  4:	proc  0 (:init::1) m.pml:8 (state 4)	[x--]
+  5:	proc  0 (:init::1) m.pml:9 (state 5)	[a[x]++]
+"""
+
+
+# %%
+def test_increment_and_decrement_update_the_table():
+    df = convert_to_dataframe(TRACE, {"x": 0})
+    assert list(df["step"]) == [1, 2, 4, 5]
+    assert list(df["x"]) == [1, 2, 1, 1]
+    assert list(df["action"]) == ["x = 1", "x++", "x--", "a[x]++"]
+    assert df["a[1]"].tolist()[-1] == 1
+    assert pd.isna(df["a[1]"].tolist()[0])
+
+
+def test_boolean_column_has_one_representation():
+    trace = """\
+  1:	proc  0 (:init::1) m.pml:5 (state 1)	[b = !x]
+  2:	proc  0 (:init::1) m.pml:6 (state 2)	[x = 1]
+  3:	proc  0 (:init::1) m.pml:7 (state 3)	[b = (x == 1)]
+  4:	proc  0 (:init::1) m.pml:8 (state 4)	[b = false]
+"""
+    df = convert_to_dataframe(trace, {"b": "false", "x": 0})
+    assert list(df["b"]) == ["true", "true", "true", "false"]
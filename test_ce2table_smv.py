@@ -0,0 +1,54 @@
+# %%
+# ce2table_smv.py のテスト
+import pandas as pd
+import pytest
+
+from ce2table_smv import build_dataframe, iter_rows, write_table
+from delta_log import DeltaLogReader
+from trace_state import build_smv_state
+
+# 2つ目の反例には y がない
+TWO_EXAMPLES = """\
+-> State: 1.1 <-
+  x = 0
+  y = 1
+-> State: 1.2 <-
+  x = 1
+-> State: 2.1 <-
+  x = 5
+-> State: 2.2 <-
+  x = 6
+"""
+
+
+# %%
+def test_variables_do_not_carry_over_to_the_next_example():
+    lines = TWO_EXAMPLES.splitlines()
+    rows = list(iter_rows(lines, {}))
+    assert [row.get("y") for row in rows] == ["1", "1", None, None]
+
+    df = build_dataframe(lines, {})
+    pd.testing.assert_frame_equal(df, pd.DataFrame(rows))
+    assert df["y"].isna().tolist() == [False, False, True, True]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_csv_leaves_cleared_variables_blank(tmp_path, stream):
+    path = tmp_path / "table.csv"
+    write_table(TWO_EXAMPLES.splitlines(), str(path), stream=stream)
+    df = pd.read_csv(path)
+    assert df["x"].tolist() == [0, 1, 5, 6]
+    assert df["y"].isna().tolist() == [False, False, True, True]
+
+
+def test_delta_log_and_trace_state_reset_per_example(tmp_path):
+    path = tmp_path / "table.jsonl"
+    write_table(TWO_EXAMPLES.splitlines(), str(path), output_format="delta")
+    reader = DeltaLogReader(str(path))
+    assert reader.state_at("1.2") == {"x": "1", "y": "1"}
+    assert reader.state_at("2.1")["y"] is None
+
+    state = build_smv_state(TWO_EXAMPLES.splitlines())
+    assert state.value_at("y", "1.2") == "1"
+    assert state.value_at("y", "2.2") is None
+    assert state.diff("1.2", "2.1") == {"x": ("1", "5"), "y": ("1", None)}
@@ -0,0 +1,75 @@
+# %%
+# delta_log.py のテスト
+import os
+
+import pytest
+
+from delta_log import INDEX_SUFFIX, DeltaLogReader, DeltaLogWriter
+from table_builder import ChangeTrackingDict
+
+INTERVAL = 3
+
+
+def write_log(path: str, num_rows: int = 10) -> list:
+    """Write a SPIN-like log (steps 2, 4, ...) and return the state after each row."""
+    env = ChangeTrackingDict()
+    states = []
+    with DeltaLogWriter(path, INTERVAL) as writer:
+        for row in range(num_rows):
+            env["x"] = row
+            if row % 4 == 0:
+                env["y"] = f"v{row}"
+            writer.write_row({"step": 2 * (row + 1)}, env)
+            states.append(dict(env))
+    return states
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = str(tmp_path / "table.jsonl")
+    return path, write_log(path)
+
+
+# %%
+def test_state_at_row_around_snapshots(log):
+    path, states = log
+    reader = DeltaLogReader(path)
+    assert len(reader) == len(states)
+    # スナップショットの直前・直後・ちょうどの行を含むすべての行
+    for row, expected in enumerate(states):
+        assert reader.state_at_row(row) == expected
+    with pytest.raises(IndexError):
+        reader.state_at_row(len(states))
+
+
+def test_state_at_on_each_side_of_a_snapshot(log):
+    path, states = log
+    reader = DeltaLogReader(path)
+    assert reader.state_at(1) is None
+    for row, expected in enumerate(states):
+        step = 2 * (row + 1)
+        assert reader.state_at(step) == expected
+        # 変数を更新しないstepは、その前の行の状態
+        assert reader.state_at(step + 1) == expected
+        assert reader.state_at(step - 1) == (states[row - 1] if row else None)
+    assert reader.state_at(1000) == states[-1]
+
+
+def test_index_is_rebuilt_when_missing(log):
+    path, states = log
+    os.remove(path + INDEX_SUFFIX)
+    reader = DeltaLogReader(path)
+    for row, expected in enumerate(states):
+        assert reader.state_at(2 * (row + 1)) == expected
+
+
+def test_state_at_with_another_key(tmp_path):
+    path = str(tmp_path / "table.jsonl")
+    env = ChangeTrackingDict()
+    with DeltaLogWriter(path, INTERVAL) as writer:
+        for row in range(7):
+            env["x"] = row
+            writer.write_row({"step": row, "time": 10 * row}, env)
+    reader = DeltaLogReader(path)
+    assert reader.state_at(35, key="time") == {"x": 3}
+    assert reader.state_at(-1, key="time") is None
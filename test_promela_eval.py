@@ -0,0 +1,159 @@
+# %%
+# promela_eval.py と ce2table.apply_action のテスト
+import pytest
+
+import profiling
+from ce2table import apply_action
+from promela_eval import PromelaSyntaxError, compile_action, execute, tokenize
+
+
+def run(action: str, **env) -> dict:
+    return execute(action, dict(env))
+
+
+# %%
+def test_tokenize():
+    assert tokenize("a[i] = (x >= 2 -> y : z)") == [
+        "a", "[", "i", "]", "=", "(", "x", ">=", "2", "->", "y", ":", "z", ")"
+    ]
+    assert tokenize("s.count++") == ["s.count", "++"]
+    with pytest.raises(PromelaSyntaxError):
+        tokenize('printf("x")')
+
+
+@pytest.mark.parametrize(
+    "expr, expected",
+    [
+        ("7 + 2", 9),
+        ("7 - 2", 5),
+        ("7 * 2", 14),
+        ("7 / 2", 3),
+        ("-7 / 2", -3),  # Cと同じく0方向に切り捨てる
+        ("7 % 3", 1),
+        ("-7 % 3", -1),
+        ("1 << 3", 8),
+        ("16 >> 2", 4),
+        ("6 & 3", 2),
+        ("6 | 3", 7),
+        ("6 ^ 3", 5),
+        ("~0", -1),
+        ("-(2 + 3)", -5),
+        ("2 < 3", "true"),
+        ("3 <= 3", "true"),
+        ("2 > 3", "false"),
+        ("2 >= 3", "false"),
+        ("2 == 2", "true"),
+        ("2 != 2", "false"),
+        ("1 && 0", "false"),
+        ("1 || 0", "true"),
+        ("!0", "true"),
+        ("(1 -> 10 : 20)", 10),
+        ("(0 -> 10 : 20)", 20),
+        ("1 + 2 * 3", 7),
+        ("(1 + 2) * 3", 9),
+        ("1 + 2 == 3 && 4 > 3", "true"),
+        ("1 << 2 + 1", 8),
+        ("5 - 2 - 1", 2),
+    ],
+)
+def test_operators(expr, expected):
+    result = run(f"x = {expr}")["x"]
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+def test_assignment_and_variables():
+    assert run("x = y + 1", y=2) == {"x": 3, "y": 2}
+    assert run("x++", x=1)["x"] == 2
+    assert run("x--", x=1)["x"] == 0
+    # 未設定の変数のインクリメントは0から
+    assert run("x++")["x"] == 1
+
+
+def test_arrays():
+    env = run("a[i + 1] = 5", i=1)
+    assert env["a[2]"] == 5
+    assert run("x = a[1] + a[2]", **{"a[1]": 3})["x"] == 3
+    assert run("a[0]++")["a[0]"] == 1
+
+
+def test_mtype_symbols_and_constants():
+    # 環境にない名前はmtypeのシンボルとして名前の文字列になる
+    assert run("state = ready")["state"] == "ready"
+    assert run("same = (state == ready)", state="ready")["same"] == "true"
+    assert run("same = (state != ready)", state="busy")["same"] == "true"
+    # true/false は従来の変数テーブルと同じく文字列のまま保持する
+    assert run("b = true")["b"] == "true"
+    assert run("b = false")["b"] == "false"
+
+
+def test_true_false_in_conditions():
+    assert run("x = !b", b="false")["x"] == "true"
+    assert run("x = !b", b="true")["x"] == "false"
+    assert run("x = (b -> 1 : 2)", b="false")["x"] == 2
+    assert run("x = b && 1", b="true")["x"] == "true"
+    assert run("x = b || 0", b="false")["x"] == "false"
+
+
+def test_booleans_have_one_representation():
+    # 定数・論理演算・比較の結果はどれも "true"/"false" の文字列になる
+    env = {"b": "false", "x": 3}
+    for action in ["b = !x", "c = (x > 2)", "d = b || (x == 3)", "e = true"]:
+        execute(action, env)
+    assert {env[k] for k in "bcde"} <= {"true", "false"}
+    assert (env["b"], env["c"], env["d"], env["e"]) == ("false", "true", "true", "true")
+
+
+def test_booleans_as_numbers():
+    # Promelaと同じく true/false は算術・比較では1/0
+    assert run("x = b + 1", b="true")["x"] == 2
+    assert run("x = (b == 1)", b="true")["x"] == "true"
+    assert run("x = (b < 1)", b="false")["x"] == "true"
+    assert run("b++", b="false")["b"] == 1
+
+
+def test_expression_statement_does_not_assign():
+    env = {"x": 1}
+    execute("(x > 0)", env)
+    execute("x == 2", env)
+    assert env == {"x": 1}
+
+
+@pytest.mark.parametrize(
+    "action", ["x = ", "x = (1", "x = 1 )", "= 1", "x = 1 2", "x = 2 ** 3", "x = 1.5"]
+)
+def test_unsupported_actions_raise(action):
+    with pytest.raises(PromelaSyntaxError):
+        compile_action(action)
+
+
+# %%
+def test_apply_action_uses_promela_semantics():
+    env = {"count": 7}
+    apply_action("count = count / 2", env)
+    apply_action("flag = (count > 2 -> 1 : 0)", env)
+    assert env == {"count": 3, "flag": 1}
+
+
+@pytest.mark.parametrize(
+    "action, expected",
+    [
+        ("x = 1.5", 1.5),
+        ("x = 2 ** 3", 8),
+        ("x = [1, 2]", [1, 2]),
+        ("x = 1 if y else 2", 1),
+    ],
+)
+def test_apply_action_falls_back_to_smart_exec(action, expected):
+    profiler = profiling.enable()
+    try:
+        env = apply_action(action, {"y": 1})
+    finally:
+        profiling.disable()
+    assert env["x"] == expected
+    assert profiler.counters["smart_exec_fallbacks"] == 1
+
+
+def test_fallback_still_rejects_unsafe_code():
+    with pytest.raises(ValueError, match="Disallowed"):
+        apply_action("x = __import__('os')", {})
@@ -0,0 +1,67 @@
+# %%
+# render_cache.py のテスト
+import os
+import time
+
+from render_cache import RenderCache, cache_key
+from renderers import HttpRenderer, PipeRenderer
+
+CODE = "@startuml\n\"a\" -> \"b\" : s.1: x = 1\n@enduml\n"
+
+
+# %%
+def test_cache_key_depends_on_renderer():
+    keys = {
+        cache_key(CODE, "png", HttpRenderer("http://a/png/").cache_id),
+        cache_key(CODE, "png", HttpRenderer("http://b/png/").cache_id),
+        cache_key(CODE, "png", PipeRenderer("a.jar").cache_id),
+        cache_key(CODE, "png", PipeRenderer("b.jar").cache_id),
+        cache_key(CODE, "svg", PipeRenderer("a.jar").cache_id),
+    }
+    assert len(keys) == 5
+    assert cache_key(CODE, "png", "x") == cache_key(CODE, "png", "x")
+
+
+def test_put_and_get(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    key = cache_key(CODE, "png")
+    assert cache.get(key) is None
+    assert cache.put(key, b"image")
+    assert cache.get(key) == b"image"
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = RenderCache(str(tmp_path), max_age=60)
+    cache.put("k", b"image")
+    old = time.time() - 120
+    os.utime(tmp_path / "k", (old, old))
+    assert cache.get("k") is None
+    assert not (tmp_path / "k").exists()
+
+
+def test_put_evicts_only_periodically(tmp_path, monkeypatch):
+    cache = RenderCache(str(tmp_path), evict_interval=3)
+    calls = []
+    monkeypatch.setattr(cache, "evict", lambda: calls.append(cache._stores))
+    for i in range(7):
+        cache.put(f"k{i}", b"image")
+    # 最初の保存と、その後3回ごと
+    assert calls == [0, 3, 6]
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = RenderCache(str(tmp_path), max_bytes=10, evict_interval=1)
+    now = time.time()
+    for i in range(3):
+        cache.put(f"k{i}", b"12345")
+        os.utime(tmp_path / f"k{i}", (now - 100 + i, now - 100 + i))
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == ["k1", "k2"]
+
+
+def test_unwritable_directory_is_ignored(tmp_path):
+    path = tmp_path / "file"
+    path.write_text("not a directory")
+    cache = RenderCache(str(path / "cache"))
+    assert not cache.put("k", b"image")
+    assert cache.get("k") is None
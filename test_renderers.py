@@ -0,0 +1,184 @@
+# %%
+# renderers.py のテスト(PlantUMLサーバはローカルのスタブで代用する)
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from ce2seq import create_renderer
+from renderers import PIPE_DELIMITER, HttpRenderer, PipeRenderer, RenderError
+
+CODE = "@startuml\n\"a\" -> \"b\" : s.1: x = 1\n@enduml\n"
+IMAGE = b"\x89PNG stub image"
+
+
+# %%
+class StubServer:
+    """PlantUML server stub answering with the queued status codes.
+
+    After the queue is empty, every request gets 200 and `IMAGE`.
+    """
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.paths = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.paths.append(self.path)
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                body = IMAGE if status == 200 else b"error"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/plantuml/png/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def make_renderer(server: str, retries: int = 2) -> HttpRenderer:
+    return HttpRenderer(server, timeout=5.0, retries=retries, backoff=0.0)
+
+
+# %%
+def test_render_returns_image():
+    with StubServer() as stub, make_renderer(stub.url) as renderer:
+        assert renderer.render(CODE) == IMAGE
+    assert stub.paths[0].startswith("/plantuml/png/")
+    assert renderer.output_format == "png"
+
+
+def test_retries_server_errors():
+    with StubServer([503, 500]) as stub, make_renderer(stub.url) as renderer:
+        assert renderer.render(CODE) == IMAGE
+    assert len(stub.paths) == 3
+
+
+def test_gives_up_after_retries():
+    with StubServer([503] * 5) as stub, make_renderer(stub.url) as renderer:
+        with pytest.raises(RenderError, match="503"):
+            renderer.render(CODE)
+    assert len(stub.paths) == 3
+
+
+def test_client_error_is_not_retried():
+    with StubServer([400]) as stub, make_renderer(stub.url) as renderer:
+        with pytest.raises(RenderError, match="400"):
+            renderer.render(CODE)
+    assert len(stub.paths) == 1
+
+
+def test_connection_refused_is_render_error():
+    with StubServer() as stub:
+        url = stub.url
+    with make_renderer(url, retries=1) as renderer:
+        with pytest.raises(RenderError, match="connect"):
+            renderer.render(CODE)
+
+
+@pytest.mark.parametrize("server", ["htp://127.0.0.1/png/", "127.0.0.1/png/"])
+def test_malformed_server_is_render_error(server):
+    with make_renderer(server) as renderer:
+        with pytest.raises(RenderError, match="failed"):
+            renderer.render(CODE)
+
+
+def test_render_many_reports_failures_per_diagram():
+    # 2つ目の図だけ失敗させる(並行に送られないよう1スレッドで描画する)
+    with StubServer([200, 400]) as stub, make_renderer(stub.url, retries=0) as renderer:
+        results = renderer.render_many([CODE, CODE + "' 2\n", CODE], max_workers=1)
+    assert [r.ok for r in results] == [True, False, True]
+    assert results[0].content == IMAGE
+    assert "400" in results[1].error
+
+
+def test_render_many_with_malformed_server():
+    with make_renderer("htp://127.0.0.1/png/") as renderer:
+        results = renderer.render_many([CODE, CODE])
+    assert not any(r.ok for r in results)
+
+
+# %%
+# plantuml.jar -pipe の代わりに起動するスタブ。@endumlまで読み込むごとに
+# 「pid:コード」を画像として区切り文字列と改行を付けて返し、"crash"を含む図では終了する
+PIPE_STUB = f"""
+import os, sys, time
+buf = []
+for line in sys.stdin.buffer:
+    if b"crash" in line:
+        sys.exit(1)
+    buf.append(line)
+    if line.strip() == b"@enduml":
+        time.sleep(0.1)
+        image = str(os.getpid()).encode() + b":" + b"".join(buf)
+        sys.stdout.buffer.write(image + b"{PIPE_DELIMITER}\\n")
+        sys.stdout.buffer.flush()
+        buf = []
+"""
+
+
+def make_pipe_renderer(pool_size: int = 1) -> PipeRenderer:
+    return PipeRenderer(pool_size=pool_size, command=[sys.executable, "-c", PIPE_STUB])
+
+
+def diagram(label: str) -> str:
+    return f"@startuml\n' {label}\n\"a\" -> \"b\" : s.1: x = 1\n@enduml\n"
+
+
+def split_image(image: bytes):
+    # (スタブのpid, 受け取ったコード)
+    pid, code = image.split(b":", 1)
+    return pid, code.decode("utf-8")
+
+
+def test_pipe_renderer_reuses_process():
+    with make_pipe_renderer() as renderer:
+        first = split_image(renderer.render(diagram(1)))
+        second = split_image(renderer.render(diagram(2)))
+    assert (first[1], second[1]) == (diagram(1), diagram(2))
+    assert first[0] == second[0]
+
+
+def test_pipe_renderer_pool_renders_concurrently():
+    codes = [diagram(i) for i in range(6)]
+    with make_pipe_renderer(pool_size=2) as renderer:
+        results = renderer.render_many(codes)
+    assert all(r.ok for r in results)
+    images = [split_image(r.content) for r in results]
+    # 入力と同じ順序で、2つのプロセスに分けて描画される
+    assert [code for _, code in images] == codes
+    assert len({pid for pid, _ in images}) == 2
+
+
+def test_pipe_renderer_restarts_after_crash():
+    with make_pipe_renderer() as renderer:
+        with pytest.raises(RenderError, match="exited"):
+            renderer.render(diagram("crash"))
+        assert split_image(renderer.render(diagram(1)))[1] == diagram(1)
+
+
+def test_pipe_renderer_command_not_found():
+    with PipeRenderer(command=["/nonexistent/plantuml"]) as renderer:
+        with pytest.raises(RenderError, match="start"):
+            renderer.render(CODE)
+
+
+def test_create_renderer_passes_pool_size():
+    with create_renderer("local", pool_size=3) as renderer:
+        assert isinstance(renderer, PipeRenderer)
+        assert renderer.max_workers == 3
@@ -0,0 +1,82 @@
+# %%
+# table_builder.py のテスト(pd.DataFrame(rows) と同じ表になること)
+import pandas as pd
+import pytest
+
+from table_builder import ChangeTrackingDict, ColumnarTableBuilder
+
+
+def build_both(initial: dict, updates: list):
+    """Build the table with the builder and with row dicts.
+
+    Args:
+        initial (dict): Variables before the first row
+        updates (list): Assignments (name, value) of each row; a "clear"
+            entry clears all variables
+    """
+    builder = ColumnarTableBuilder(initial)
+    env = dict(initial)
+    rows = []
+    for step, changes in enumerate(updates, 1):
+        for change in changes:
+            if change == "clear":
+                builder.variables.clear()
+                env.clear()
+                continue
+            name, value = change
+            builder.variables[name] = value
+            env[name] = value
+        builder.append({"step": step})
+        rows.append({"step": step, **env})
+    return builder.to_dataframe(), pd.DataFrame(rows)
+
+
+# %%
+@pytest.mark.parametrize(
+    "initial, updates",
+    [
+        # int64
+        ({"x": 0}, [[("x", 1)], [], [("x", 2)]]),
+        # 最初の行より後に現れる整数はNaNを含むfloat64
+        ({}, [[], [("x", 1)], [("x", 2)]]),
+        # intとfloatの混在はfloat64
+        ({"x": 0}, [[("x", 1.5)], [("x", 2)]]),
+        # bool
+        ({"b": False}, [[("b", True)], []]),
+        # NaNを含むboolはobject
+        ({}, [[], [("b", True)]]),
+        # 文字列(mtype・true/false)
+        ({"s": "ready"}, [[("s", "busy")], [("s", "true")]]),
+        # intと文字列の混在はobject
+        ({"x": 0}, [[("x", "ready")], [("x", 3)]]),
+        # intとboolの混在もobject
+        ({"x": 0}, [[("x", True)], [("x", 1)]]),
+        # int64に収まらない整数
+        ({"x": 0}, [[("x", 2**70)], [("x", 1)]]),
+        # 複数の変数の列の順序
+        ({"b": 0, "a": 0}, [[("c", 1)], [("a", 1), ("d", 2)], [("b", 5)]]),
+        # clearで消えた変数はNaN(NuSMVの反例の切り替わり)
+        ({}, [[("x", 1), ("y", "a")], ["clear", ("x", 2)], [("y", "b")]]),
+    ],
+)
+def test_matches_dataframe_from_rows(initial, updates):
+    df, expected = build_both(initial, updates)
+    pd.testing.assert_frame_equal(df, expected)
+    assert df.dtypes.tolist() == expected.dtypes.tolist()
+
+
+def test_empty_table():
+    builder = ColumnarTableBuilder({"x": 0})
+    assert builder.to_dataframe().empty
+
+
+def test_change_tracking_dict():
+    env = ChangeTrackingDict({"x": 0})
+    assert env.changed == {"x"}
+    env.changed.clear()
+    env.update(y=1)
+    env["x"] = 0
+    assert env.changed == {"x", "y"}
+    env.changed.clear()
+    env.clear()
+    assert env.changed == {"x", "y"} and not env
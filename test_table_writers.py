@@ -0,0 +1,37 @@
+# %%
+# table_writers.py のテスト
+import pandas as pd
+import pytest
+
+from table_writers import optimize_dtypes, write_dataframe
+
+
+# %%
+@pytest.mark.parametrize(
+    "values, dtype, expected",
+    [
+        # NuSMVの真偽値
+        (["TRUE", "FALSE", "TRUE"], "boolean", [True, False, True]),
+        # SPINのtrue/false(promela_evalの比較・論理演算の結果も同じ文字列)
+        (["true", "false", None], "boolean", [True, False, pd.NA]),
+        ([True, False], "bool", [True, False]),
+        (["1", "-2", "3"], "int8", [1, -2, 3]),
+        ([1, 300], "int16", [1, 300]),
+        # intとmtypeが混在する列は文字列
+        ([1, "ready", 1, 1], "category", ["1", "ready", "1", "1"]),
+    ],
+)
+def test_optimize_dtypes(values, dtype, expected):
+    column = optimize_dtypes(pd.DataFrame({"v": values}))["v"]
+    assert str(column.dtype) == dtype
+    assert column.tolist() == expected
+
+
+def test_boolean_strings_round_trip_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "table.parquet")
+    df = pd.DataFrame({"step": [1, 2], "b": ["false", "true"], "s": ["TRUE", "FALSE"]})
+    write_dataframe(df, path, "parquet")
+    result = pd.read_parquet(path)
+    assert result["b"].tolist() == [False, True]
+    assert result["s"].tolist() == [True, False]
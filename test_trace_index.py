@@ -0,0 +1,120 @@
+# %%
+# trace_index.py(--from-step/--to-step)のテスト
+import os
+import re
+
+import pandas as pd
+import pytest
+
+import ce2table
+import ce2table_smv
+from trace_index import INDEX_SUFFIX, TraceIndex, read_window
+
+
+def spin_trace(num_steps: int = 12, value=lambda step: step) -> str:
+    # 偶数stepでxを更新し、奇数stepは条件式。step 7からサイクル
+    lines = []
+    for step in range(1, num_steps + 1):
+        if step == 7:
+            lines.append("  <<<<<START OF CYCLE>>>>>\n")
+        action = f"x = {value(step)}" if step % 2 == 0 else "(1)"
+        lines.append(f"{step:3d}:\tproc  0 (:init::1) m.pml:{step} (state {step})\t[{action}]\n")
+    return "".join(lines)
+
+
+SMV_TRACE = """\
+-> State: 1.1 <-
+  x = 0
+-> State: 1.2 <-
+  x = 1
+-> State: 1.3 <-
+  x = 2
+-> State: 2.1 <-
+  x = 10
+-> State: 2.2 <-
+  x = 11
+"""
+
+
+def steps_of(text: str) -> list:
+    return [int(m.group(1)) for m in re.finditer(r"^\s*(\d+):", text, re.MULTILINE)]
+
+
+@pytest.fixture
+def spin_file(tmp_path):
+    path = tmp_path / "trace.txt"
+    path.write_text(spin_trace())
+    return str(path)
+
+
+# %%
+@pytest.mark.parametrize(
+    "first, last, expected",
+    [
+        ("3", "5", [3, 4, 5]),
+        (None, "2", [1, 2]),
+        ("11", None, [11, 12]),
+        ("0", "100", list(range(1, 13))),
+        ("12", "12", [12]),
+        ("13", None, []),
+        (None, "0", []),
+        ("6", "5", []),
+    ],
+)
+def test_window_bounds(spin_file, first, last, expected):
+    assert steps_of(read_window(spin_file, first, last).getvalue()) == expected
+
+
+def test_window_after_cycle_start_keeps_marker(spin_file):
+    assert "START OF CYCLE" in read_window(spin_file, "9", "10").getvalue()
+    assert "START OF CYCLE" not in read_window(spin_file, "3", "5").getvalue()
+
+
+def test_smv_window_bounds(tmp_path):
+    path = tmp_path / "trace.txt"
+    path.write_text(SMV_TRACE)
+    text = read_window(str(path), "1.2", "2.1").getvalue()
+    assert re.findall(r"State: (\S+)", text) == ["1.2", "1.3", "2.1"]
+    # 例の番号を省略すると最初の反例
+    text = read_window(str(path), "3").getvalue()
+    assert re.findall(r"State: (\S+)", text) == ["1.3", "2.1", "2.2"]
+
+
+def test_stale_index_is_rebuilt(spin_file):
+    read_window(spin_file, "1", "2")
+    assert os.path.exists(spin_file + INDEX_SUFFIX)
+
+    # 同じ長さで内容が変わった場合は更新時刻で検出する
+    with open(spin_file, "w") as f:
+        f.write(spin_trace(value=lambda step: step + 10))
+    st = os.stat(spin_file)
+    os.utime(spin_file, (st.st_atime, st.st_mtime + 10))
+    assert "x = 14" in read_window(spin_file, "4", "4").getvalue()
+
+    # stepが増えた場合はサイズで検出する
+    with open(spin_file, "w") as f:
+        f.write(spin_trace(20))
+    assert steps_of(read_window(spin_file, "19").getvalue()) == [19, 20]
+    assert len(TraceIndex.load(spin_file + INDEX_SUFFIX).keys) == 20
+
+
+# %%
+def test_spin_table_window_matches_full_table(spin_file, tmp_path):
+    full = tmp_path / "full.csv"
+    part = tmp_path / "part.csv"
+    ce2table.convert_file(spin_file, str(full), {"x": 0})
+    ce2table.convert_file(spin_file, str(part), {"x": 0}, from_step="5", to_step="9")
+    df = pd.read_csv(full)
+    expected = df[(df["step"] >= 5) & (df["step"] <= 9)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(pd.read_csv(part), expected)
+
+
+def test_smv_table_window_matches_full_table(tmp_path):
+    path = tmp_path / "trace.txt"
+    path.write_text(SMV_TRACE)
+    full = tmp_path / "full.csv"
+    part = tmp_path / "part.csv"
+    ce2table_smv.convert_file(str(path), str(full))
+    ce2table_smv.convert_file(str(path), str(part), from_step="1.3", to_step="2.1")
+    df = pd.read_csv(full)
+    pd.testing.assert_frame_equal(pd.read_csv(part), df.iloc[2:4].reset_index(drop=True))
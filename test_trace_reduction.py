@@ -0,0 +1,80 @@
+# %%
+# trace_reduction.py(--compress-cycle)のテスト
+import pandas as pd
+import pytest
+
+from ce2table import compress_cycle_rows
+from spin_parser import CYCLE_START, Step, parse_trace
+from trace_reduction import REPEAT_END, RepeatStart, compress_cycle, find_repetition
+
+
+def spin_trace(actions, cycle_at: int) -> list:
+    lines = []
+    for step, action in enumerate(actions, 1):
+        if step == cycle_at:
+            lines.append("  <<<<<START OF CYCLE>>>>>\n")
+        lines.append(f"{step:3d}:\tproc  0 (:init::1) m.pml:{ord(action)} (state 1)\t[{action}]\n")
+    return lines
+
+
+# %%
+@pytest.mark.parametrize(
+    "keys, expected",
+    [
+        ("", None),
+        ("a", None),
+        ("abc", None),
+        ("aa", (0, 1, 2)),
+        ("abab", (0, 2, 2)),
+        ("abcabcabc", (0, 3, 3)),
+        # 最後の不完全な繰り返しは含めない
+        ("abcabcab", (0, 3, 2)),
+        ("abcabcx", (0, 3, 2)),
+        # 最初の要素のあとから繰り返す
+        ("xabab", (1, 2, 2)),
+        ("xyzbcbcbc", (3, 2, 3)),
+        # 先頭の短い繰り返しより、長く続く繰り返しを選ぶ
+        ("aabcbcbcbc", (2, 2, 4)),
+    ],
+)
+def test_find_repetition(keys, expected):
+    assert find_repetition(list(keys)) == expected
+
+
+def test_find_repetition_lead_in_limit():
+    keys = list("xyz") + list("ab") * 3
+    assert find_repetition(keys, max_lead_in=3) == (3, 2, 3)
+    assert find_repetition(keys, max_lead_in=2) is None
+
+
+def test_find_repetition_long_sequence():
+    keys = list(range(5)) + list(range(100, 150)) * 1000
+    assert find_repetition(keys) == (5, 50, 1000)
+
+
+# %%
+def test_compress_cycle_after_lead_in():
+    # サイクル開始(step 3)のあと、step 3は1回だけで、step 4からbcが3回繰り返す
+    events = list(compress_cycle(parse_trace(spin_trace("aaxbcbcbcy", cycle_at=3))))
+    labels = [e.step_num if type(e) is Step else e for e in events]
+    assert labels == [1, 2, CYCLE_START, 3, RepeatStart(3, 4, 9), 4, 5, REPEAT_END, 10]
+
+
+def test_compress_cycle_without_repeat():
+    events = list(parse_trace(spin_trace("abcdef", cycle_at=3)))
+    assert len(events) == 7
+    assert list(compress_cycle(events)) == events
+
+
+def test_compress_cycle_rows_after_lead_in():
+    df = pd.DataFrame(
+        {
+            "step": range(1, 9),
+            "loop": [False] + [True] * 7,
+            "action": list("axbcbcbc"),
+        }
+    )
+    result = compress_cycle_rows(df)
+    assert result["action"].tolist() == list("axbc")
+    assert result["repeat"].tolist() == [1, 1, 3, 3]
+    assert result["step"].tolist() == [1, 2, 3, 4]
@@ -0,0 +1,125 @@
+# %%
+# trace_state.py のテスト
+import pytest
+
+from trace_state import TraceState, build_smv_state, build_spin_state
+
+
+def make_state(checkpoint_interval: int = 3) -> TraceState:
+    # stepは2, 4, ..., 20。xは毎回、yは3行ごと、zはstep 10の1回だけ変化する
+    state = TraceState("spin", {"x": 0, "y": "a"}, checkpoint_interval)
+    for row in range(10):
+        changes = [("x", row + 1)]
+        if row % 3 == 0:
+            changes.append(("y", f"v{row}"))
+        if row == 4:
+            changes.append(("z", True))
+        state.append(2 * (row + 1), changes)
+    return state
+
+
+def replay(state: TraceState, step: int) -> dict:
+    # チェックポイントを使わずに最初から再生した状態
+    values = dict(state.initial)
+    for row, key in enumerate(state.keys):
+        if key > step:
+            break
+        values.update(state._row_changes[row])
+    return values
+
+
+# %%
+@pytest.mark.parametrize("interval", [1, 3, 100])
+def test_state_at_matches_replay(interval):
+    state = make_state(interval)
+    for step in range(0, 23):
+        assert state.state_at(step) == replay(state, step)
+
+
+def test_value_at():
+    state = make_state()
+    assert state.value_at("x", 1) == 0
+    assert state.value_at("x", 7) == 3
+    assert state.value_at("z", 9) is None
+    assert state.value_at("z", 9, default="-") == "-"
+    assert state.value_at("z", 10) is True
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        (4, 4, {}),
+        # 変数を更新しないstepは、その前の行と同じ
+        (4, 5, {}),
+        (4, 6, {"x": (2, 3)}),
+        (0, 2, {"x": (0, 1), "y": ("a", "v0")}),
+        (8, 10, {"x": (4, 5), "z": (None, True)}),
+        # 逆順は値も入れ替わる
+        (10, 8, {"x": (5, 4), "z": (True, None)}),
+        (2, 100, {"x": (1, 10), "y": ("v0", "v9"), "z": (None, True)}),
+    ],
+)
+def test_diff_ranges(a, b, expected):
+    assert make_state().diff(a, b) == expected
+
+
+def test_diff_ignores_values_that_returned():
+    state = TraceState("spin", {"x": 0})
+    state.append(1, [("x", 1)])
+    state.append(2, [("x", 0)])
+    assert state.diff(0, 2) == {}
+    assert state.diff(0, 1) == {"x": (0, 1)}
+
+
+@pytest.mark.parametrize(
+    "first, last, expected",
+    [
+        (None, None, [(2, "v0"), (8, "v3"), (14, "v6"), (20, "v9")]),
+        (8, 14, [(8, "v3"), (14, "v6")]),
+        # 範囲の端がstepの間にある場合
+        (3, 13, [(8, "v3")]),
+        (9, None, [(14, "v6"), (20, "v9")]),
+        (None, 7, [(2, "v0")]),
+        (21, None, []),
+        (None, 1, []),
+        (15, 13, []),
+    ],
+)
+def test_history_ranges(first, last, expected):
+    assert make_state().history("y", first, last) == expected
+
+
+def test_history_of_unknown_variable():
+    assert make_state().history("w") == []
+
+
+def test_variables_in_order():
+    assert make_state().variables == ["x", "y", "z"]
+
+
+# %%
+def test_build_spin_state():
+    lines = [
+        "  1:\tproc  0 (:init::1) m.pml:1 (state 1)\t[x = 1]\n",
+        "  2:\tproc  0 (:init::1) m.pml:2 (state 2)\t[(x == 1)]\n",
+        "  3:\tproc  0 (:init::1) m.pml:3 (state 3)\t[x++]\n",
+    ]
+    state = build_spin_state(lines, {"x": 0})
+    assert state.history("x") == [(1, 1), (3, 2)]
+    assert state.diff(0, 3) == {"x": (0, 2)}
+
+
+def test_build_smv_state_labels():
+    lines = [
+        "-> State: 1.1 <-",
+        "  x = 0",
+        "-> State: 1.2 <-",
+        "  x = 1",
+        "-> State: 2.1 <-",
+        "  x = 5",
+    ]
+    state = build_smv_state(lines)
+    assert state.history("x") == [("1.1", "0"), ("1.2", "1"), ("2.1", "5")]
+    assert state.history("x", "1.2", "2.1") == [("1.2", "1"), ("2.1", "5")]
+    # 例の番号を省略すると最初の反例
+    assert state.diff("1", "2") == {"x": ("0", "1")}
@@ -0,0 +1,390 @@
+# %%
+# 反例ファイルのstepごとのバイト位置を索引にして、指定範囲だけを読み込む
+# SPINのstep行・<<<<<START OF CYCLE>>>>>・NuSMVの "-> State: x.y <-" の位置をサイドカーファイルに保存する
+import argparse
+import io
+import json
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from trace_io import open_input
+
+INDEX_SUFFIX = ".stepidx"
+INDEX_VERSION = 1
+
+SPIN_STEP_PATTERN = re.compile(rb"^\s*(\d+):\s*proc")
+SMV_STATE_PATTERN = re.compile(rb"^\s*->\s+State:\s+(\d+)\.(\d+)\s+<-")
+CYCLE_MARKER = b"<<<<<START OF CYCLE>>>>>"
+
+# NuSMVの "x.y" を1つの整数キーにする
+SMV_EXAMPLE_SHIFT = 32
+
+
+# %%
+def smv_key(example: int, state: int) -> int:
+    """Encode a NuSMV state `example.state` as an index key.
+
+    Args:
+        example (int): Counter example number (x of x.y)
+        state (int): State number (y of x.y)
+
+    Returns:
+        int: Key ordered like (example, state)
+    """
+    return (example << SMV_EXAMPLE_SHIFT) | state
+
+
+def split_smv_key(key: int) -> Tuple[int, int]:
+    """Decode an index key into `(example, state)`."""
+    return key >> SMV_EXAMPLE_SHIFT, key & ((1 << SMV_EXAMPLE_SHIFT) - 1)
+
+
+class TraceIndex:
+    """Byte offsets of the steps in a counter example file.
+
+    `keys` holds SPIN step numbers, or `smv_key(x, y)` for NuSMV states, in
+    file order; `offsets` holds the byte offset of the line starting each one.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        keys: array,
+        offsets: array,
+        cycle_offsets: List[int],
+        size: int,
+        mtime: float,
+    ):
+        self.kind = kind
+        self.keys = keys
+        self.offsets = offsets
+        self.cycle_offsets = cycle_offsets
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def build(cls, path: str) -> "TraceIndex":
+        """Scan a counter example file once and index its steps.
+
+        Args:
+            path (str): Path to the counter example file
+
+        Returns:
+            TraceIndex: Index of the file
+        """
+        keys = array("q")
+        offsets = array("q")
+        cycle_offsets = []
+        kind = "spin"
+        last_key = None
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                m = SPIN_STEP_PATTERN.match(line)
+                if m:
+                    key = int(m.group(1))
+                    # 最後の状態出力のように同じstepが続く行は最初の行だけを記録する
+                    if key != last_key:
+                        keys.append(key)
+                        offsets.append(offset)
+                        last_key = key
+                elif CYCLE_MARKER in line:
+                    cycle_offsets.append(offset)
+                else:
+                    m = SMV_STATE_PATTERN.match(line)
+                    if m:
+                        kind = "smv"
+                        keys.append(smv_key(int(m.group(1)), int(m.group(2))))
+                        offsets.append(offset)
+                offset += len(line)
+        return cls(kind, keys, offsets, cycle_offsets, st.st_size, st.st_mtime)
+
+    def save(self, index_path: str):
+        """Save the index as a JSON header line followed by the raw arrays."""
+        header = {
+            "version": INDEX_VERSION,
+            "kind": self.kind,
+            "count": len(self.keys),
+            "cycle_offsets": self.cycle_offsets,
+            "size": self.size,
+            "mtime": self.mtime,
+        }
+        with open(index_path, "wb") as f:
+            f.write(json.dumps(header).encode("ascii") + b"\n")
+            self.keys.tofile(f)
+            self.offsets.tofile(f)
+
+    @classmethod
+    def load(cls, index_path: str) -> "TraceIndex":
+        """Load an index saved by `save`."""
+        with open(index_path, "rb") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version: {index_path}")
+            keys = array("q")
+            offsets = array("q")
+            keys.fromfile(f, header["count"])
+            offsets.fromfile(f, header["count"])
+        return cls(
+            header["kind"],
+            keys,
+            offsets,
+            header["cycle_offsets"],
+            header["size"],
+            header["mtime"],
+        )
+
+    @classmethod
+    def for_file(cls, path: str) -> "TraceIndex":
+        """Load the sidecar index of a file, rebuilding it if missing or stale.
+
+        Args:
+            path (str): Path to the counter example file
+
+        Returns:
+            TraceIndex: Index of the file
+        """
+        index_path = path + INDEX_SUFFIX
+        st = os.stat(path)
+        try:
+            index = cls.load(index_path)
+            if index.size == st.st_size and index.mtime == st.st_mtime:
+                return index
+        except (OSError, ValueError):
+            pass
+        index = cls.build(path)
+        try:
+            index.save(index_path)
+        except OSError:
+            # 書き込めない場所でも索引はメモリ上で使う
+            pass
+        return index
+
+    def parse_key(self, step: str) -> int:
+        """Convert a step given on the command line to an index key.
+
+        Args:
+            step (str): SPIN step number, or NuSMV state "x.y" (or "y" for
+                the first counter example)
+
+        Returns:
+            int: Index key
+        """
+        if self.kind != "smv":
+            return int(step)
+        if "." in str(step):
+            example, state = str(step).split(".", 1)
+            return smv_key(int(example), int(state))
+        first = split_smv_key(self.keys[0])[0] if self.keys else 1
+        return smv_key(first, int(step))
+
+    def window(self, first: Optional[int], last: Optional[int]) -> Tuple[int, int]:
+        """Get the byte range covering the steps `first` to `last`.
+
+        Args:
+            first (Optional[int]): First key, or None from the beginning
+            last (Optional[int]): Last key, or None to the end
+
+        Returns:
+            Tuple[int, int]: Start and end offsets
+        """
+        start = 0
+        end = self.size
+        if first is not None:
+            i = bisect_left(self.keys, first)
+            start = self.offsets[i] if i < len(self.keys) else self.size
+        if last is not None:
+            i = bisect_right(self.keys, last)
+            if i < len(self.keys):
+                end = self.offsets[i]
+        return start, max(start, end)
+
+    def replay_start(self, start: int) -> int:
+        """Get the offset from which variable values must be replayed for `start`.
+
+        SPIN steps only carry the changed variable, so the whole prefix is
+        needed: the cost of a SPIN table window grows with its start step.
+        The index stores no variable values, since they depend on the initial
+        values given by the Promela file. A NuSMV counter example begins with
+        a full state, so replaying from its first state is enough.
+
+        Args:
+            start (int): Start offset of the window
+
+        Returns:
+            int: Offset to start replaying from
+        """
+        if self.kind != "smv":
+            return 0
+        i = bisect_right(self.offsets, start) - 1
+        if i < 0:
+            return 0
+        example = split_smv_key(self.keys[i])[0]
+        first = bisect_left(self.keys, smv_key(example, 0))
+        return self.offsets[first]
+
+
+# %%
+def _iter_lines(mm: mmap.mmap, start: int, end: int, only_updates: bool = False):
+    mm.seek(start)
+    while mm.tell() < end:
+        line = mm.readline()
+        # SPINの前半部分は変数の更新(代入・++・--)とサイクル開始の行だけあればよい
+        if (
+            only_updates
+            and b"=" not in line
+            and b"++" not in line
+            and b"--" not in line
+            and CYCLE_MARKER not in line
+        ):
+            continue
+        yield line.decode("utf-8", errors="replace")
+
+
+class Window(NamedTuple):
+    """Lines of a step range and the keys of its bounds."""
+
+    lines: Iterator[str]
+    kind: str  # "spin" または "smv"
+    first_key: Optional[int]
+    last_key: Optional[int]
+
+
+@contextmanager
+def open_window(
+    path: str,
+    first: Optional[str] = None,
+    last: Optional[str] = None,
+    with_prefix: bool = False,
+) -> Iterator[Window]:
+    """Read only the lines of the steps `first` to `last` of a counter example.
+
+    The offsets come from the sidecar index (built on first use), and the file
+    is accessed through mmap.
+
+    Args:
+        path (str): Path to the counter example file
+        first (Optional[str]): First step (see `TraceIndex.parse_key`)
+        last (Optional[str]): Last step
+        with_prefix (bool): Also yield the lines needed to rebuild the variable
+            values before the window (for the variable tables). Without it,
+            only a cycle marker before the window is added
+
+    Yields:
+        Window: Lines of the window. Rows built from the prefix lines have keys
+            below `first_key` and should be dropped by the caller
+    """
+    index = TraceIndex.for_file(path)
+    first_key = index.parse_key(first) if first is not None else None
+    last_key = index.parse_key(last) if last is not None else None
+    start, end = index.window(first_key, last_key)
+
+    with open(path, "rb") as f:
+        if index.size == 0:
+            yield Window(iter(()), index.kind, first_key, last_key)
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+            def lines():
+                if with_prefix:
+                    replay = index.replay_start(start)
+                    yield from _iter_lines(
+                        mm, replay, start, only_updates=index.kind != "smv"
+                    )
+                elif any(offset < start for offset in index.cycle_offsets):
+                    yield CYCLE_MARKER.decode("ascii") + "\n"
+                yield from _iter_lines(mm, start, end)
+
+            yield Window(lines(), index.kind, first_key, last_key)
+
+
+def read_window(
+    path: str, first: Optional[str] = None, last: Optional[str] = None
+) -> io.StringIO:
+    """Read the steps `first` to `last` into a seekable text stream.
+
+    Args:
+        path (str): Path to the counter example file
+        first (Optional[str]): First step
+        last (Optional[str]): Last step
+
+    Returns:
+        io.StringIO: Lines of the window
+    """
+    with open_window(path, first, last) as window:
+        return io.StringIO("".join(window.lines))
+
+
+@contextmanager
+def open_trace(
+    input_file: Optional[str],
+    sample: Optional[str] = None,
+    from_step: Optional[str] = None,
+    to_step: Optional[str] = None,
+) -> Iterator[Window]:
+    """Open a whole counter example, or the window `from_step` to `to_step`.
+
+    The window includes the prefix needed to rebuild the variable values; the
+    rows built from it have keys below `first_key` and must not be output.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        sample (Optional[str]): Counter example used when there is no input
+        from_step (Optional[str]): First step
+        to_step (Optional[str]): Last step
+
+    Yields:
+        Window: Lines of the counter example (`first_key` is None without a range)
+    """
+    if from_step is None and to_step is None:
+        with open_input(input_file, sample=sample) as f:
+            yield Window(f, "", None, None)
+        return
+    if not input_file or input_file == "-":
+        # 標準入力は位置を指定して読めないため索引を作れない
+        raise ValueError("--from-step/--to-step require an input file")
+    with open_window(input_file, from_step, to_step, with_prefix=True) as window:
+        yield window
+
+
+def add_window_arguments(parser):
+    """Add --from-step/--to-step to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument(
+        "--from-step",
+        help="First step to convert (NuSMV: state x.y). Uses a step index next to the input file. "
+        "SPIN variable tables still replay every assignment before this step.",
+        default=None,
+    )
+    parser.add_argument(
+        "--to-step",
+        help="Last step to convert (NuSMV: state x.y).",
+        default=None,
+    )
+
+
+# %%
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Build the step index of counter example files for --from-step/--to-step."
+    )
+    parser.add_argument("files", nargs="+", help="Counter example files")
+    args = parser.parse_args(argv)
+
+    for path in args.files:
+        index = TraceIndex.build(path)
+        index.save(path + INDEX_SUFFIX)
+        print(f"{path}{INDEX_SUFFIX}: {len(index.keys)} steps ({index.kind})")
+
+
+if __name__ == "__main__":
+    main()
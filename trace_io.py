@@ -0,0 +1,275 @@
+# %%
+# 反例ファイルの入出力を行う共通処理
+# ファイル全体をメモリに載せずに1行ずつ処理する
+import csv
+import io
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, TextIO
+
+STDIN = "-"
+
+# 追跡モードで新しい行を待つ間隔と、書き込みが止まったとみなすまでの秒数
+FOLLOW_POLL_INTERVAL = 0.2
+DEFAULT_FOLLOW_TIMEOUT = 10.0
+
+# spin -t -p の出力の最後の行(これを読んだら追跡を終える)
+FOLLOW_END_PATTERN = re.compile(r"^\s*\d+ processes created")
+
+
+# %%
+def stdin_is_piped() -> bool:
+    """Determine if data is piped or redirected from a file into stdin.
+
+    Returns:
+        bool: True if stdin is a pipe or a regular file
+    """
+    if sys.stdin is None:
+        return False
+    try:
+        mode = os.fstat(sys.stdin.fileno()).st_mode
+    except (OSError, ValueError):
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISREG(mode)
+
+
+@contextmanager
+def open_input(
+    path: Optional[str], rewindable: bool = False, sample: Optional[str] = None
+) -> Iterator[TextIO]:
+    """Open a counter example file or stdin for line-by-line reading.
+
+    Args:
+        path (Optional[str]): Path to the file, or "-" for stdin
+        rewindable (bool): Spool stdin to a temporary file so that the caller
+            can `seek(0)` and scan the input again
+        sample (Optional[str]): Text used when no path is given and nothing is
+            piped into stdin
+
+    Yields:
+        TextIO: Text stream of the counter example
+    """
+    if not path and sample is not None and not stdin_is_piped():
+        yield io.StringIO(sample)
+        return
+
+    if path and path != STDIN:
+        with open(path, "r") as f:
+            yield f
+        return
+
+    if not rewindable:
+        yield sys.stdin
+        return
+
+    # stdinは巻き戻せないので一時ファイルに退避する(メモリには載せない)
+    with tempfile.TemporaryFile("w+") as spool:
+        shutil.copyfileobj(sys.stdin, spool)
+        spool.seek(0)
+        yield spool
+
+
+def follow_input(
+    path: Optional[str],
+    idle_timeout: Optional[float] = DEFAULT_FOLLOW_TIMEOUT,
+    poll_interval: float = FOLLOW_POLL_INTERVAL,
+) -> Iterator[str]:
+    """Yield the lines of a counter example while it is still being written.
+
+    A file is tailed like `tail -f`: at its end, new data is polled every
+    `poll_interval` seconds. A line is yielded only once it is complete.
+    Following stops at the last line of `spin -t -p` ("N processes
+    created"), when the file has not grown for `idle_timeout` seconds, or on
+    Ctrl-C. A pipe (stdin) is read line by line until it is closed.
+
+    Args:
+        path (Optional[str]): Path to the file, or None/"-" for stdin
+        idle_timeout (Optional[float]): Seconds without new data before
+            stopping, or None to wait until the end line or Ctrl-C
+        poll_interval (float): Seconds between checks for new data
+
+    Yields:
+        str: Lines of the counter example
+    """
+    try:
+        if not path or path == STDIN:
+            # パイプは1行ずつ読み、書き込み側が閉じるまで続ける
+            for line in iter(sys.stdin.readline, ""):
+                yield line
+            return
+
+        idle_since = time.monotonic()
+        # 書き込む側より先に起動した場合はファイルができるのを待つ
+        while not os.path.exists(path):
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                raise FileNotFoundError(path)
+            time.sleep(poll_interval)
+
+        with open(path, "r", newline="") as f:
+            partial = ""
+            while True:
+                line = f.readline()
+                if line:
+                    idle_since = time.monotonic()
+                    partial += line
+                    if not partial.endswith("\n"):
+                        continue
+                    line, partial = partial, ""
+                    yield line
+                    if FOLLOW_END_PATTERN.match(line):
+                        return
+                    continue
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                time.sleep(poll_interval)
+            if partial:
+                yield partial
+    except KeyboardInterrupt:
+        # Ctrl-Cで追跡をやめ、それまでの出力を完成させる
+        return
+
+
+def add_follow_arguments(parser):
+    """Add --follow/--follow-timeout to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument(
+        "--follow",
+        help="Convert the input while it is being written (tail a file, or read a pipe line by line) and write the output as it arrives.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--follow-timeout",
+        help="With --follow, stop after this many seconds without new data in the file (0 to wait until 'processes created' or Ctrl-C).",
+        type=float,
+        default=DEFAULT_FOLLOW_TIMEOUT,
+    )
+
+
+# %%
+def write_rows_csv(
+    rows: Iterable[dict], output_file: str, line_buffered: bool = False
+) -> int:
+    """Write dict rows to a CSV file one by one.
+
+    Columns are ordered by first appearance like `pd.DataFrame(rows)`. If a new
+    column appears after the header has been written, the file is rewritten
+    once at the end with the earlier rows left blank for that column.
+
+    Args:
+        rows (Iterable[dict]): Rows to write
+        output_file (str): Path to the CSV file
+        line_buffered (bool): Flush every row, so that readers of the file
+            see the rows as soon as they are converted
+
+    Returns:
+        int: Number of rows written
+    """
+    columns = []
+    known = set()
+    header_size = 0
+    count = 0
+    buffering = 1 if line_buffered else -1
+    with open(output_file, "w", newline="", buffering=buffering) as out:
+        writer = csv.writer(out, lineterminator="\n")
+        for row in rows:
+            if not columns:
+                columns.extend(row)
+                known.update(row)
+                header_size = len(columns)
+                writer.writerow(columns)
+            elif len(row) != len(known) or not known.issuperset(row):
+                for key in row:
+                    if key not in known:
+                        known.add(key)
+                        columns.append(key)
+            writer.writerow([row.get(column, "") for column in columns])
+            count += 1
+
+    if len(columns) != header_size:
+        _widen_csv(output_file, columns)
+    return count
+
+
+def _widen_csv(output_file: str, columns: list):
+    # 途中で増えた列をヘッダに反映し、足りない列を空欄で埋める
+    directory = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".csv")
+    try:
+        with open(output_file, "r", newline="") as src, os.fdopen(
+            fd, "w", newline=""
+        ) as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst, lineterminator="\n")
+            next(reader)
+            writer.writerow(columns)
+            padding = [""] * len(columns)
+            for record in reader:
+                writer.writerow(record + padding[len(record) :])
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# %%
+# 変数テーブルの出力形式と既定の拡張子
+TABLE_FORMATS = {
+    "csv": ".csv",
+    "delta": ".jsonl",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+DEFAULT_TABLE_NAME = "variable_table"
+
+
+def add_table_output_arguments(parser):
+    """Add the output options of the variable table scripts to a parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        help="Path to save the output table. If not provided, it will output as variable_table.<ext> for the format.",
+        default=None,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format: dense CSV (csv), a change log with periodic snapshots (delta), Parquet (parquet) or Arrow IPC (arrow). parquet/arrow require pyarrow.",
+        choices=list(TABLE_FORMATS),
+        default="csv",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        help="Number of rows between full snapshots in the delta format.",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--stream",
+        help="Write CSV rows while reading the counter example to keep memory usage constant.",
+        action="store_true",
+    )
+
+
+def default_table_file(output_format: str) -> str:
+    """Get the default output path of a variable table.
+
+    Args:
+        output_format (str): Key of `TABLE_FORMATS`
+
+    Returns:
+        str: Output path
+    """
+    return DEFAULT_TABLE_NAME + TABLE_FORMATS[output_format]
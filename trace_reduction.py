@@ -0,0 +1,361 @@
+# %%
+# シーケンス図に出力する前に反例のstepを間引く
+# プロセス・ファイル・処理の正規表現で除外し、同じ自己メッセージの連続を1つにまとめる
+import re
+from typing import Hashable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import profiling
+from smv_parser import ExampleStart
+from spin_parser import CYCLE_START, Step, TraceEvent, split_channel
+
+
+# %%
+class Collapsed(NamedTuple):
+    """A run of identical self-messages collapsed into one message."""
+
+    step: Step  # 最初のstep
+    count: int
+    last_step_num: int
+
+    @property
+    def process(self) -> str:
+        return self.step.process
+
+    @property
+    def step_num(self) -> int:
+        return self.step.step_num
+
+    @property
+    def action(self) -> str:
+        return self.step.action
+
+
+class RepeatStart(NamedTuple):
+    """Start of one iteration of the cycle standing for `count` iterations."""
+
+    count: int
+    first_step_num: int
+    last_step_num: int  # 最後の繰り返しの最後のstep
+
+
+class RepeatEnd(NamedTuple):
+    """End of the iteration started by `RepeatStart`."""
+
+
+REPEAT_END = RepeatEnd()
+
+ReducedEvent = Union[TraceEvent, Collapsed, RepeatStart, RepeatEnd]
+
+
+def _compile_any(patterns: Iterable[str]) -> Optional[re.Pattern]:
+    # 複数の正規表現を1つにまとめてコンパイルし、1回の検索で判定する
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+class ReductionRules:
+    """Rules removing and collapsing steps before a diagram is emitted.
+
+    Each list of patterns is combined into one compiled regex, and `apply`
+    checks a step against all of them in a single pass over the trace.
+
+    Args:
+        processes (Iterable[str]): Regexes of processes ("pid:name") to drop
+        files (Iterable[str]): Regexes of source files to drop, e.g. `lib\\.pml`.
+            Never-claim steps (`_spin_nvr.tmp`) are never parsed, so they
+            need no rule
+        actions (Iterable[str]): Regexes of actions to drop
+        collapse (bool): Collapse runs of identical self-messages into one
+        compress_cycle (bool): Show repeated iterations of the acceptance
+            cycle once, between `RepeatStart` and `REPEAT_END`
+    """
+
+    def __init__(
+        self,
+        processes: Iterable[str] = (),
+        files: Iterable[str] = (),
+        actions: Iterable[str] = (),
+        collapse: bool = False,
+        compress_cycle: bool = False,
+    ):
+        self.processes = list(processes)
+        self.files = list(files)
+        self.actions = list(actions)
+        self.collapse = collapse
+        self.compress_cycle = compress_cycle
+        self._process = _compile_any(self.processes)
+        self._file = _compile_any(self.files)
+        self._action = _compile_any(self.actions)
+
+    @classmethod
+    def from_args(cls, args) -> "ReductionRules":
+        """Create rules from the options added by `add_reduction_arguments`."""
+        return cls(
+            args.exclude_process,
+            args.exclude_file,
+            args.exclude_action,
+            args.collapse,
+            args.compress_cycle,
+        )
+
+    def extend(self, actions: Iterable[str] = ()) -> "ReductionRules":
+        """Return new rules also dropping the given action regexes."""
+        return ReductionRules(
+            self.processes,
+            self.files,
+            self.actions + list(actions),
+            self.collapse,
+            self.compress_cycle,
+        )
+
+    def drops_process(self, process: str) -> bool:
+        """Check if all steps of a process are dropped."""
+        return bool(self._process and self._process.search(process))
+
+    def apply(
+        self, events: Iterable[TraceEvent], participants: Optional[set] = None
+    ) -> Iterator[ReducedEvent]:
+        """Filter and collapse the events of a counter example.
+
+        Args:
+            events (Iterable[TraceEvent]): Output of `spin_parser.parse_trace`
+            participants (Optional[set]): If given, processes not dropped by
+                the process rules are added to it, even if all their steps
+                are dropped by the other rules
+
+        Yields:
+            ReducedEvent: `Step`, `CYCLE_START`, `Collapsed`, and
+                `RepeatStart`/`REPEAT_END` around a compressed cycle
+        """
+        events = self._filter(events, participants)
+        if self.compress_cycle:
+            events = compress_cycle(events)
+        return events
+
+    def _filter(
+        self, events: Iterable[TraceEvent], participants: Optional[set]
+    ) -> Iterator[ReducedEvent]:
+        process_match = self._process.search if self._process else None
+        file_match = self._file.search if self._file else None
+        action_match = self._action.search if self._action else None
+        collapse = self.collapse
+        run = None
+        count = 0
+        last_step_num = 0
+        # --profile用に規則ごとの除外数を数える(除外したときだけ加算する)
+        dropped_process = dropped_file = dropped_action = collapsed = 0
+
+        for event in events:
+            if event is CYCLE_START or type(event) is ExampleStart:
+                # サイクル・反例の前後はまとめない
+                if run is not None:
+                    yield _finish_run(run, count, last_step_num)
+                    run = None
+                yield event
+                continue
+
+            if process_match and process_match(event.process):
+                dropped_process += 1
+                continue
+            if participants is not None:
+                participants.add(event.process)
+            if file_match and file_match(event.file):
+                dropped_file += 1
+                continue
+            if action_match and action_match(event.action):
+                dropped_action += 1
+                continue
+            if not collapse:
+                yield event
+                continue
+
+            if run is not None:
+                if (
+                    event.process == run.process
+                    and event.action == run.action
+                    and event.line == run.line
+                    and event.file == run.file
+                ):
+                    count += 1
+                    collapsed += 1
+                    last_step_num = event.step_num
+                    continue
+                yield _finish_run(run, count, last_step_num)
+                run = None
+
+            # チャネルの送受信は自己メッセージではないのでまとめない
+            if split_channel(event.action):
+                yield event
+            else:
+                run, count, last_step_num = event, 1, event.step_num
+
+        if run is not None:
+            yield _finish_run(run, count, last_step_num)
+        profiling.count("steps_dropped_process", dropped_process)
+        profiling.count("steps_dropped_file", dropped_file)
+        # -s のSKIP_RULESによる除外もここに含まれる
+        profiling.count("steps_dropped_action", dropped_action)
+        profiling.count("steps_collapsed", collapsed)
+
+
+def _finish_run(step: Step, count: int, last_step_num: int) -> ReducedEvent:
+    return Collapsed(step, count, last_step_num) if count > 1 else step
+
+
+# %%
+# 繰り返しの前に置ける、繰り返さないstepの数(サイクルを閉じるstepなど)
+MAX_LEAD_IN = 16
+
+
+def find_repetition(
+    keys: Sequence[Hashable], max_lead_in: int = MAX_LEAD_IN
+) -> Optional[Tuple[int, int, int]]:
+    """Find a block repeated at least twice near the start of `keys`.
+
+    The block may follow up to `max_lead_in` keys that are not repeated. For
+    each start offset, the prefix function of the Knuth-Morris-Pratt
+    algorithm gives the longest run from there made of a repeated block in
+    O(n). The offset covering the most keys is used, and the search stops as
+    soon as no later offset can cover more.
+
+    Args:
+        keys (Sequence[Hashable]): Keys of the steps, e.g. (process, file, line, action)
+        max_lead_in (int): Largest start offset of the repeated block
+
+    Returns:
+        Optional[Tuple[int, int, int]]: Start offset, length of the block and
+            number of full repetitions, or None if there is no repeat
+    """
+    best = None
+    covered = 0
+    for start in range(min(max_lead_in, len(keys)) + 1):
+        if len(keys) - start <= covered:
+            break
+        found = _repeated_prefix(keys[start:])
+        if found and found[0] * found[1] > covered:
+            best = (start, *found)
+            covered = found[0] * found[1]
+    return best
+
+
+def _repeated_prefix(keys: Sequence[Hashable]) -> Optional[Tuple[int, int]]:
+    # 最も長い「同じブロックの2回以上の繰り返し」になっている先頭部分の(周期, 回数)
+    n = len(keys)
+    if n < 2:
+        return None
+    prefix = [0] * n
+    for i in range(1, n):
+        k = prefix[i - 1]
+        while k and keys[i] != keys[k]:
+            k = prefix[k - 1]
+        if keys[i] == keys[k]:
+            k += 1
+        prefix[i] = k
+
+    for length in range(n, 1, -1):
+        period = length - prefix[length - 1]
+        if length >= 2 * period:
+            return period, length // period
+    return None
+
+
+def _event_key(event: ReducedEvent) -> tuple:
+    if type(event) is Collapsed:
+        step = event.step
+        return step.process, step.file, step.line, step.action, event.count
+    return event.process, event.file, event.line, event.action
+
+
+def compress_cycle(events: Iterable[ReducedEvent]) -> Iterator[ReducedEvent]:
+    """Show the repeated iterations at the start of the cycle only once.
+
+    The steps after `CYCLE_START` (up to the end of the trace, or the next
+    NuSMV counter example) are buffered, and if they begin with a block of
+    steps (compared by process, file_line and action) repeated k times, the
+    first iteration is yielded between `RepeatStart(k, ...)` and
+    `REPEAT_END`. The block may follow a few steps that are not repeated
+    (see `find_repetition`). The other steps are yielded unchanged.
+
+    Args:
+        events (Iterable[ReducedEvent]): Events of the counter example
+
+    Yields:
+        ReducedEvent: Events with the repetitions of the cycle removed
+    """
+    cycle = None
+    for event in events:
+        if cycle is None:
+            yield event
+            if event is CYCLE_START:
+                cycle = []
+        elif type(event) is ExampleStart:
+            yield from _compress(cycle)
+            yield event
+            cycle = None
+        else:
+            cycle.append(event)
+    if cycle:
+        yield from _compress(cycle)
+
+
+def _compress(cycle: List[ReducedEvent]) -> Iterator[ReducedEvent]:
+    # サイクル以降のstepを整数に置き換えて周期を探す
+    ids = {}
+    keys = [ids.setdefault(_event_key(e), len(ids)) for e in cycle]
+    found = find_repetition(keys)
+    if found is None:
+        yield from cycle
+        return
+
+    start, period, count = found
+    end = start + period * count
+    last = cycle[end - 1]
+    yield from cycle[:start]
+    yield RepeatStart(
+        count,
+        cycle[start].step_num,
+        last.last_step_num if type(last) is Collapsed else last.step_num,
+    )
+    yield from cycle[start : start + period]
+    yield REPEAT_END
+    yield from cycle[end:]
+
+
+# %%
+def add_reduction_arguments(parser):
+    """Add the options of `ReductionRules` to an argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument(
+        "--exclude-process",
+        help="Regex of processes ('pid:name') to leave out of the diagram. Can be repeated.",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--exclude-file",
+        help="Regex of source files whose steps are left out, e.g. 'lib\\.pml'. Can be repeated. "
+        "Never-claim steps (proc -, _spin_nvr.tmp) are always left out.",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--exclude-action",
+        help="Regex of actions to leave out of the diagram. Can be repeated.",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--collapse",
+        help="Collapse runs of identical self-messages into one message with a repeat count.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compress-cycle",
+        help="Show the repeated iterations of the acceptance cycle once with a repeat count.",
+        action="store_true",
+    )
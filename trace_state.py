@@ -0,0 +1,429 @@
+# %%
+# 反例の任意のstepの変数の値・2つのstepの差分・変数ごとの変化の履歴を調べる
+# 一定行ごとの全変数のチェックポイントと、変数ごとの変化した行の一覧を持ち、表全体を作らずに答える
+import argparse
+import json
+import shlex
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ce2table import initialize_globals_from_pml, iter_updates
+from smv_parser import STATE_PATTERN, iter_states
+from spin_parser import STEP_PATTERN
+from table_builder import ChangeTrackingDict
+from trace_index import smv_key, split_smv_key
+from trace_io import open_input
+
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+# 変数がまだ存在しないことを表す値
+_MISSING = object()
+
+
+# %%
+class TraceState:
+    """Variable values of a counter example at every step, for fast queries.
+
+    Rows are the steps that update variables (as in the variable tables).
+    Every `checkpoint_interval` rows the full state is kept, so `state_at`
+    replays at most that many rows. The rows where each variable changed are
+    kept per variable, so `value_at`, `diff` and `history` use binary search
+    and do not depend on the length of the trace.
+
+    Args:
+        kind (str): "spin" (keys are step numbers) or "smv" (keys are
+            `smv_key(x, y)` of the state "x.y")
+        variables (Optional[dict]): Variable values before the first row
+        checkpoint_interval (int): Number of rows between full states
+    """
+
+    def __init__(
+        self,
+        kind: str = "spin",
+        variables: Optional[dict] = None,
+        checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+    ):
+        self.kind = kind
+        self.initial = dict(variables or {})
+        self.checkpoint_interval = max(checkpoint_interval, 1)
+        self.keys = array("q")
+        self._row_changes: List[tuple] = []
+        self._checkpoints: List[dict] = []
+        self._rows: Dict[str, array] = {}
+        self._values: Dict[str, list] = {}
+        self._state = dict(self.initial)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def append(self, key: int, changes: Iterable[Tuple[str, object]]):
+        """Add a row with the variables assigned at a step.
+
+        Args:
+            key (int): Step key, not smaller than the key of the previous row
+            changes (Iterable[Tuple[str, object]]): Assigned variables and
+                values; values equal to the current ones are not recorded
+        """
+        row = len(self.keys)
+        state = self._state
+        if row % self.checkpoint_interval == 0:
+            # チェックポイントはこの行の変更を反映する前の状態
+            self._checkpoints.append(dict(state))
+
+        recorded = []
+        for name, value in changes:
+            old = state.get(name, _MISSING)
+            if old is not _MISSING and old == value and type(old) is type(value):
+                continue
+            state[name] = value
+            recorded.append((name, value))
+            rows = self._rows.get(name)
+            if rows is None:
+                self._rows[name] = array("q", [row])
+                self._values[name] = [value]
+            else:
+                rows.append(row)
+                self._values[name].append(value)
+        self.keys.append(key)
+        self._row_changes.append(tuple(recorded))
+
+    def parse_key(self, step) -> int:
+        """Convert a step to a key.
+
+        Args:
+            step: SPIN step number, or NuSMV state "x.y" (or "y" for the
+                first counter example)
+
+        Returns:
+            int: Key
+        """
+        if self.kind != "smv":
+            return int(step)
+        if "." in str(step):
+            example, state = str(step).split(".", 1)
+            return smv_key(int(example), int(state))
+        first = split_smv_key(self.keys[0])[0] if self.keys else 1
+        return smv_key(first, int(step))
+
+    def step_label(self, key: int):
+        """Convert a key back to a step number, or "x.y" for NuSMV."""
+        if self.kind != "smv":
+            return key
+        return "{}.{}".format(*split_smv_key(key))
+
+    def _row(self, step) -> int:
+        # stepの時点で最後に適用された行(-1は最初の行より前)
+        return bisect_right(self.keys, self.parse_key(step)) - 1
+
+    def _state_at_row(self, row: int) -> dict:
+        if row < 0:
+            return dict(self.initial)
+        start = row - row % self.checkpoint_interval
+        state = dict(self._checkpoints[row // self.checkpoint_interval])
+        for changes in self._row_changes[start : row + 1]:
+            state.update(changes)
+        return state
+
+    def _value_at_row(self, name: str, row: int, default=None):
+        rows = self._rows.get(name)
+        if rows is not None:
+            i = bisect_right(rows, row) - 1
+            if i >= 0:
+                return self._values[name][i]
+        return self.initial.get(name, default)
+
+    def state_at(self, step) -> dict:
+        """Return all variable values after the given step.
+
+        Args:
+            step: Step (see `parse_key`). A step that updates no variable
+                gives the values after the last step before it
+
+        Returns:
+            dict: Variable values
+        """
+        return self._state_at_row(self._row(step))
+
+    def value_at(self, name: str, step, default=None):
+        """Return the value of one variable after the given step.
+
+        Args:
+            name (str): Variable name
+            step: Step (see `parse_key`)
+            default: Value returned if the variable is not set yet
+
+        Returns:
+            Value of the variable
+        """
+        return self._value_at_row(name, self._row(step), default)
+
+    def diff(self, a, b) -> Dict[str, Tuple[object, object]]:
+        """Return the variables whose values differ between two steps.
+
+        Only variables changed between the two steps are compared, so a
+        variable that changed and then returned to its value is not included.
+
+        Args:
+            a: First step
+            b: Second step
+
+        Returns:
+            Dict[str, Tuple[object, object]]: Variable name to (value at a, value at b)
+        """
+        row_a = self._row(a)
+        row_b = self._row(b)
+        low, high = min(row_a, row_b), max(row_a, row_b)
+        result = {}
+        for name, rows in self._rows.items():
+            i = bisect_right(rows, low)
+            if i == len(rows) or rows[i] > high:
+                continue
+            old = self._value_at_row(name, row_a, _MISSING)
+            new = self._value_at_row(name, row_b, _MISSING)
+            if old != new or type(old) is not type(new):
+                result[name] = (
+                    None if old is _MISSING else old,
+                    None if new is _MISSING else new,
+                )
+        return result
+
+    def history(self, name: str, first=None, last=None) -> List[Tuple[object, object]]:
+        """Return the changes of one variable.
+
+        Args:
+            name (str): Variable name
+            first: First step to include, or None from the beginning
+            last: Last step to include, or None to the end
+
+        Returns:
+            List[Tuple[object, object]]: (step, value) of each change
+        """
+        rows = self._rows.get(name)
+        if rows is None:
+            return []
+        start = 0 if first is None else bisect_left(self.keys, self.parse_key(first))
+        end = len(self.keys) if last is None else self._row(last) + 1
+        i = bisect_left(rows, start)
+        j = bisect_left(rows, end)
+        values = self._values[name]
+        return [(self.step_label(self.keys[rows[k]]), values[k]) for k in range(i, j)]
+
+    @property
+    def variables(self) -> List[str]:
+        """Names of all variables, in the order they were first set."""
+        names = list(self.initial)
+        names += [name for name in self._rows if name not in self.initial]
+        return names
+
+
+# %%
+def build_spin_state(
+    lines: Iterable[str],
+    variables: Optional[dict] = None,
+    checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+) -> TraceState:
+    """Build the state of a SPIN counter example.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        variables (Optional[dict]): Initialized variables from the Promela (.pml) file
+        checkpoint_interval (int): Number of rows between full states
+
+    Returns:
+        TraceState: State of the counter example
+    """
+    state = TraceState("spin", variables, checkpoint_interval)
+    env = ChangeTrackingDict(variables or {})
+    env.changed.clear()
+    for info in iter_updates(lines, env):
+        state.append(info["step"], [(name, env[name]) for name in env.changed])
+        env.changed.clear()
+    return state
+
+
+def build_smv_state(
+    lines: Iterable[str], checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL
+) -> TraceState:
+    """Build the state of a NuSMV counter example.
+
+    Args:
+        lines (Iterable[str]): Lines of the counter example
+        checkpoint_interval (int): Number of rows between full states
+
+    Returns:
+        TraceState: State of the counter example
+    """
+    state = TraceState("smv", None, checkpoint_interval)
+    env = ChangeTrackingDict()
+    for info in iter_states(lines, env, reset_variables=True):
+        key = smv_key(int(info["example"]), int(info["step"]))
+        # 前の反例にだけある変数は、次の反例ではNone(未設定)になる
+        state.append(key, [(name, env.get(name)) for name in env.changed])
+        env.changed.clear()
+    return state
+
+
+def _detect(lines: Iterable[str]) -> Tuple[str, Iterator[str]]:
+    # 最初のstep行・State行で反例の種類を判別する(読み込んだ行は戻す)
+    lines = iter(lines)
+    head = []
+    for line in lines:
+        head.append(line)
+        if STEP_PATTERN.match(line):
+            return "spin", chain(head, lines)
+        if STATE_PATTERN.match(line):
+            return "smv", chain(head, lines)
+    return "spin", iter(head)
+
+
+def load_trace_state(
+    input_file: Optional[str],
+    pml_file: Optional[str] = None,
+    checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+) -> TraceState:
+    """Read a SPIN or NuSMV counter example and build its state.
+
+    Args:
+        input_file (Optional[str]): Path to the counter example, "-" for stdin
+        pml_file (Optional[str]): Promela file with the initial values (SPIN)
+        checkpoint_interval (int): Number of rows between full states
+
+    Returns:
+        TraceState: State of the counter example
+    """
+    with open_input(input_file) as f:
+        kind, lines = _detect(f)
+        if kind == "smv":
+            return build_smv_state(lines, checkpoint_interval)
+        variables = initialize_globals_from_pml(pml_file) if pml_file else {}
+        return build_spin_state(lines, variables, checkpoint_interval)
+
+
+# %%
+def run_query(state: TraceState, query: List[str]):
+    """Run one query such as ["at", "120"] and return its result.
+
+    Args:
+        state (TraceState): State of the counter example
+        query (List[str]): "at STEP", "value VAR STEP", "diff A B" or
+            "history VAR [FIRST [LAST]]", split into words
+
+    Returns:
+        Result of the query (dict or list)
+    """
+    command, args = query[0], query[1:]
+    if command == "at" and len(args) == 1:
+        return state.state_at(args[0])
+    if command == "value" and len(args) == 2:
+        return {args[0]: state.value_at(args[0], args[1])}
+    if command == "diff" and len(args) == 2:
+        return {name: list(values) for name, values in state.diff(*args).items()}
+    if command == "history" and 1 <= len(args) <= 3:
+        return [list(change) for change in state.history(*args)]
+    raise ValueError(f"Unknown query: {' '.join(query)}")
+
+
+def print_result(result, as_json: bool = False):
+    """Print the result of `run_query`."""
+    if as_json:
+        print(json.dumps(result, ensure_ascii=False))
+    elif isinstance(result, dict):
+        for name, value in result.items():
+            if isinstance(value, list):
+                print(f"{name}: {value[0]} -> {value[1]}")
+            else:
+                print(f"{name} = {value}")
+    else:
+        for step, value in result:
+            print(f"{step}: {value}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Query variable values of a SPIN or NuSMV counter example at any step."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_file",
+        help="Path to the SPIN or NuSMV counter example file ('-' for stdin).",
+        default=None,
+    )
+    parser.add_argument(
+        "-p",
+        "--pml_file",
+        help="Path to the Promela file with the initial values (SPIN).",
+        default=None,
+    )
+    parser.add_argument(
+        "--at",
+        help="Print all variables after STEP.",
+        action="append",
+        default=[],
+        metavar="STEP",
+    )
+    parser.add_argument(
+        "--diff",
+        help="Print the variables that differ between steps A and B.",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("A", "B"),
+    )
+    parser.add_argument(
+        "--history",
+        help="Print the steps where VAR changed and its values.",
+        action="append",
+        default=[],
+        metavar="VAR",
+    )
+    parser.add_argument("--json", help="Print results as JSON lines.", action="store_true")
+    parser.add_argument(
+        "--checkpoint-interval",
+        help="Number of rows between full states kept in memory.",
+        type=int,
+        default=DEFAULT_CHECKPOINT_INTERVAL,
+    )
+    args = parser.parse_args(argv)
+
+    queries = (
+        [["at", step] for step in args.at]
+        + [["diff", a, b] for a, b in args.diff]
+        + [["history", name] for name in args.history]
+    )
+    if not queries and (not args.input_file or args.input_file == "-"):
+        parser.error("interactive queries need -i FILE (stdin is used for the queries)")
+
+    state = load_trace_state(args.input_file, args.pml_file, args.checkpoint_interval)
+    if queries:
+        for query in queries:
+            print_result(run_query(state, query), args.json)
+        return
+
+    # 反例は一度だけ読み込み、標準入力から1行ずつ問い合わせを受け付ける
+    interactive = sys.stdin.isatty()
+    if interactive:
+        print(f"{len(state)} rows, {len(state.variables)} variables ({state.kind})")
+        print("Queries: at STEP | value VAR STEP | diff A B | history VAR [FIRST [LAST]] | quit")
+    while True:
+        if interactive:
+            print("> ", end="", flush=True)
+        line = sys.stdin.readline()
+        if not line:
+            break
+        query = shlex.split(line)
+        if not query:
+            continue
+        if query[0] in ("quit", "exit"):
+            break
+        try:
+            print_result(run_query(state, query), args.json)
+        except (ValueError, IndexError) as e:
+            print(f"error: {e}")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()